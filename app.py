@@ -1,33 +1,108 @@
-from queue import Queue
 from flask import Flask, request, render_template, jsonify, Response
-import requests
 import time
 import logging
 import json
+import os
+from typing import Any, Dict, Iterator, List
 from flask import stream_with_context
-from PyPDF2 import PdfReader
 
+from citation_graph import CitationGraph
 from config import Config
+from llm_scheduler import RequestContext
 from local_llm_helper import LocalLLM
+from metrics_helper import Trace, metrics, timed
+from pdf_helper import PDFIngestor, PDFIngestError
+from ranking_helper import EmbeddingRanker
+from resilience_helper import LLMUnavailableError
+from search_pipeline import SearchPipeline
 from semantic_scholar_helper import SemanticScholarAPI
+from status_helper import StatusBus
+from summary_worker import SummaryJobs, SummaryWorker
 
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Global status queue
-status_updates = Queue()
+LLM_UNAVAILABLE = "The language model is unavailable right now, please try again shortly."
+
+# Status updates are scoped to the browser session that asked for the work
+status_bus = StatusBus(Config.STATUS_BUFFER_SIZE, Config.STATUS_HEARTBEAT_INTERVAL, Config.STATUS_IDLE_TTL)
 
 
 app = Flask(__name__)
-semantic_scholar = SemanticScholarAPI(Config.SEMANTIC_API_KEY)
-llm = LocalLLM(Config.OLLAMA_API_URL, Config.OLLAMA_MODEL)
+
+# Built by create_app(), not on import: the PDF workers are spawned processes that re-import this module (as
+# __mp_main__ under `python app.py`), and each must not get its own LLM scheduler, backend pool and stores
+semantic_scholar: SemanticScholarAPI = None
+llm: LocalLLM = None
+pdf_ingestor: PDFIngestor = None
+ranker: EmbeddingRanker = None
+summary_worker: SummaryWorker = None
+citation_graph: CitationGraph = None
+
+
+def create_app() -> Flask:
+    """
+    Sets up the services the routes share (once per process) and returns the Flask app. Background work is
+    started separately by start_background_work(), only in the process that serves requests.
+    """
+    global semantic_scholar, llm, pdf_ingestor, ranker, summary_worker, citation_graph
+    if llm is not None:
+        return app
+    semantic_scholar = SemanticScholarAPI(Config.SEMANTIC_API_KEY)
+    llm = LocalLLM(Config.OLLAMA_API_URL, Config.OLLAMA_MODEL)
+    pdf_ingestor = PDFIngestor(Config.PDF_CACHE_PATH)
+    ranker = EmbeddingRanker(llm, semantic_scholar.store)
+    summary_worker = SummaryWorker(llm, semantic_scholar.store,
+                                   SummaryJobs(Config.SUMMARY_QUEUE_PATH, Config.SUMMARY_MAX_ATTEMPTS),
+                                   Config.SUMMARY_WORKERS)
+    citation_graph = CitationGraph(semantic_scholar, Config.EXPANSION_NEIGHBORS, Config.EXPANSION_RECOMMENDATIONS)
+    return app
+
+
+def start_background_work():
+    # The summary worker's LLM calls go through this process's scheduler, so only the serving process may run it
+    if Config.PRESUMMARIZE_ENABLED and not summary_worker.threads:
+        summary_worker.start()
+
+
+def stop_background_work():
+    summary_worker.stop()
+
+
+def live_metrics():
+    # State that lives in other objects, read when /metrics is scraped
+    samples = []
+    for name, stats in llm.scheduler.stats().items():
+        samples.append(("llm_queue_depth", "gauge", "LLM calls waiting for a slot.", {"priority": name},
+                        stats["queued"]))
+        samples.append(("llm_running", "gauge", "LLM calls holding a slot.", {"priority": name}, stats["running"]))
+    for backend in llm.pool.stats():
+        labels = {"backend": backend["backend"]}
+        samples.append(("ollama_backend_healthy", "gauge", "1 if the backend is in rotation.", labels,
+                        int(backend["healthy"])))
+        samples.append(("ollama_backend_outstanding", "gauge", "Calls in flight at the backend.", labels,
+                        backend["outstanding"]))
+    for policy in list(llm.retry.values()) + list(semantic_scholar.retry.values()):
+        samples.append(("circuit_open", "gauge", "1 while a dependency's circuit breaker is failing fast.",
+                        {"endpoint": policy.breaker.name}, int(policy.breaker.state == "open")))
+    for flights in (llm.flights, semantic_scholar.flights):
+        stats = flights.stats()
+        samples.append(("coalesced_calls_total", "counter", "Calls that waited for an identical call in flight.",
+                        {"name": stats["name"]}, stats["coalesced"]))
+    if Config.PRESUMMARIZE_ENABLED:
+        for state, count in summary_worker.jobs.counts(summary_worker.model).items():
+            samples.append(("summary_jobs", "gauge", "Background summary jobs by state.", {"state": state}, count))
+    return samples
+
+
+metrics.add_collector(live_metrics)
 
 
 @app.route("/", methods=["GET"])
 def index():
-    llm.reset()
+    # Each page load gets a fresh session id in the browser, so there is no shared state to reset here
     return render_template("index.html")
 
 
@@ -36,21 +111,65 @@ def chat():
     data = request.get_json()
     query = data.get("message", "").strip()
     chat_id = data.get("chat_id", None)
+    session_id = data.get("session_id")
 
     if not query:
         return jsonify({"error": "Message is required"}), 400
-    update_status('Thinking...')
-    response = llm.chat_about_research(query, chat_id)
-    if chat_id is None:
-        chat_id = list(response.keys())[0]
+    update_status('Thinking...', session_id, stage="chat")
+    try:
+        response = llm.chat_about_research(query, chat_id, session_id)
+    except LLMUnavailableError as e:
+        logger.error(f"Chat failed: {e}")
+        return jsonify({"error": LLM_UNAVAILABLE}), 503
     return jsonify({
-        "chat_id": response[chat_id]["chat_id"],
-        "most_recent_response": response[chat_id]["most_recent_response"],
-        "ready_to_search": response[chat_id]["ready_to_search"],
-        "summary": response[chat_id]["summary"]
+        "chat_id": response["chat_id"],
+        "most_recent_response": response["most_recent_response"],
+        "ready_to_search": response["ready_to_search"],
+        "summary": response["summary"]
     })
 
 
+@app.route("/chat_stream", methods=["POST"])
+def chat_stream():
+    data = request.get_json()
+    query = data.get("message", "").strip()
+    chat_id = data.get("chat_id", None)
+    session_id = data.get("session_id")
+
+    if not query:
+        return jsonify({"error": "Message is required"}), 400
+    update_status('Thinking...', session_id, stage="chat")
+    return Response(
+        stream_with_context(chat_stream_lines(query, chat_id, session_id, RequestContext(session_id))),
+        mimetype='application/x-ndjson'
+    )
+
+
+def chat_stream_lines(query: str, chat_id: str, session_id: str, ctx: RequestContext = None) -> Iterator[str]:
+    """
+    NDJSON lines for /chat_stream: a "token" event per piece of the reply, then "done" (or "error"). If the
+    client goes away first, ctx is cancelled.
+    """
+    try:
+        for kind, value in llm.chat_about_research_stream(query, chat_id, session_id, ctx):
+            if kind == "token":
+                yield json.dumps({"type": "token", "data": value}) + "\n"
+            else:
+                yield json.dumps({"type": "done", "data": {
+                    "chat_id": value["chat_id"],
+                    "most_recent_response": value["most_recent_response"],
+                    "ready_to_search": value["ready_to_search"],
+                    "summary": value["summary"]
+                }}) + "\n"
+    except LLMUnavailableError as e:
+        logger.error(f"Chat failed: {e}")
+        yield json.dumps({"type": "error", "data": LLM_UNAVAILABLE}) + "\n"
+    except GeneratorExit:
+        if ctx is not None:
+            ctx.cancel()
+        raise
+
+
 @app.route('/process-pdf', methods=['GET'])
 def process_pdf():
     pdf_url = request.args.get('url')
@@ -58,59 +177,51 @@ def process_pdf():
         return jsonify({'error': 'PDF URL is required'}), 400
 
     try:
-        # Download the PDF
-        response = requests.get(pdf_url)
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to download PDF'}), 400
-
-        # Save the PDF locally
-        pdf_path = '.temp_paper.pdf'
-        with open(pdf_path, 'wb') as f:
-            f.write(response.content)
-
-        # Extract text from the PDF
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-
+        # Streams the download to a per-request temp file, and reuses the text of PDFs we've already read
+        text = pdf_ingestor.ingest(pdf_url)
         if not text.strip():
             return jsonify({'error': 'No text found in the PDF'}), 400
+        if request.args.get('paper_id'):
+            # Papers without an abstract become findable in the local corpus by their text
+            semantic_scholar.store.add_pdf_text(request.args.get('paper_id'), text)
 
-        # Add the extracted text to the LLM context
-        chat_id = str(time.time())  # Generate a new chat ID
-        llm.chat_state[chat_id] = {
-            "chat_id": chat_id,
-            "paper_text": text,
-            "full_context": "",
-            "most_recent_response": "The paper's content has been loaded into the chat context.",
-            "started_chat": False
-        }
+        # Index the paper for retrieval; loading a paper into an existing paper chat adds it alongside the others
+        chat_id = llm.add_paper(request.args.get('title', 'Untitled'), text, request.args.get('chat_id'),
+                                request.args.get('session_id'))
 
         return jsonify({'message': 'PDF processed successfully', 'chat_id': chat_id})
 
+    except PDFIngestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
 
-def update_status(message: str):
-    status_updates.put(message)
+def update_status(message: str, session_id: str = None, **progress):
+    # progress: optional stage / done / total / started, see StatusBus.publish
+    status_bus.publish(session_id or "", message, **progress)
 
 
 @app.route("/status")
 def status():
-    def generate():
-        while True:
-            try:
-                # Check for new status every 0.1 seconds
-                message = status_updates.get(timeout=0.1)
-                yield f"data: {json.dumps({'status': message})}\n\n"
-            except:
-                # Send heartbeat to keep connection alive
-                yield f"data: {json.dumps({'heartbeat': True})}\n\n"
-            time.sleep(0.1)
+    session_id = request.args.get("session_id", "")
+    return Response(status_bus.subscribe(session_id), mimetype='text/event-stream')
+
+
+@app.route("/llm_queue")
+def llm_queue():
+    # Queue depth, running calls and wait times per LLM priority class, the load on each Ollama backend, and how
+    # many LLM and Semantic Scholar calls were coalesced into one already in flight, and the background summary
+    # jobs by state
+    return jsonify({"queues": llm.scheduler.stats(), "backends": llm.pool.stats(),
+                    "coalescing": [llm.flights.stats(), semantic_scholar.flights.stats()],
+                    "summary_jobs": summary_worker.jobs.counts(summary_worker.model)})
 
-    return Response(generate(), mimetype='text/event-stream')
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Prometheus text format: LLM calls, tokens and timings per caller, search stages, Semantic Scholar requests
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/generate_timeline", methods=["POST"])
@@ -121,7 +232,11 @@ def generate_timeline():
     if not papers:
         return jsonify({"error": "No papers provided"}), 400
 
-    timeline = llm.generate_timeline(papers)
+    try:
+        timeline = llm.generate_timeline(papers)
+    except LLMUnavailableError as e:
+        logger.error(f"Timeline failed: {e}")
+        return jsonify({"error": LLM_UNAVAILABLE}), 503
     return jsonify({"timeline": timeline})
 
 
@@ -133,131 +248,130 @@ def generate_future_work():
     if not papers:
         return jsonify({"error": "No papers provided"}), 400
 
-    future_work = llm.generate_future_work(papers, cutoff=Config.RELEVANT_PAPERS_FOR_FUTURE_WORK)
+    try:
+        future_work = llm.generate_future_work(papers, cutoff=Config.RELEVANT_PAPERS_FOR_FUTURE_WORK)
+    except LLMUnavailableError as e:
+        logger.error(f"Future work failed: {e}")
+        return jsonify({"error": LLM_UNAVAILABLE}), 503
     return jsonify({"future_work": future_work})
 
 
+def generation_lines(events, result_key: str, ctx: RequestContext = None) -> Iterator[str]:
+    """
+    Forwards ("token", text) / ("done", text) events as NDJSON lines: {"type": "token", "data": text} for
+    each piece, then {"type": "done", "data": {result_key: text}}, or {"type": "error", "data": message} if
+    the LLM is unavailable. If the client goes away first, ctx is cancelled so the LLM calls still queued for
+    the report are dropped.
+    """
+    try:
+        for kind, value in events:
+            if kind == "token":
+                yield json.dumps({"type": "token", "data": value}) + "\n"
+            else:
+                yield json.dumps({"type": "done", "data": {result_key: value}}) + "\n"
+    except LLMUnavailableError as e:
+        logger.error(f"Generating {result_key} failed: {e}")
+        yield json.dumps({"type": "error", "data": LLM_UNAVAILABLE}) + "\n"
+    except GeneratorExit:
+        if ctx is not None:
+            ctx.cancel()
+        raise
+
+
+def stream_generation(events, result_key: str, ctx: RequestContext = None) -> Response:
+    return Response(
+        stream_with_context(generation_lines(events, result_key, ctx)),
+        mimetype='application/x-ndjson'
+    )
+
+
+@app.route("/generate_timeline_stream", methods=["POST"])
+def generate_timeline_stream():
+    data = request.get_json()
+    papers = data.get("papers", [])
+
+    if not papers:
+        return jsonify({"error": "No papers provided"}), 400
+
+    ctx = RequestContext(data.get("session_id"))
+    return stream_generation(llm.generate_timeline_stream(papers, ctx=ctx), "timeline", ctx)
+
+
+@app.route("/generate_future_work_stream", methods=["POST"])
+def generate_future_work_stream():
+    data = request.get_json()
+    papers = data.get("papers", [])
+
+    if not papers:
+        return jsonify({"error": "No papers provided"}), 400
+
+    ctx = RequestContext(data.get("session_id"))
+    events = llm.generate_future_work_stream(papers, cutoff=Config.RELEVANT_PAPERS_FOR_FUTURE_WORK, ctx=ctx)
+    return stream_generation(events, "future_work", ctx)
+
+
+def start_search(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Reads a /stream_search request body into the settings the search steps below share."""
+    session_id = data.get("session_id")
+    # Mark this session as having searched so that its chats are now just chats
+    llm.mark_searched(session_id)
+    # Opt-in: end the stream with a {"type": "trace"} event showing where the time went
+    trace = Trace() if data.get("trace", False) else None
+    return {
+        "query": data.get("query", "").strip(),
+        "year_filter": data.get("year_filter", Config.DEFAULT_YEAR_FILTER),
+        # Opt-in: also send summary_token events while LLM summaries are being written
+        "stream_tokens": data.get("stream_tokens", False),
+        "session_id": session_id,
+        "trace": trace,
+        # Cancelled if the client goes away while the query is being rephrased
+        "ctx": RequestContext(session_id, trace=trace),
+        "started": time.time(),
+    }
+
+
+def refine_search_query(search: Dict[str, Any]) -> List[str]:
+    """Step 1: rephrase the query. Blocks on the LLM."""
+    update_status("Refining search query...", search["session_id"], stage="refine", started=search["started"])
+    try:
+        with timed("refine", search["trace"]):
+            refined_query_list = llm.rephrase_query(search["query"], search["session_id"], search["ctx"])
+    except LLMUnavailableError as e:
+        # Searching for the query as typed still works without the LLM
+        logger.error(f"Query rephrasing failed: {e}")
+        refined_query_list = []
+    return refined_query_list or [search["query"]]
+
+
+def search_pipeline(search: Dict[str, Any], refined_query_list: List[str]) -> SearchPipeline:
+    # Steps 2-4: search, relevance scoring and summarization run as overlapping pipeline stages, so the first
+    # summaries stream back while later pages are still being searched and scored
+    def status(message, **progress):
+        update_status(message, search["session_id"], started=search["started"], **progress)
+
+    return SearchPipeline(llm, semantic_scholar, ranker, search["query"], refined_query_list, search["year_filter"],
+                          stream_tokens=search["stream_tokens"], status=status, session_id=search["session_id"],
+                          trace=search["trace"], summaries=summary_worker if Config.PRESUMMARIZE_ENABLED else None,
+                          graph=citation_graph if Config.EXPANSION_ENABLED else None)
+
+
+def finish_search(search: Dict[str, Any]) -> Iterator[str]:
+    metrics.observe("search_stage_seconds", time.time() - search["started"], stage="total")
+    update_status("Done!", search["session_id"], stage="done", started=search["started"])
+    if search["trace"] is not None:
+        yield json.dumps({"type": "trace", "data": search["trace"].as_dict()}) + "\n"
+
+
 @app.route("/stream_search", methods=["POST"])
 def stream_search():
-    # Mark us as having searched so that chats are now just chats
-    llm.searched_already = True
+    search = start_search(request.get_json())
 
     def generate():
-        data = request.get_json()
-        query = data.get("query", "").strip()
-        year_filter = data.get("year_filter", Config.DEFAULT_YEAR_FILTER)
-
-        # Step 1: Rephrase query
-        update_status("Refining search query...")
-        refined_query_list = llm.rephrase_query(query)
-        if not refined_query_list:
-            refined_query_list = [query]
-
+        refined_query_list = refine_search_query(search)
         yield json.dumps({"type": "refined_query", "data": refined_query_list}) + "\n"
-
-        # Step 2: Search papers
-        update_status("Searching for relevant papers...")
-        papers = []
-        seen_paper_ids = set()  # Track unique papers
-
-        for refined_query in refined_query_list:
-            batch = semantic_scholar.search_papers(refined_query, year_filter)
-            # Stream each batch of papers immediately
-            papers_back = []
-            for p in batch:
-                if p.get("paperId") not in seen_paper_ids:
-                    papers.append(p)
-                    seen_paper_ids.add(p.get("paperId"))
-                    open_pdf = p.get("openAccessPdf", None)
-                    open_pdf_url = ''
-                    if open_pdf is not None:
-                        open_pdf_url = open_pdf.get('url')
-                    papers_back.append({
-                        "title": p.get("title", "Untitled"),
-                        "url": p.get("url"),
-                        "publication_date": p.get("publicationDate"),
-                        "citation_count": p.get("citationCount", 0),
-                        "authors": [a.get("name", "") for a in p.get("authors", [])],
-                        "pdf_url": open_pdf_url,
-                        "paper_id": p.get("paperId"),
-                        "abstract": p.get("abstract", "")
-                    })
-            if papers_back:
-                yield json.dumps({
-                    "type": "papers",
-                    "data": papers_back
-                }) + "\n"
-
-        # Step 3: Rank papers for relevance to the original query
-        paper_relevance_scores = {}
-        update_status("Rating paper relevance...")
-        for paper in papers:
-            paper_id = paper.get("paperId")
-            try:
-                relevance = llm.rate_paper_relevance(query, paper)
-                paper_relevance_scores[paper_id] = relevance
-                yield json.dumps({
-                    "type": "relevance",
-                    "data": {"paper_id": paper_id, "relevance": relevance}
-                }) + "\n"
-            except Exception as e:
-                paper_relevance_scores[paper_id] = 0
-                logger.error(f"Error rating paper {paper_id}: {e}")
-
-        # Identify all papers that have a `tldr` `text` that is not Null,
-        # and send them back immediately with the TLDR as the summary
-        update_status("Summarizing the most relevant papers...")
-        sorted_papers = sorted(
-            papers,
-            key=lambda p_id: paper_relevance_scores.get(p_id.get("paperId"), 0),
-            reverse=True
-        )
-        papers_needing_summary = []
-        for paper in sorted_papers:
-            paper_id = paper.get("paperId")
-            tldr = paper.get("tldr", {})
-            if tldr:
-                tldr = tldr.get("text")
-                if tldr:
-                    yield json.dumps({
-                        "type": "summary",
-                        "data": {
-                            "paper_id": paper_id,
-                            "summary": tldr
-                        }
-                    }) + "\n"
-                elif paper.get("abstract"):
-                    # Does not have a TLDR but has an abstract
-                    papers_needing_summary.append(paper)
-                else:
-                    # Paper has no TLDR and no abstract
-                    yield json.dumps({
-                        "type": "summary",
-                        "data": {
-                            "paper_id": paper_id,
-                            "summary": 'No summary available.'
-                        }
-                    }) + "\n"
-
-        # Send the rest of the papers
-        unsummarized = []
-        for paper in papers_needing_summary:
-            paper_id = paper.get("paperId")
-            try:
-                summary = llm.summarize_paper(query, paper)
-                yield json.dumps({
-                    "type": "summary",
-                    "data": {"paper_id": paper_id, "summary": summary}
-                }) + "\n"
-            except Exception as e:
-                unsummarized.append(paper)
-                logger.error(f"Error summarizing paper {paper_id}: {e}")
-        for paper in unsummarized:
-            paper_id = paper.get("paperId")
-            yield json.dumps({
-                "type": "summary",
-                "data": {"paper_id": paper_id, "summary": "No summary available."}
-            }) + "\n"
+        for event in search_pipeline(search, refined_query_list).run():
+            yield json.dumps(event) + "\n"
+        yield from finish_search(search)
 
     return Response(
         stream_with_context(generate()),
@@ -266,4 +380,8 @@ def stream_search():
 
 
 if __name__ == "__main__":
+    create_app()
+    # With debug on, this module also runs in the reloader's file-watching process, which serves nothing
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_work()
     app.run(debug=True)
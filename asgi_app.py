@@ -0,0 +1,211 @@
+"""
+Asyncio (ASGI) entry point, for deployments that hold many long-lived streams open:
+
+    uvicorn asgi_app:app --port 5000
+
+The streaming routes (/status, /stream_search, /chat_stream and the /generate_*_stream routes) are served on the
+event loop, so an idle /status feed doesn't hold a thread. A client disconnecting cancels its search, chat or
+report, which drops the LLM calls still queued for it. The work itself still runs on threads: a search holds its
+pipeline's threads (one for Semantic Scholar plus LLM_WORKERS) until it finishes, and a chat or report holds one
+while it generates. Every other route is passed to the Flask app, which runs on a small thread pool. Responses
+are the same as under `python app.py`.
+"""
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+import app as services
+from app import (chat_stream_lines, create_app, finish_search, generation_lines, refine_search_query, search_pipeline,
+                 start_background_work, start_search, status_bus, stop_background_work, update_status)
+from config import Config
+from llm_scheduler import RequestContext
+
+logger = logging.getLogger(__name__)
+
+NDJSON = [(b"content-type", b"application/x-ndjson")]
+EVENT_STREAM = [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]
+
+_END = object()
+
+wsgi = WSGIMiddleware(create_app(), workers=Config.ASGI_WSGI_WORKERS)
+
+
+async def read_json(receive: Callable[[], Awaitable[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def send_json(send, status: int, payload: Dict[str, Any]):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+
+async def stream(receive, send, lines: AsyncIterator[str], headers=NDJSON, on_disconnect: Callable[[], None] = None):
+    """
+    Sends each line as it's produced. If the client disconnects first, the task consuming `lines` is cancelled,
+    which runs the cleanup in its finally blocks (cancelling the search, unsubscribing from /status).
+    """
+    async def forward():
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        async for line in lines:
+            await send({"type": "http.response.body", "body": line.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    sender, watcher = asyncio.ensure_future(forward()), asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait([sender, watcher], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if not sender.done():
+            if on_disconnect is not None:
+                on_disconnect()
+            sender.cancel()
+        watcher.cancel()
+        await asyncio.gather(sender, watcher, return_exceptions=True)
+    if sender.done() and not sender.cancelled() and sender.exception() is not None:
+        logger.error(f"Stream failed: {sender.exception()}")
+
+
+async def iterate_in_thread(iterable: Iterable[str]) -> AsyncIterator[str]:
+    """
+    Runs a blocking generator on its own thread and hands its items to the event loop. Used for LLM token streams,
+    which keep the thread busy generating; if the client goes away the generator is closed after its next item.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stop = threading.Event()
+
+    def post(item):
+        try:
+            loop.call_soon_threadsafe(items.put_nowait, item)
+        except RuntimeError:
+            # The event loop has shut down
+            stop.set()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    break
+                post(item)
+        except Exception as e:
+            logger.exception(f"Stream failed: {e}")
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+            post(_END)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = await items.get()
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+async def status(scope, receive, send):
+    session_id = parse_qs(scope.get("query_string", b"").decode()).get("session_id", [""])[0]
+    await stream(receive, send, status_bus.asubscribe(session_id), headers=EVENT_STREAM)
+
+
+async def stream_search(scope, receive, send):
+    data = await read_json(receive)
+    if data is None:
+        return await send_json(send, 400, {"error": "Invalid JSON body"})
+    search = start_search(data)
+
+    async def lines():
+        refined_query_list = await asyncio.get_running_loop().run_in_executor(None, refine_search_query, search)
+        yield json.dumps({"type": "refined_query", "data": refined_query_list}) + "\n"
+        async for event in search_pipeline(search, refined_query_list).arun():
+            yield json.dumps(event) + "\n"
+        for line in finish_search(search):
+            yield line
+
+    await stream(receive, send, lines(), on_disconnect=search["ctx"].cancel)
+
+
+async def chat_stream(scope, receive, send):
+    data = await read_json(receive)
+    if data is None:
+        return await send_json(send, 400, {"error": "Invalid JSON body"})
+    query = data.get("message", "").strip()
+    if not query:
+        return await send_json(send, 400, {"error": "Message is required"})
+    session_id = data.get("session_id")
+    update_status('Thinking...', session_id, stage="chat")
+    ctx = RequestContext(session_id)
+    lines = chat_stream_lines(query, data.get("chat_id"), session_id, ctx)
+    await stream(receive, send, iterate_in_thread(lines), on_disconnect=ctx.cancel)
+
+
+def generation_stream(start_events: Callable[[list, RequestContext], Iterable], result_key: str):
+    async def handler(scope, receive, send):
+        data = await read_json(receive)
+        if data is None:
+            return await send_json(send, 400, {"error": "Invalid JSON body"})
+        papers = data.get("papers", [])
+        if not papers:
+            return await send_json(send, 400, {"error": "No papers provided"})
+        ctx = RequestContext(data.get("session_id"))
+        lines = generation_lines(start_events(papers, ctx), result_key, ctx)
+        await stream(receive, send, iterate_in_thread(lines), on_disconnect=ctx.cancel)
+    return handler
+
+
+STREAMING_ROUTES = {
+    ("GET", "/status"): status,
+    ("POST", "/stream_search"): stream_search,
+    ("POST", "/chat_stream"): chat_stream,
+    ("POST", "/generate_timeline_stream"): generation_stream(
+        lambda papers, ctx: services.llm.generate_timeline_stream(papers, ctx=ctx), "timeline"),
+    ("POST", "/generate_future_work_stream"): generation_stream(
+        lambda papers, ctx: services.llm.generate_future_work_stream(
+            papers, cutoff=Config.RELEVANT_PAPERS_FOR_FUTURE_WORK, ctx=ctx),
+        "future_work"),
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            start_background_work()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            stop_background_work()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http":
+        handler = STREAMING_ROUTES.get((scope["method"], scope["path"]))
+        if handler is not None:
+            return await handler(scope, receive, send)
+    await wsgi(scope, receive, send)
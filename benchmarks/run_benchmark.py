@@ -0,0 +1,291 @@
+"""
+End-to-end benchmark: drives /stream_search with several simulated users against the stub servers and reports
+latency percentiles, LLM and Semantic Scholar calls per search, and peak memory.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmark --users 4 --searches 3 --output bench.json
+    python -m benchmarks.run_benchmark --users 4 --searches 3 --baseline bench.json
+
+The stubs run in a child process, so peak RSS is the app's (plus this script's small client threads). The app
+is served by werkzeug's threaded server, the same way `flask run` serves it, or with --server uvicorn by the
+ASGI entry point (asgi_app), with every cache and store in a temporary directory. The LLM cache is off unless --llm-cache is given, so runs measure real work.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import requests
+
+from benchmarks.stub_servers import add_arguments
+
+QUERIES = [
+    "graph neural networks for molecule property prediction",
+    "preference learning for autonomous driving style",
+    "retrieval augmented generation evaluation",
+    "diffusion models for protein structure",
+    "federated learning under label noise",
+    "sparse mixture of experts language models",
+    "reinforcement learning from human feedback",
+    "self-supervised speech representation learning",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout:.0f}s")
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "max": None, "count": 0}
+    return {
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p95": round(float(np.percentile(values, 95)), 4),
+        "max": round(max(values), 4),
+        "count": len(values),
+    }
+
+
+def configure(args: argparse.Namespace, workdir: str, ollama_url: str, semantic_url: str):
+    """Points the app at the stubs and keeps everything it writes inside workdir. Must run before importing app."""
+    from config import Config
+    Config.OLLAMA_API_URL = f"{ollama_url}/api/generate"
+    Config.OLLAMA_CHAT_URL = f"{ollama_url}/api/chat"
+    Config.OLLAMA_EMBED_URL = f"{ollama_url}/api/embed"
+    Config.OLLAMA_BACKENDS = ""
+    Config.LLM_MAX_CONCURRENT = args.llm_slots
+    Config.LLM_WORKERS = args.llm_slots
+    Config.SEMANTIC_API_URL = semantic_url
+    Config.SEMANTIC_API_KEY = ""
+    Config.SEMANTIC_RATE_ANON = args.semantic_rate
+    Config.SEMANTIC_RATE_BURST = max(1.0, args.semantic_rate)
+    Config.MAX_PAGES = args.max_pages
+    Config.LLM_CACHE_ENABLED = args.llm_cache
+    Config.LLM_CACHE_PATH = os.path.join(workdir, "llm_cache.sqlite3")
+    Config.PAPER_STORE_PATH = os.path.join(workdir, "papers.sqlite3")
+    Config.PDF_CACHE_PATH = os.path.join(workdir, "pdfs.sqlite3")
+    Config.SESSION_SPILL_PATH = os.path.join(workdir, "sessions.sqlite3")
+    Config.SUMMARY_QUEUE_PATH = os.path.join(workdir, "summary_jobs.sqlite3")
+
+
+def run_search(base_url: str, query: str, session_id: str, stream_tokens: bool) -> Dict[str, Any]:
+    """One /stream_search request, timed from the moment it is sent."""
+    result = {"query": query, "session_id": session_id, "events": {}, "error": None,
+              "first_event": None, "last_summary": None, "total": None}
+    started = time.perf_counter()
+    try:
+        with requests.post(f"{base_url}/stream_search", stream=True, timeout=600,
+                           json={"query": query, "session_id": session_id, "stream_tokens": stream_tokens}) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                elapsed = time.perf_counter() - started
+                event = json.loads(line)
+                kind = event.get("type")
+                if result["first_event"] is None:
+                    result["first_event"] = elapsed
+                if kind == "summary":
+                    result["last_summary"] = elapsed
+                if kind == "error":
+                    result["error"] = event.get("data")
+                result["events"][kind] = result["events"].get(kind, 0) + 1
+    except (requests.exceptions.RequestException, ValueError) as e:
+        result["error"] = str(e)
+    result["total"] = time.perf_counter() - started
+    return result
+
+
+def run_load(args: argparse.Namespace, base_url: str) -> List[Dict[str, Any]]:
+    """Each user runs its searches back to back; users start together (staggered by --stagger seconds)."""
+    results = []
+    lock = threading.Lock()
+
+    def user(index: int):
+        time.sleep(index * args.stagger)
+        for n in range(args.searches):
+            # With --shared-queries every user asks the same things, which exercises caching and coalescing
+            offset = n if args.shared_queries else index * args.searches + n
+            query = QUERIES[offset % len(QUERIES)]
+            if offset >= len(QUERIES):
+                query = f"{query} {offset // len(QUERIES)}"
+            result = run_search(base_url, query, f"bench-user-{index}", args.stream_tokens)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def stub_stats(url: str) -> Dict[str, int]:
+    return requests.get(f"{url}/stats", timeout=10).json()
+
+
+def summarize(args: argparse.Namespace, results: List[Dict[str, Any]], wall: float, ollama: Dict[str, int],
+              semantic: Dict[str, int]) -> Dict[str, Any]:
+    searches = len(results)
+    ok = [r for r in results if not r["error"]]
+
+    def per_search(counters: Dict[str, int]) -> Dict[str, float]:
+        return {name: round(count / searches, 2) for name, count in sorted(counters.items())} if searches else {}
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+    return {
+        "searches": searches,
+        "errors": searches - len(ok),
+        "wall_seconds": round(wall, 3),
+        "searches_per_minute": round(60 * searches / wall, 2) if wall else None,
+        "time_to_first_event": percentiles([r["first_event"] for r in ok if r["first_event"] is not None]),
+        "time_to_last_summary": percentiles([r["last_summary"] for r in ok if r["last_summary"] is not None]),
+        "search_duration": percentiles([r["total"] for r in ok]),
+        "llm_calls_per_search": per_search(ollama),
+        "semantic_scholar_calls_per_search": per_search(semantic),
+        "events_per_search": per_search({kind: sum(r["events"].get(kind, 0) for r in results)
+                                         for kind in {k for r in results for k in r["events"]}}),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
+
+
+def compare(report: Dict[str, Any], baseline_path: str):
+    """Prints how the headline numbers moved against an earlier report."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    results = report["results"]
+    rows = [
+        ("time_to_first_event p50", ("time_to_first_event", "p50")),
+        ("time_to_first_event p95", ("time_to_first_event", "p95")),
+        ("time_to_last_summary p50", ("time_to_last_summary", "p50")),
+        ("time_to_last_summary p95", ("time_to_last_summary", "p95")),
+        ("llm generate calls/search", ("llm_calls_per_search", "generate")),
+        ("peak_rss_mb", ("peak_rss_mb",)),
+    ]
+    print(f"\n{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for label, path in rows:
+        old, new = baseline, results
+        for key in path:
+            old = old.get(key) if isinstance(old, dict) else None
+            new = new.get(key) if isinstance(new, dict) else None
+        change = f"{100 * (new - old) / old:+.1f}%" if old and new is not None else "n/a"
+        print(f"{label:<28}{old if old is not None else '-':>12}{new if new is not None else '-':>12}{change:>10}")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /stream_search against stub Ollama and Semantic Scholar.")
+    parser.add_argument("--users", type=int, default=4, help="simulated users searching at the same time")
+    parser.add_argument("--searches", type=int, default=2, help="searches per user, one after another")
+    parser.add_argument("--stagger", type=float, default=0.0, help="seconds between users starting")
+    parser.add_argument("--shared-queries", action="store_true", help="every user runs the same queries")
+    parser.add_argument("--stream-tokens", action="store_true", help="ask for summary_token events")
+    parser.add_argument("--max-pages", type=int, default=1, help="Config.MAX_PAGES for the run")
+    parser.add_argument("--semantic-rate", type=float, default=50.0,
+                        help="Semantic Scholar requests/second allowed by the app's rate limiter")
+    parser.add_argument("--llm-cache", action="store_true", help="leave the LLM cache on")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--server", choices=["werkzeug", "uvicorn"], default="werkzeug",
+                        help="serve the Flask app threaded, or asgi_app with uvicorn")
+    parser.add_argument("--verbose", action="store_true", help="show the app's logs")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    ollama_port, semantic_port, app_port = free_port(), free_port(), free_port()
+    stub_args = [sys.executable, "-m", "benchmarks.stub_servers",
+                 "--ollama-port", str(ollama_port), "--semantic-port", str(semantic_port)]
+    stub_parser = argparse.ArgumentParser()
+    add_arguments(stub_parser)
+    for action in stub_parser._actions:
+        if action.dest != "help":
+            stub_args += [action.option_strings[0], str(getattr(args, action.dest))]
+    stubs = subprocess.Popen(stub_args, stdout=subprocess.DEVNULL)
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    server = None
+    try:
+        wait_for_port(ollama_port)
+        wait_for_port(semantic_port)
+        ollama_url, semantic_url = f"http://127.0.0.1:{ollama_port}", f"http://127.0.0.1:{semantic_port}"
+        configure(args, workdir, ollama_url, semantic_url)
+        if not args.verbose:
+            logging.disable(logging.WARNING)
+        if args.server == "uvicorn":
+            import uvicorn
+            asgi = importlib.import_module("asgi_app")
+            server = uvicorn.Server(uvicorn.Config(asgi.app, host="127.0.0.1", port=app_port, log_level="warning"))
+            threading.Thread(target=server.run, daemon=True).start()
+            wait_for_port(app_port)
+        else:
+            from werkzeug.serving import make_server
+            web = importlib.import_module("app")
+            server = make_server("127.0.0.1", app_port, web.create_app(), threaded=True)
+            web.start_background_work()
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        started = time.perf_counter()
+        results = run_load(args, f"http://127.0.0.1:{app_port}")
+        wall = time.perf_counter() - started
+        report = {
+            "benchmark": "stream_search",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "settings": vars(args),
+            "results": summarize(args, results, wall, stub_stats(ollama_url), stub_stats(semantic_url)),
+            "errors": sorted({str(r["error"]) for r in results if r["error"]}),
+        }
+    finally:
+        if args.server == "uvicorn" and server is not None:
+            server.should_exit = True
+        elif server is not None:
+            server.shutdown()
+        stubs.terminate()
+        stubs.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report["results"], indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Stand-in Ollama and Semantic Scholar servers for benchmarking without GPUs, network access or rate limits.
+
+The Ollama stub answers /api/generate, /api/chat, /api/embed and /api/tags with canned replies shaped like the
+prompts LocalLLM sends (rephrased queries, relevance scores, summaries). It simulates a prompt delay plus a
+per-token delay, only works on `slots` requests at once (like OLLAMA_NUM_PARALLEL), and can fail a fraction of
+requests with a 500.
+
+The Semantic Scholar stub serves /graph/v1/paper/search, /graph/v1/paper/batch, /graph/v1/paper/{id}/references,
+/graph/v1/paper/{id}/citations and /recommendations/v1/papers from a generated corpus and citation graph. Each
+query maps to a fixed, seeded sample of that corpus, so runs are repeatable and refined queries overlap the way
+real ones do. A fraction of requests can be answered with 429 + Retry-After.
+
+Both count their requests: GET /stats returns the counters and POST /reset clears them.
+
+Run standalone with:
+    python -m benchmarks.stub_servers --ollama-port 11500 --semantic-port 11501
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+WORDS = ("learning model graph network data method results approach performance training neural task "
+         "evaluation robust efficient representation benchmark analysis framework inference").split()
+
+
+def seeded(*parts: Any) -> random.Random:
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Set on the subclass made by each server
+    settings: Dict[str, Any] = {}
+    counters: Counter = None
+    lock: threading.Lock = None
+    rng: random.Random = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def chance(self, probability: float) -> bool:
+        with self.lock:
+            return self.rng.random() < probability
+
+    def read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, body: Any, code: int = 200, headers: Dict[str, str] = None):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_stats(self) -> bool:
+        if self.path == "/stats":
+            with self.lock:
+                self.send_json(dict(self.counters))
+            return True
+        if self.path == "/reset":
+            with self.lock:
+                self.counters.clear()
+            self.send_json({})
+            return True
+        return False
+
+
+class OllamaHandler(StubHandler):
+
+    def do_GET(self):
+        if self.handle_stats():
+            return
+        if self.path == "/api/tags":
+            self.send_json({"models": [{"name": "stub"}]})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.handle_stats():
+            return
+        body = self.read_json()
+        endpoint = self.path.rsplit("/", 1)[-1]
+        if endpoint not in ("generate", "chat", "embed"):
+            self.send_json({"error": "not found"}, 404)
+            return
+        self.count(endpoint)
+        with self.settings["slots_semaphore"]:
+            if self.chance(self.settings["failure_rate"]):
+                self.count(f"{endpoint}_failed")
+                self.send_json({"error": "injected failure"}, 500)
+                return
+            if endpoint == "embed":
+                time.sleep(self.settings["prompt_latency"])
+                self.send_json({"embeddings": [self.embedding(text) for text in body.get("input", [])]})
+                return
+            if endpoint == "generate":
+                reply = self.generate_reply(body.get("prompt", ""), body.get("format"))
+            else:
+                reply = "Could you tell me a bit more about what you are looking for?"
+            self.reply(endpoint, reply, bool(body.get("stream")))
+
+    def reply(self, endpoint: str, text: str, stream: bool):
+        tokens = [word + " " for word in text.split(" ")]
+        token_latency = self.settings["token_latency"]
+        time.sleep(self.settings["prompt_latency"])
+        # Durations are in nanoseconds, like Ollama's
+        stats = {"done": True, "prompt_eval_count": 200, "eval_count": len(tokens),
+                 "prompt_eval_duration": int(self.settings["prompt_latency"] * 1e9),
+                 "eval_duration": int(token_latency * len(tokens) * 1e9)}
+
+        def piece(token: str) -> Dict[str, Any]:
+            if endpoint == "chat":
+                return {"message": {"role": "assistant", "content": token}, "done": False}
+            return {"response": token, "done": False}
+
+        if not stream:
+            time.sleep(token_latency * len(tokens))
+            body = piece(text)
+            body.update(stats)
+            self.send_json(body)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(token_latency)
+                self.write_chunk(json.dumps(piece(token)) + "\n")
+            self.write_chunk(json.dumps(dict(piece(""), **stats)) + "\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the stream, just like a cancelled search
+            self.count(f"{endpoint}_aborted")
+
+    def write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def generate_reply(self, prompt: str, fmt: Optional[str]) -> str:
+        if fmt == "json":
+            # Batched relevance: {"1": score, ...} for every "[n] Title:" in the prompt
+            keys = [line[1:line.index("]")] for line in prompt.splitlines() if line.startswith("[") and "] Title:" in line]
+            return json.dumps({key: seeded(prompt, key).randint(0, 100) for key in keys})
+        if "Return only the numerical score" in prompt:
+            return str(seeded(prompt).randint(0, 100))
+        if "Rephrase the following query" in prompt:
+            query = prompt.rsplit('Query: "', 1)[-1].split('"', 1)[0]
+            return (f"The researcher wants papers about {query}. Rephrased query: [{query}] "
+                    f"[{query} methods] [{query} survey]")
+        rng = seeded(prompt)
+        return " ".join(rng.choice(WORDS) for _ in range(self.settings["reply_tokens"])) + "."
+
+    @staticmethod
+    def embedding(text: str, dims: int = 64) -> List[float]:
+        vector = [0.0] * dims
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dims] += 1.0
+        return vector
+
+
+class SemanticScholarHandler(StubHandler):
+
+    def paper(self, index: int) -> Dict[str, Any]:
+        rng = seeded("paper", index)
+        year = rng.randint(2000, 2025)
+        return {
+            "paperId": f"{index:040x}",
+            "title": " ".join(rng.choice(WORDS) for _ in range(6)).capitalize(),
+            "url": f"https://www.semanticscholar.org/paper/{index:040x}",
+            "abstract": None if index % 7 == 0 else " ".join(rng.choice(WORDS) for _ in range(120)),
+            "publicationTypes": ["JournalArticle"],
+            "publicationDate": f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "openAccessPdf": None,
+            "citationCount": rng.randint(0, 2000),
+            "authors": [{"name": f"Author {rng.randint(1, 500)}"} for _ in range(rng.randint(1, 8))],
+            "tldr": {"text": "A short machine-written summary."} if index % 2 else None,
+        }
+
+    @staticmethod
+    def select(paper: Dict[str, Any], fields: Optional[str]) -> Dict[str, Any]:
+        if not fields:
+            return {"paperId": paper["paperId"], "title": paper["title"]}
+        wanted = set(fields.split(",")) | {"paperId"}
+        return {key: value for key, value in paper.items() if key in wanted}
+
+    def query_results(self, query: str) -> List[int]:
+        corpus_size = self.settings["corpus_size"]
+        count = min(self.settings["results_per_query"], corpus_size)
+        return seeded("query", query.lower()).sample(range(corpus_size), count)
+
+    def references(self, index: int) -> List[int]:
+        corpus_size = self.settings["corpus_size"]
+        count = min(self.settings["references_per_paper"], corpus_size - 1)
+        picks = seeded("references", index).sample(range(corpus_size), count + 1)
+        return [i for i in picks if i != index][:count]
+
+    def citations(self, index: int) -> List[int]:
+        # Built on first use: who cites a paper follows from every paper's references
+        with self.lock:
+            cited_by = self.settings.get("cited_by")
+            if cited_by is None:
+                cited_by = self.settings["cited_by"] = {}
+                for citing in range(self.settings["corpus_size"]):
+                    for cited in self.references(citing):
+                        cited_by.setdefault(cited, []).append(citing)
+        return cited_by.get(index, [])
+
+    def send_neighbors(self, paper_id: str, direction: str, params: Dict[str, str]):
+        self.count(direction)
+        if self.rate_limited():
+            return
+        time.sleep(self.settings["latency"])
+        try:
+            index = int(paper_id, 16)
+        except ValueError:
+            index = -1
+        if not 0 <= index < self.settings["corpus_size"]:
+            self.send_json({"error": "Paper not found"}, 404)
+            return
+        neighbors = self.references(index) if direction == "references" else self.citations(index)
+        key = "citedPaper" if direction == "references" else "citingPaper"
+        offset, limit = int(params.get("offset", 0)), int(params.get("limit", 100))
+        body = {"offset": offset, "data": [{key: self.select(self.paper(i), params.get("fields"))}
+                                           for i in neighbors[offset:offset + limit]]}
+        if offset + limit < len(neighbors):
+            body["next"] = offset + limit
+        self.send_json(body)
+
+    def rate_limited(self) -> bool:
+        if self.chance(self.settings["rate_limit_rate"]):
+            self.count("rate_limited")
+            self.send_json({"message": "Too Many Requests"}, 429, {"Retry-After": str(self.settings["retry_after"])})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.handle_stats():
+            return
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.split("/")
+        if len(parts) == 6 and url.path.startswith("/graph/v1/paper/") and parts[5] in ("references", "citations"):
+            self.send_neighbors(parts[4], parts[5], params)
+            return
+        if url.path != "/graph/v1/paper/search":
+            self.send_json({"error": "not found"}, 404)
+            return
+        self.count("search")
+        if self.rate_limited():
+            return
+        time.sleep(self.settings["latency"])
+        results = self.query_results(params.get("query", ""))
+        offset, limit = int(params.get("offset", 0)), int(params.get("limit", 100))
+        page = [self.select(self.paper(i), params.get("fields")) for i in results[offset:offset + limit]]
+        body = {"total": len(results), "offset": offset, "data": page}
+        if offset + limit < len(results):
+            body["next"] = offset + limit
+        self.send_json(body)
+
+    def do_POST(self):
+        if self.handle_stats():
+            return
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.read_json()
+        if url.path == "/graph/v1/paper/batch":
+            self.count("batch")
+            if self.rate_limited():
+                return
+            time.sleep(self.settings["latency"])
+            papers = []
+            for paper_id in body.get("ids", []):
+                try:
+                    index = int(paper_id, 16)
+                except ValueError:
+                    index = -1
+                known = 0 <= index < self.settings["corpus_size"]
+                papers.append(self.select(self.paper(index), params.get("fields")) if known else None)
+            self.send_json(papers)
+        elif url.path.startswith("/recommendations/v1/papers"):
+            self.count("recommendations")
+            if self.rate_limited():
+                return
+            time.sleep(self.settings["latency"])
+            seeds = ",".join(sorted(body.get("positivePaperIds", [])))
+            limit = min(int(params.get("limit", 100)), self.settings["corpus_size"])
+            picks = seeded("recommendations", seeds).sample(range(self.settings["corpus_size"]), limit)
+            self.send_json({"recommendedPapers": [self.select(self.paper(i), params.get("fields")) for i in picks]})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is normal here
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def make_server(handler_cls: type, port: int, settings: Dict[str, Any], seed: int = 0) -> ThreadingHTTPServer:
+    handler = type(handler_cls.__name__, (handler_cls,), {
+        "settings": settings,
+        "counters": Counter(),
+        "lock": threading.Lock(),
+        "rng": random.Random(seed),
+    })
+    return QuietServer(("127.0.0.1", port), handler)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds per generated token")
+    parser.add_argument("--prompt-latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="tokens in a summary-style reply")
+    parser.add_argument("--llm-slots", type=int, default=4, help="requests the Ollama stub works on at once")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="fraction of Ollama calls that 500")
+    parser.add_argument("--corpus-size", type=int, default=5000, help="papers in the Semantic Scholar stub")
+    parser.add_argument("--results-per-query", type=int, default=100, help="search results per query")
+    parser.add_argument("--references-per-paper", type=int, default=20, help="references of each stub paper")
+    parser.add_argument("--semantic-latency", type=float, default=0.05, help="seconds per Semantic Scholar call")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of S2 calls answered 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with each 429")
+    parser.add_argument("--seed", type=int, default=0, help="seed for failure and 429 injection")
+
+
+def start_servers(args: argparse.Namespace, ollama_port: int, semantic_port: int):
+    ollama = make_server(OllamaHandler, ollama_port, {
+        "token_latency": args.token_latency,
+        "prompt_latency": args.prompt_latency,
+        "reply_tokens": args.reply_tokens,
+        "failure_rate": args.llm_failure_rate,
+        "slots_semaphore": threading.BoundedSemaphore(max(1, args.llm_slots)),
+    }, args.seed)
+    semantic = make_server(SemanticScholarHandler, semantic_port, {
+        "corpus_size": args.corpus_size,
+        "results_per_query": args.results_per_query,
+        "references_per_paper": args.references_per_paper,
+        "latency": args.semantic_latency,
+        "rate_limit_rate": args.rate_limit_rate,
+        "retry_after": args.retry_after,
+    }, args.seed)
+    for server in (ollama, semantic):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return ollama, semantic
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the stub Ollama and Semantic Scholar servers.")
+    parser.add_argument("--ollama-port", type=int, default=11500)
+    parser.add_argument("--semantic-port", type=int, default=11501)
+    add_arguments(parser)
+    args = parser.parse_args()
+    start_servers(args, args.ollama_port, args.semantic_port)
+    print(f"Ollama stub on http://127.0.0.1:{args.ollama_port}, "
+          f"Semantic Scholar stub on http://127.0.0.1:{args.semantic_port}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from concurrency_helper import bounded_map_unordered
+from config import Config
+from resilience_helper import SearchUnavailableError
+from semantic_scholar_helper import SemanticScholarAPI
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DIRECTIONS = ("references", "citations")
+
+
+def rank_frontier(adjacency: np.ndarray, seed_relevance: np.ndarray) -> np.ndarray:
+    """
+    Scores candidate papers by their links to the seeds, without the LLM.
+
+    adjacency[s, c] counts the links between seed s and candidate c (s cites c, c cites s, c is recommended for
+    s). A candidate scores one point per seed it is linked to (its co-citation count), plus each link weighted by
+    that seed's relevance (0-100, as a fraction), so papers that several of the best hits point to come first.
+
+    Args:
+        adjacency (np.ndarray): (seeds, candidates) link counts.
+        seed_relevance (np.ndarray): (seeds,) relevance scores.
+    Returns:
+        np.ndarray: (candidates,) scores.
+    """
+    linked = (adjacency > 0).sum(axis=0)
+    weighted = (seed_relevance / 100.0) @ adjacency
+    return linked + weighted
+
+
+class CitationGraph:
+    """
+    Widens a search by following references, citations and recommendations out from its best papers.
+
+    Every seed's references and citations, and the seeds' recommendations, are fetched at the same time under the
+    shared Semantic Scholar rate limiter. Edges are kept in the paper store, so expanding from the same papers
+    again (from any query) costs no requests.
+
+    Args:
+        semantic_scholar (SemanticScholarAPI): Fetches and stores the edges.
+        neighbors (int): References / citations fetched per seed.
+        recommendations (int): Recommendations fetched for the seeds together (0 = none).
+    """
+
+    def __init__(self, semantic_scholar: SemanticScholarAPI, neighbors: int = 100, recommendations: int = 20):
+        self.semantic_scholar = semantic_scholar
+        self.neighbors = neighbors
+        self.recommendations = recommendations
+
+    def links(self, seed_ids: List[str]) -> Dict[str, List[str]]:
+        """seed -> ids linked to it; recommendations for the seeds as a group are under the key "". """
+        tasks = [(seed_id, direction) for seed_id in seed_ids for direction in DIRECTIONS]
+        if self.recommendations > 0:
+            tasks.append(("", "recommendations"))
+
+        def fetch(task: Tuple[str, str]) -> List[str]:
+            seed_id, direction = task
+            if direction == "recommendations":
+                papers = self.semantic_scholar.get_recommended_papers(seed_ids, self.recommendations)
+                return [p.get("paperId") for p in papers if p.get("paperId")]
+            return self.semantic_scholar.get_neighbors(seed_id, direction, self.neighbors)
+
+        links = {}
+        for (seed_id, direction), neighbors, error in bounded_map_unordered(fetch, tasks, Config.SEARCH_WORKERS):
+            if error is not None:
+                # A missing direction only makes the frontier smaller
+                if isinstance(error, SearchUnavailableError):
+                    logger.warning(f"Fetching {direction} of {seed_id or seed_ids} failed: {error}")
+                else:
+                    logger.error(f"Fetching {direction} of {seed_id or seed_ids} failed: {error!r}")
+                continue
+            links.setdefault(seed_id, []).extend(neighbors)
+        return links
+
+    def frontier(self, seeds: Dict[str, float], known: Iterable[str]) -> List[Tuple[str, float]]:
+        """
+        Papers linked to the seeds that aren't in `known` yet, best first.
+
+        Args:
+            seeds (dict): paperId -> relevance (0-100) of the papers to expand from.
+            known (iterable): paperIds already in the results.
+        Returns:
+            list: (paperId, score) pairs, see rank_frontier().
+        """
+        if not seeds:
+            return []
+        seed_ids = list(seeds)
+        links = self.links(seed_ids)
+        known = set(known) | set(seed_ids)
+        candidates = sorted({paper_id for neighbors in links.values() for paper_id in neighbors} - known)
+        if not candidates:
+            return []
+        column = {paper_id: i for i, paper_id in enumerate(candidates)}
+        # The seeds' shared recommendations get a row of their own, weighted by the seeds' average relevance
+        rows = seed_ids + [""]
+        relevance = np.array([seeds[seed_id] for seed_id in seed_ids] + [np.mean(list(seeds.values()))],
+                             dtype=np.float32)
+        adjacency = np.zeros((len(rows), len(candidates)), dtype=np.float32)
+        for row, seed_id in enumerate(rows):
+            columns = [column[paper_id] for paper_id in links.get(seed_id, []) if paper_id in column]
+            np.add.at(adjacency[row], columns, 1.0)
+        scores = rank_frontier(adjacency, relevance)
+        order = np.argsort(-scores, kind="stable")
+        return [(candidates[i], float(scores[i])) for i in order]
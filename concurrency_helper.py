@@ -0,0 +1,119 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def bounded_map_unordered(fn: Callable[[Any], Any], items: Iterable[Any], max_workers: int,
+                          max_in_flight: Optional[int] = None) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+    """
+    Runs fn over items on a thread pool and yields results as soon as each one finishes.
+
+    At most max_in_flight items are submitted at any time, so a slow backend (e.g. Ollama) never has more than
+    that many requests waiting on it. Items are pulled lazily from the iterable as slots free up.
+
+    Args:
+        fn (callable): Function applied to every item.
+        items (iterable): Inputs to fn.
+        max_workers (int): Number of worker threads.
+        max_in_flight (int): Maximum number of submitted-but-unfinished calls. Defaults to max_workers.
+    Returns:
+        iterator: (item, result, error) tuples in completion order. error is None on success.
+    """
+    max_workers = max(1, max_workers)
+    max_in_flight = max(max_workers, max_in_flight or max_workers)
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+
+    def submit_next() -> bool:
+        try:
+            item = next(items)
+        except StopIteration:
+            return False
+        pending[executor.submit(fn, item)] = item
+        return True
+
+    try:
+        while len(pending) < max_in_flight and submit_next():
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, (None if error else future.result()), error
+                submit_next()
+    finally:
+        # If the consumer stops early (e.g. the client disconnected), drop any queued work
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class MicroBatcher:
+    """
+    Groups lookups from many threads into batched calls.
+
+    Callers ask for keys with get(); keys nobody is fetching yet are queued. Whenever no batch is running,
+    one waiting caller takes up to max_batch queued keys (its own and anyone else's) and runs fn on them, so
+    everything that arrives while a batch is in flight naturally rides along in the next one. A key that is
+    already queued or in flight is never requested twice.
+
+    Args:
+        fn (callable): fn(keys) -> {key: value}. Keys missing from the result map to None.
+        max_batch (int): Most keys per fn call.
+    """
+
+    def __init__(self, fn: Callable[[List[Hashable]], Dict[Hashable, Any]], max_batch: int):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.cond = threading.Condition()
+        self.futures = {}              # every unresolved key -> Future
+        self.waiting = OrderedDict()   # keys not sent yet, oldest first
+        self.running = False
+
+    def get(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Returns {key: value} for keys, raising whatever fn raised if a batch holding one of them failed.
+        """
+        with self.cond:
+            futures = {}
+            for key in keys:
+                if key in futures:
+                    continue
+                future = self.futures.get(key)
+                if future is None:
+                    future = self.futures[key] = Future()
+                    self.waiting[key] = None
+                futures[key] = future
+
+        while True:
+            with self.cond:
+                while self.running and not all(f.done() for f in futures.values()):
+                    self.cond.wait()
+                if all(f.done() for f in futures.values()):
+                    break
+                batch = []
+                while self.waiting and len(batch) < self.max_batch:
+                    batch.append(self.waiting.popitem(last=False)[0])
+                self.running = True
+            try:
+                results, error = self.fn(batch), None
+            except Exception as e:
+                results, error = {}, e
+            with self.cond:
+                for key in batch:
+                    future = self.futures.pop(key)
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(results.get(key))
+                self.running = False
+                self.cond.notify_all()
+
+        return {key: future.result() for key, future in futures.items()}
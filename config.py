@@ -5,12 +5,76 @@ from dataclasses import dataclass
 @dataclass
 class Config:
     SEMANTIC_API_KEY: str = os.getenv("SEMANTIC_API_KEY", "")       # If you have a SemanticScholar API key, use it here
+    SEMANTIC_API_URL: str = "https://api.semanticscholar.org"      # Semantic Scholar API base URL
     OLLAMA_API_URL: str = "http://localhost:11434/api/generate"     # Default Ollama API endpoint
+    OLLAMA_CHAT_URL: str = "http://localhost:11434/api/chat"        # Ollama endpoint used for multi-turn chats
+    OLLAMA_EMBED_URL: str = "http://localhost:11434/api/embed"      # Ollama endpoint used for embeddings
+    OLLAMA_EMBED_MODEL: str = "nomic-embed-text"                    # Embedding model ("" turns embeddings off)
     OLLAMA_MODEL: str = "llama3.2"                                  # Model for Ollama
-    CACHE_SIZE: int = 100                                           # Cache for API call
+    OLLAMA_BACKENDS: str = os.getenv("OLLAMA_BACKENDS", "")         # "url|model|max_concurrent, ..." ("" = OLLAMA_API_URL)
+    OLLAMA_HEALTH_INTERVAL: float = 10.0                            # Seconds between backend health probes
+    OLLAMA_EJECT_AFTER: int = 3                                     # Consecutive failures before a backend is ejected
+    CACHE_SIZE: int = 100                                           # Max number of searches kept in the paper store
     DEFAULT_YEAR_FILTER: str = "2020-"                              # Default year cutoff
     PAPERS_PER_PAGE: int = 20                                       # Number of results per Semantic Scholar API Call
     MAX_PAGES: int = 1                                              # How many pages of Semantic Scholar results?
     MAX_RETRIES: int = 5                                            # Retries for SemanticScholar or Ollama calls
+    RETRY_BASE_DELAY: float = 1.0                                   # First retry backoff (seconds), doubling each retry
+    RETRY_MAX_DELAY: float = 30.0                                   # Backoff cap (seconds), before jitter
+    BREAKER_FAILURE_THRESHOLD: int = 5                              # Consecutive failures before failing fast
+    BREAKER_RESET_TIMEOUT: float = 30.0                             # Seconds to fail fast before trying again
     TIMEOUT: int = 300                                              # Seconds until timeout for Ollama calls
     RELEVANT_PAPERS_FOR_FUTURE_WORK: int = 10                       # 10 papers used for future work ideation
+    REPORT_GROUP_SIZE: int = 25                                     # Papers per partial timeline prompt (0 = one prompt)
+    REPORT_REDUCE_FANIN: int = 8                                    # Partial reports merged per prompt
+    LLM_WORKERS: int = int(os.getenv("OLLAMA_NUM_PARALLEL", 4))     # Concurrent Ollama calls (match OLLAMA_NUM_PARALLEL)
+    LLM_MAX_CONCURRENT: int = int(os.getenv("OLLAMA_NUM_PARALLEL", 4))  # Ollama calls at once per backend
+    LLM_INTERACTIVE_RESERVE: int = 1                                # Of those, slots kept free for chat
+    LLM_MAX_IN_FLIGHT: int = 8                                      # Max queued + running Ollama calls per search
+    RELEVANCE_BATCH_SIZE: int = 5                                   # Papers scored per Ollama call (1 = one at a time)
+    PRERANK_TOP_K: int = 20                                         # Papers (by embedding similarity) the LLM rates (0 = all)
+    PIPELINE_QUEUE_SIZE: int = 256                                  # Events buffered between search stages and the response
+    PRESUMMARIZE_ENABLED: bool = True                               # Summarize found papers in the background for later searches
+    SUMMARY_QUEUE_PATH: str = ".cache/summary_jobs.sqlite3"         # Papers waiting for a background summary (survives restarts)
+    SUMMARY_WORKERS: int = 1                                        # Background summaries written at once (on otherwise idle LLM slots)
+    SUMMARY_MAX_ATTEMPTS: int = 3                                   # Give up on a paper's background summary after this many failures
+    SUMMARY_QUERY_NOTE: bool = False                                # Add a sentence relating a pre-made summary to the query (short LLM call)
+    EXPANSION_ENABLED: bool = True                                  # Follow citations from the best hits for more papers
+    EXPANSION_SEEDS: int = 5                                        # Most relevant papers to expand from
+    EXPANSION_NEIGHBORS: int = 100                                  # References and citations fetched per seed
+    EXPANSION_RECOMMENDATIONS: int = 20                             # Recommendations fetched for the seeds (0 = none)
+    EXPANSION_MAX_PAPERS: int = 20                                  # New papers added to the results
+    EXPANSION_LLM_BUDGET: int = 5                                   # Of those, how many the LLM may rate (with PRERANK_TOP_K)
+    LLM_CACHE_ENABLED: bool = True                                  # Cache LLM generations on disk
+    LLM_CACHE_PATH: str = ".cache/llm_cache.sqlite3"                # Where the LLM cache lives
+    LLM_CACHE_MAX_BYTES: int = 256 * 1024 * 1024                    # LRU eviction once cached responses pass this size
+    LLM_CACHE_TTL: int = 30 * 24 * 60 * 60                          # Seconds before a cached generation expires
+    PAPER_STORE_PATH: str = ".cache/papers.sqlite3"                 # Where Semantic Scholar results are stored
+    SEARCH_CACHE_TTL: int = 7 * 24 * 60 * 60                        # Seconds before a cached search expires
+    SEARCH_WORKERS: int = 4                                         # Concurrent Semantic Scholar requests
+    SEMANTIC_BATCH_SIZE: int = 500                                  # Paper ids per /paper/batch call (API maximum)
+    LOCAL_CORPUS_ENABLED: bool = True                               # Search stored papers before the API
+    LOCAL_CORPUS_LIMIT: int = 20                                    # Local matches per query
+    LOCAL_CORPUS_ENOUGH: int = 0                                    # Skip the API with this many local matches (0 = never)
+    SEMANTIC_RATE_KEYED: float = 1.0                                # Semantic Scholar requests/second with an API key
+    SEMANTIC_RATE_ANON: float = 0.5                                 # Semantic Scholar requests/second without a key
+    SEMANTIC_RATE_BURST: float = 1.0                                # How many requests may go out back to back
+    CHAT_HISTORY_BUDGET: float = 0.75                               # Fraction of num_ctx a chat may fill before compacting
+    CHAT_KEEP_TURNS: int = 4                                        # Recent exchanges kept word-for-word when compacting
+    PDF_CACHE_PATH: str = ".cache/pdfs.sqlite3"                     # Extracted PDF text, keyed by content hash
+    PDF_MAX_BYTES: int = 50 * 1024 * 1024                           # Refuse PDFs bigger than this
+    PDF_TIMEOUT: int = 120                                          # Seconds allowed to download a PDF
+    PDF_WORKERS: int = 2                                            # Processes used to extract text from big PDFs
+    PDF_PAGES_PER_TASK: int = 16                                    # Pages each PDF worker extracts at a time
+    RETRIEVAL_CHUNK_WORDS: int = 200                                # Words per searchable chunk of a loaded paper
+    RETRIEVAL_CHUNK_OVERLAP: int = 40                               # Words shared between neighbouring chunks
+    RETRIEVAL_TOP_K: int = 6                                        # Chunks sent to the LLM with each paper question
+    STATUS_BUFFER_SIZE: int = 50                                    # Recent status messages kept per browser session
+    STATUS_HEARTBEAT_INTERVAL: float = 15.0                         # Seconds between keep-alive pings on /status
+    STATUS_IDLE_TTL: float = 10 * 60                                # Drop a disconnected session's status after this
+    ASGI_WSGI_WORKERS: int = 16                                     # Threads for the non-streaming routes under asgi_app
+    SESSION_MAX_ENTRIES: int = 1000                                 # Chats (and browser sessions) kept in memory
+    SESSION_MAX_BYTES: int = 512 * 1024 * 1024                      # Memory budget for chat state, incl. loaded papers
+    SESSION_IDLE_TTL: float = 2 * 60 * 60                           # Seconds before an idle chat is evicted from memory
+    SESSION_SPILL_PATH: str = ".cache/sessions.sqlite3"             # Evicted chats are saved here ("" to just drop them)
+    SESSION_SPILL_TTL: float = 7 * 24 * 60 * 60                     # Seconds an evicted chat can still be restored
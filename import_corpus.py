@@ -0,0 +1,134 @@
+"""
+Bulk-loads Semantic Scholar dataset dumps into the local paper corpus (Config.PAPER_STORE_PATH).
+
+Usage:
+    python import_corpus.py papers-*.jsonl.gz --abstracts abstracts-*.jsonl.gz --tldrs tldrs-*.jsonl.gz
+
+Paper files can be shards of the "papers" dataset (https://api.semanticscholar.org/datasets/v1/) or JSONL of Graph
+API records (with a paperId). Abstracts and TLDRs come from their own datasets and are joined on corpusid; they
+are staged in a temporary SQLite file first, so even full dumps don't need to fit in memory.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import Config
+from paper_store import PaperStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def stage(conn: sqlite3.Connection, table: str, paths: List[str], text_key: str):
+    """Loads corpusid -> (text, extra) rows from abstract or TLDR files into a staging table."""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (corpusid INTEGER PRIMARY KEY, text TEXT, extra TEXT)")
+    for path in paths:
+        rows = []
+        for record in read_jsonl(path):
+            if record.get("corpusid") is None or not record.get(text_key):
+                continue
+            rows.append((record["corpusid"], record[text_key], json.dumps(record.get("openaccessinfo") or {})))
+            if len(rows) >= 10000:
+                conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)", rows)
+                rows = []
+        conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)", rows)
+        conn.commit()
+        logger.info(f"Staged {path}")
+
+
+def lookup(conn: sqlite3.Connection, table: str, corpus_ids: List[int]) -> Dict[int, tuple]:
+    if not corpus_ids:
+        return {}
+    placeholders = ",".join("?" * len(corpus_ids))
+    rows = conn.execute(f"SELECT corpusid, text, extra FROM {table} WHERE corpusid IN ({placeholders})", corpus_ids)
+    return {corpus_id: (text, extra) for corpus_id, text, extra in rows}
+
+
+def to_paper(record: Dict[str, Any], abstract: Optional[tuple], tldr: Optional[tuple]) -> Optional[Dict[str, Any]]:
+    """Maps a dataset record (lower-case keys) to the Graph API shape the rest of the app uses."""
+    if record.get("paperId"):
+        # Already a Graph API record
+        return record
+    url = record.get("url") or ""
+    paper_id = url.rstrip("/").rsplit("/", 1)[-1] if "/paper/" in url else None
+    if not paper_id:
+        return None
+    open_access = json.loads(abstract[1]) if abstract else {}
+    return {
+        "paperId": paper_id,
+        "title": record.get("title"),
+        "url": url,
+        "year": record.get("year"),
+        "publicationDate": record.get("publicationdate"),
+        "publicationTypes": record.get("publicationtypes"),
+        "citationCount": record.get("citationcount") or 0,
+        "authors": [{"name": a.get("name", "")} for a in record.get("authors") or []],
+        "abstract": abstract[0] if abstract else None,
+        "tldr": {"text": tldr[0]} if tldr else None,
+        "openAccessPdf": {"url": open_access["url"]} if open_access.get("url") else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load Semantic Scholar dataset dumps into the local paper corpus.")
+    parser.add_argument("papers", nargs="+", help="papers dataset shards or Graph API JSONL (.jsonl or .jsonl.gz)")
+    parser.add_argument("--abstracts", nargs="*", default=[], help="abstracts dataset shards")
+    parser.add_argument("--tldrs", nargs="*", default=[], help="tldrs dataset shards")
+    parser.add_argument("--store", default=Config.PAPER_STORE_PATH, help="paper store to load into")
+    parser.add_argument("--batch-size", type=int, default=5000, help="papers written per transaction")
+    args = parser.parse_args()
+
+    store = PaperStore(args.store, Config.SEARCH_CACHE_TTL, Config.CACHE_SIZE)
+    staging_dir = tempfile.mkdtemp(prefix="corpus_import_")
+    staging = sqlite3.connect(os.path.join(staging_dir, "staging.sqlite3"))
+    try:
+        stage(staging, "abstracts", args.abstracts, "abstract")
+        stage(staging, "tldrs", args.tldrs, "text")
+
+        total = 0
+        for path in args.papers:
+            batch = []
+            for record in read_jsonl(path):
+                batch.append(record)
+                if len(batch) >= args.batch_size:
+                    total += load_batch(store, staging, batch)
+                    batch = []
+            total += load_batch(store, staging, batch)
+            logger.info(f"Imported {path} ({total} papers so far)")
+        logger.info(f"Done: {total} papers in {args.store}")
+    finally:
+        staging.close()
+        os.remove(os.path.join(staging_dir, "staging.sqlite3"))
+        os.rmdir(staging_dir)
+
+
+def load_batch(store: PaperStore, staging: sqlite3.Connection, records: List[Dict[str, Any]]) -> int:
+    corpus_ids = [r["corpusid"] for r in records if r.get("corpusid") is not None]
+    abstracts = lookup(staging, "abstracts", corpus_ids)
+    tldrs = lookup(staging, "tldrs", corpus_ids)
+    papers = []
+    for record in records:
+        corpus_id = record.get("corpusid")
+        paper = to_paper(record, abstracts.get(corpus_id), tldrs.get(corpus_id))
+        if paper is not None:
+            papers.append(paper)
+    store.put_papers(papers)
+    return len(papers)
+
+
+if __name__ == "__main__":
+    main()
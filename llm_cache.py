@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(payload: Dict[str, Any]) -> str:
+    """
+    Content-addressed key for an Ollama request: a hash of everything that affects the output
+    (model, prompt, stop sequences, sampling options, output format), ignoring transport fields like "stream".
+    """
+    relevant = {k: v for k, v in payload.items() if k != "stream"}
+    blob = json.dumps(relevant, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent SQLite cache for LLM generations.
+
+    Entries expire after ttl seconds, and once the stored responses exceed max_bytes the least recently used
+    entries are evicted. Safe to share between threads, and between processes pointing at the same file.
+
+    The total size is tracked in memory, so a put only scans the table when it takes the cache over budget, and
+    hits record their access times in batches (every flush_interval seconds) instead of committing on each one.
+    Expired entries are purged on the same timer, so they don't sit on disk until the cache next fills up.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: int, log_every: int = 50, flush_interval: float = 30.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.log_every = log_every
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> last access time, not yet written to the table
+        self._accessed: Dict[str, float] = {}
+        self._flushed = time.time()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_accessed ON generations (accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_created ON generations (created)")
+        self._conn.commit()
+        self._size = self._total_size()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                # Left for the next eviction to delete; expired entries are never returned
+                row = None
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._accessed[key] = now
+            if now - self._flushed > self.flush_interval:
+                self._maintain(now)
+                self._conn.commit()
+            self._maybe_log()
+        return row[0] if row is not None else None
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM generations WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._accessed.pop(key, None)
+            self._size += size - (old[0] if old is not None else 0)
+            if self._size > self.max_bytes:
+                self._evict(now)
+            elif now - self._flushed > self.flush_interval:
+                self._maintain(now)
+            self._conn.commit()
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+
+    def _flush_accessed(self, now: float):
+        if self._accessed:
+            self._conn.executemany("UPDATE generations SET accessed = ? WHERE key = ?",
+                                   [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+        self._flushed = now
+
+    def _maintain(self, now: float):
+        # Periodic upkeep: write out access times, drop expired entries and re-read the real total (other
+        # processes may have written to the file)
+        self._flush_accessed(now)
+        self._conn.execute("DELETE FROM generations WHERE created < ?", (now - self.ttl,))
+        self._size = self._total_size()
+
+    def _evict(self, now: float):
+        # Runs once the cache is over budget: after the usual upkeep, walk from least to most recently used
+        # until back under it
+        self._maintain(now)
+        if self._size <= self.max_bytes:
+            return
+        to_free = self._size - self.max_bytes
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM generations ORDER BY accessed ASC"):
+            doomed.append((key,))
+            to_free -= size
+            self._size -= size
+            if to_free <= 0:
+                break
+        self._conn.executemany("DELETE FROM generations WHERE key = ?", doomed)
+
+    def _maybe_log(self):
+        lookups = self.hits + self.misses
+        if self.log_every and lookups % self.log_every == 0:
+            logger.info(f"LLM cache: {self.hits} hits, {self.misses} misses ({self.hits / lookups:.0%} hit rate)")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM generations")
+            self._conn.commit()
+            self._accessed.clear()
+            self._size = 0
@@ -0,0 +1,172 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterator
+
+from metrics_helper import Trace, metrics as registry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Priority:
+    """LLM priority classes, most urgent first."""
+    INTERACTIVE = 0  # Chat turns and anything else a user is actively waiting on
+    REPORT = 1       # Timeline and future work
+    RELEVANCE = 2    # Relevance scoring during a search
+    BULK = 3         # Paper summaries
+    BACKGROUND = 4   # Pre-made summaries nobody is waiting for yet
+
+    NAMES = {INTERACTIVE: "interactive", REPORT: "report", RELEVANCE: "relevance", BULK: "bulk",
+             BACKGROUND: "background"}
+
+
+class LLMCancelled(Exception):
+    """Raised when a request is cancelled (e.g. the client disconnected) while waiting for a slot."""
+
+
+class RequestContext:
+    """
+    Who an LLM call is for: the session it belongs to (for fairness), an optional event that is set once
+    nobody wants the answer anymore, and an optional Trace that collects the request's timings.
+    """
+
+    def __init__(self, session_id: str = "", cancelled: threading.Event = None, trace: Optional[Trace] = None):
+        self.session_id = session_id or ""
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+        self.trace = trace
+
+    def cancel(self):
+        self.cancelled.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancelled.is_set()
+
+
+class _Waiter:
+    __slots__ = ("priority", "session_id", "granted", "enqueued")
+
+    def __init__(self, priority: int, session_id: str):
+        self.priority = priority
+        self.session_id = session_id
+        self.granted = False
+        self.enqueued = time.monotonic()
+
+
+class LLMScheduler:
+    """
+    Decides which LLM call goes to Ollama next.
+
+    At most `max_concurrent` calls run at once. Waiting calls are served by priority class, and within a class
+    round-robin across sessions, so one big search can't starve another user's. `reserved` slots are kept free
+    for interactive calls: background work never holds more than max_concurrent - reserved slots, so a chat
+    message only ever waits for other chat messages.
+
+    Args:
+        max_concurrent (int): Calls allowed at Ollama at once (match OLLAMA_NUM_PARALLEL).
+        reserved (int): Slots only interactive calls may use.
+    """
+
+    def __init__(self, max_concurrent: int, reserved: int = 1):
+        self.max_concurrent = max(1, max_concurrent)
+        self.reserved = min(max(0, reserved), self.max_concurrent - 1)
+        self.cond = threading.Condition()
+        self.running = 0
+        # priority -> session_id -> deque of waiters; sessions rotate to the back after each grant
+        self.queues = {p: OrderedDict() for p in Priority.NAMES}
+        self.metrics = {
+            p: {"queued": 0, "running": 0, "granted": 0, "cancelled": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for p in Priority.NAMES
+        }
+
+    def _limit(self, priority: int) -> int:
+        if priority == Priority.INTERACTIVE:
+            return self.max_concurrent
+        return self.max_concurrent - self.reserved
+
+    def _grant_next(self):
+        # Called with the lock held: hand free slots to the most urgent waiters
+        for priority in sorted(self.queues):
+            sessions = self.queues[priority]
+            while sessions and self.running < self._limit(priority):
+                session_id, waiters = next(iter(sessions.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    sessions.move_to_end(session_id)
+                else:
+                    del sessions[session_id]
+                waiter.granted = True
+                self.running += 1
+                metrics = self.metrics[priority]
+                metrics["queued"] -= 1
+                metrics["running"] += 1
+                metrics["granted"] += 1
+                waited = time.monotonic() - waiter.enqueued
+                metrics["wait_total"] += waited
+                metrics["wait_max"] = max(metrics["wait_max"], waited)
+                registry.observe("llm_queue_seconds", waited, priority=Priority.NAMES[priority])
+                if waited > 1.0:
+                    logger.info(f"{Priority.NAMES[priority]} LLM call for session {session_id or '-'} "
+                                f"waited {waited:.1f}s for a slot")
+            if sessions:
+                # Lower priorities never jump ahead of a waiting higher priority
+                break
+        self.cond.notify_all()
+
+    def _remove(self, waiter: _Waiter):
+        waiters = self.queues[waiter.priority].get(waiter.session_id)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self.queues[waiter.priority][waiter.session_id]
+            self.metrics[waiter.priority]["queued"] -= 1
+            self.metrics[waiter.priority]["cancelled"] += 1
+
+    def acquire(self, priority: int = Priority.BULK, ctx: RequestContext = None) -> _Waiter:
+        ctx = ctx or RequestContext()
+        if ctx.is_cancelled:
+            # Don't start work nobody wants anymore, even if a slot is free
+            raise LLMCancelled()
+        waiter = _Waiter(priority, ctx.session_id)
+        with self.cond:
+            self.queues[priority].setdefault(ctx.session_id, deque()).append(waiter)
+            self.metrics[priority]["queued"] += 1
+            self._grant_next()
+            while not waiter.granted:
+                if ctx.is_cancelled:
+                    self._remove(waiter)
+                    raise LLMCancelled()
+                # Wake up now and then to notice cancellation
+                self.cond.wait(timeout=0.5)
+        return waiter
+
+    def release(self, waiter: _Waiter):
+        with self.cond:
+            self.running -= 1
+            self.metrics[waiter.priority]["running"] -= 1
+            self._grant_next()
+
+    @contextmanager
+    def slot(self, priority: int = Priority.BULK, ctx: RequestContext = None) -> Iterator[None]:
+        """
+        Holds one Ollama slot for the duration of the block. Raises LLMCancelled if ctx is cancelled first.
+        """
+        waiter = self.acquire(priority, ctx)
+        try:
+            yield
+        finally:
+            self.release(waiter)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Queue depth, running calls and wait times per priority class."""
+        with self.cond:
+            stats = {}
+            for priority, metrics in self.metrics.items():
+                stats[Priority.NAMES[priority]] = dict(
+                    metrics,
+                    wait_avg=metrics["wait_total"] / metrics["granted"] if metrics["granted"] else 0.0
+                )
+            return stats
@@ -1,14 +1,29 @@
 import re
+import json
 import requests
 import logging
-from typing import List, Dict, Any
+import math
 import time
+from typing import List, Dict, Any, Optional, Iterator, Generator, Tuple
+import uuid
+import numpy as np
 
+from concurrency_helper import bounded_map_unordered
 from config import Config
+from llm_cache import LLMCache, make_cache_key
+from llm_scheduler import LLMScheduler, LLMCancelled, Priority, RequestContext
+from metrics_helper import metrics
+from ollama_pool import Backend, BackendPool, parse_backends
+from resilience_helper import CircuitBreaker, LLMUnavailableError, RetryPolicy
+from retrieval_helper import PaperIndex, retrieve
+from session_helper import SessionStore
+from single_flight import SingleFlight, WaitCancelled
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+TIMELINE_STOPS = ["References:", "\nReferences:", "Bibliography:", "\nBibliography:"]
+
 
 def extract_bracket_content(input_string, angle: bool = False):
     """
@@ -44,132 +59,805 @@ def add_citations(sorted_papers: list = None, citations: Dict = None, ref_text:
     return bibliography
 
 
+def remap_citations(text: str, numbering: Dict[int, int]) -> str:
+    """
+    Rewrites citation numbers in text, e.g. with {1: 12, 2: 7, 3: 9}, "[1]" becomes "[12]", and "[1, 2]" and
+    "[1-2]" become "[12][7]" (so add_citations finds each one). Numbers not in numbering were made up by the LLM
+    and are dropped.
+    """
+    def replace(match):
+        numbers = []
+        for start, end in re.findall(r"(\d+)(?:\s*[-\u2013]\s*(\d+))?", match.group(1)):
+            if end:
+                numbers.extend(n for n in sorted(numbering) if int(start) <= n <= int(end))
+            else:
+                numbers.append(int(start))
+        return "".join(f"[{numbering[n]}]" for n in numbers if n in numbering)
+    citation = r"\d+(?:\s*[-\u2013]\s*\d+)?"
+    return re.sub(rf"\[({citation}(?:\s*[,;]\s*{citation})*)\]", replace, text)
+
+
+def group_by_year(papers: List[Dict[str, Any]], group_size: int) -> List[List[Dict[str, Any]]]:
+    """
+    Splits papers into one group per year, oldest first; only a year with more than group_size papers is split
+    further, into chunks of group_size. Papers keep their relative order within a year.
+
+    Groups never span years, so adding papers only changes the group(s) for their own year, and every other
+    group's partial report still comes from the LLM cache.
+    """
+    by_year = {}
+    for paper in papers:
+        by_year.setdefault((paper.get('publication_date') or '')[:4], []).append(paper)
+    groups = []
+    for year in sorted(by_year):
+        year_papers = by_year[year]
+        groups.extend(year_papers[i:i + group_size] for i in range(0, len(year_papers), group_size))
+    return groups
+
+
+class StreamIncomplete(Exception):
+    """Raised in callers waiting on a shared stream that ended before Ollama finished the reply."""
+
+
+class ScratchPadFilter:
+    """
+    Incrementally removes <<scratch pad>> notes from streamed text.
+
+    feed() returns whatever can safely be shown so far; a trailing "<" is held back until we know whether it
+    starts a note. Like the non-streaming path, a note that is never closed is shown as-is by flush().
+    """
+
+    def __init__(self):
+        self.inside = False
+        self.buffer = ''
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        visible = ''
+        while self.buffer:
+            if self.inside:
+                end = self.buffer.find('>>')
+                if end < 0:
+                    return visible
+                self.buffer = self.buffer[end + 2:]
+                self.inside = False
+            else:
+                start = self.buffer.find('<<')
+                if start >= 0:
+                    visible += self.buffer[:start]
+                    self.buffer = self.buffer[start:]
+                    self.inside = True
+                    # Keep the opening marker in the buffer in case the note never closes
+                    if self.buffer.find('>>', 2) < 0:
+                        return visible
+                    self.buffer = self.buffer[2:]
+                elif self.buffer.endswith('<'):
+                    visible += self.buffer[:-1]
+                    self.buffer = '<'
+                    return visible
+                else:
+                    visible += self.buffer
+                    self.buffer = ''
+        return visible
+
+    def flush(self) -> str:
+        visible, self.buffer, self.inside = self.buffer, '', False
+        return visible
+
+
+class CallMetrics:
+    """
+    Records one Ollama call, all attempts included, in /metrics and in the request's trace (if it has one):
+    wall time, outcome, retries, and the token counts and durations Ollama reports in its final reply.
+
+        with CallMetrics("summarize_paper", "generate", ctx) as call:
+            ...
+            call.attempts = attempt + 1
+            call.body = response.json()
+    """
+
+    def __init__(self, caller: str, endpoint: str, ctx: Optional[RequestContext] = None):
+        self.caller = caller
+        self.endpoint = endpoint
+        self.ctx = ctx
+        self.attempts = 0
+        self.body = {}
+        self.started = None
+
+    def __enter__(self) -> "CallMetrics":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        if exc_type is None:
+            cancelled = self.ctx is not None and self.ctx.is_cancelled and not self.body
+            outcome = "cancelled" if cancelled else "ok"
+        elif issubclass(exc_type, (LLMCancelled, GeneratorExit)):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        labels = {"caller": self.caller, "endpoint": self.endpoint}
+        metrics.inc("llm_requests_total", outcome=outcome, **labels)
+        metrics.observe("llm_request_seconds", seconds, **labels)
+        if self.attempts > 1:
+            metrics.inc("llm_retries_total", self.attempts - 1, **labels)
+        prompt_tokens = self.body.get("prompt_eval_count") or 0
+        completion_tokens = self.body.get("eval_count") or 0
+        if prompt_tokens or completion_tokens:
+            metrics.inc("llm_prompt_tokens_total", prompt_tokens, **labels)
+            metrics.inc("llm_completion_tokens_total", completion_tokens, **labels)
+            # Ollama reports durations in nanoseconds
+            metrics.inc("llm_prompt_eval_seconds_total", (self.body.get("prompt_eval_duration") or 0) / 1e9, **labels)
+            metrics.inc("llm_eval_seconds_total", (self.body.get("eval_duration") or 0) / 1e9, **labels)
+        trace = getattr(self.ctx, "trace", None)
+        if trace is not None:
+            trace.add_llm_call(self.caller, seconds, prompt_tokens, completion_tokens, outcome)
+        return False
+
+
 class LocalLLM:
-    def __init__(self, api_url: str, model: str):
-        self.api_url = api_url
-        self.model = model
-        self.session = requests.Session()
-        self.chat_state = {}
-        self.original_search_query = ''
-        self.searched_already = False
+    def __init__(self, api_url: str, model: str, chat_url: str = Config.OLLAMA_CHAT_URL,
+                 embed_url: str = Config.OLLAMA_EMBED_URL, backends: List[Backend] = None):
+        # Config.OLLAMA_BACKENDS spreads calls over several Ollama servers; otherwise it's just the one at api_url
+        if backends is None:
+            backends = parse_backends(Config.OLLAMA_BACKENDS, model, Config.LLM_MAX_CONCURRENT)
+        if not backends:
+            backends = [Backend(api_url.rsplit("/api/", 1)[0], model, Config.LLM_MAX_CONCURRENT,
+                                generate_url=api_url, chat_url=chat_url, embed_url=embed_url)]
+        self.pool = BackendPool(backends, Config.OLLAMA_HEALTH_INTERVAL, Config.OLLAMA_EJECT_AFTER)
+        # The model the backends actually run; cache keys and stored summaries are keyed on it
+        self.model = self.pool.model
+        # Chats are keyed by chat_id and per-tab flags by session_id; both are bounded and evict idle entries
+        self.chat_state = SessionStore("chats", Config.SESSION_MAX_ENTRIES, Config.SESSION_MAX_BYTES,
+                                       Config.SESSION_IDLE_TTL, Config.SESSION_SPILL_PATH, Config.SESSION_SPILL_TTL)
+        self.sessions = SessionStore("sessions", Config.SESSION_MAX_ENTRIES, Config.SESSION_MAX_BYTES,
+                                     Config.SESSION_IDLE_TTL, Config.SESSION_SPILL_PATH, Config.SESSION_SPILL_TTL)
+        self.options = {"temperature": 0.8, "num_ctx": 32000}
+        self.cache = None
+        if Config.LLM_CACHE_ENABLED:
+            self.cache = LLMCache(Config.LLM_CACHE_PATH, Config.LLM_CACHE_MAX_BYTES, Config.LLM_CACHE_TTL)
+        # Every call to Ollama goes through the scheduler, so chat isn't stuck behind someone's search
+        self.scheduler = LLMScheduler(self.pool.capacity, Config.LLM_INTERACTIVE_RESERVE)
+        # Backoff between attempts, and fail fast while an endpoint keeps failing
+        self.retry = {
+            endpoint: RetryPolicy(CircuitBreaker(f"Ollama {endpoint}", Config.BREAKER_FAILURE_THRESHOLD,
+                                                 Config.BREAKER_RESET_TIMEOUT),
+                                  LLMUnavailableError, Config.MAX_RETRIES, Config.RETRY_BASE_DELAY,
+                                  Config.RETRY_MAX_DELAY)
+            for endpoint in ("generate", "chat", "embed")
+        }
+        # Identical cacheable generations that are in flight at the same time share one Ollama call
+        self.flights = SingleFlight("llm")
 
     def reset(self):
-        self.session = requests.Session()
-        self.chat_state = {}
-        self.original_search_query = ''
-        self.searched_already = False
+        self.pool.reset()
+        self.chat_state.clear()
+        self.sessions.clear()
+
+    def session_state(self, session_id: str = None) -> Dict[str, Any]:
+        session_id = session_id or ""
+        state = self.sessions.get(session_id)
+        if state is None:
+            state = {"searched_already": False, "original_search_query": ""}
+            self.sessions.put(session_id, state)
+        return state
+
+    def mark_searched(self, session_id: str = None):
+        # Once a session has searched, its chats are about papers rather than about composing a search
+        state = self.session_state(session_id)
+        state["searched_already"] = True
+        self.sessions.put(session_id or "", state)
 
-    def generate(self, prompt: str, max_retries: int = Config.MAX_RETRIES, stops=None) -> str:
+    @staticmethod
+    def _new_chat_id() -> str:
+        return uuid.uuid4().hex
+
+    def generate(self, prompt: str, max_retries: int = Config.MAX_RETRIES, stops=None, fmt: str = None,
+                 use_cache: bool = True, priority: int = Priority.BULK, ctx: RequestContext = None,
+                 caller: str = "generate") -> str:
+        """
+        Raises LLMUnavailableError if Ollama keeps failing, so callers can tell that apart from an empty reply.
+        Returns "" only if ctx was cancelled before the call got a slot. `caller` labels the call in /metrics.
+
+        Cacheable calls are also coalesced: if the same prompt is already being generated (say, two tabs
+        searching the same topic), this waits for that reply instead of asking Ollama again - unless that call
+        was queued at a lower priority, and only for as long as our own ctx isn't cancelled.
+        """
         payload = {
             "model": self.model,
             "prompt": prompt,
             "stream": False,
-            "temperature": 0.8,
-            "num_ctx": 32000,
+            "options": dict(self.options),
         }
         if stops is not None:
             payload['stop'] = stops
+        if fmt is not None:
+            # Ollama structured output, e.g. "json"
+            payload['format'] = fmt
+
+        if not use_cache:
+            try:
+                return self._post_generate(payload, max_retries, priority, ctx, caller=caller)
+            except LLMCancelled:
+                return ""
+
+        cache_key = make_cache_key(payload)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.inc("llm_cache_hits_total", caller=caller)
+                return cached
 
-        for attempt in range(max_retries):
+        while True:
             try:
-                response = self.session.post(
-                    self.api_url,
-                    json=payload,
-                    timeout=Config.TIMEOUT
-                )
-                response.raise_for_status()
-                return response.json().get('response', '')
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Attempt {attempt + 1}/{max_retries} failed: {e}")
-                if attempt == max_retries - 1:
+                return self.flights.do(cache_key, lambda: self._post_generate(payload, max_retries, priority, ctx,
+                                                                              cache_key, caller),
+                                       rank=priority, cancelled=ctx.cancelled if ctx is not None else None)
+            except (LLMCancelled, WaitCancelled):
+                if ctx is not None and ctx.is_cancelled:
                     return ""
+                # We were waiting on someone else's call and its client went away; make our own
+
+    def _post_generate(self, payload: Dict[str, Any], max_retries: int, priority: int, ctx: Optional[RequestContext],
+                       cache_key: str = None, caller: str = "generate") -> str:
+        policy = self.retry["generate"]
+        with CallMetrics(caller, "generate", ctx) as call:
+            for attempt in policy.attempts(max_retries):
+                call.attempts = attempt + 1
+                try:
+                    with self.scheduler.slot(priority, ctx), self.pool.lease() as backend:
+                        response = backend.session.post(
+                            backend.generate_url,
+                            json=dict(payload, model=backend.model),
+                            timeout=Config.TIMEOUT
+                        )
+                        response.raise_for_status()
+                    call.body = response.json()
+                    text = call.body.get('response', '')
+                    policy.succeeded()
+                    # Don't cache empty replies, they are almost always a server hiccup
+                    if cache_key is not None and self.cache is not None and text.strip():
+                        self.cache.put(cache_key, text)
+                    return text
+                except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+                    policy.failed(attempt, e, max_retries)
         return ""
 
-    def chat_to_search(self, query: str, chat_id: str = None) -> Dict[str, Any]:
-        if not chat_id:
-            chat_id = str(time.time())
+    def generate_stream(self, prompt: str, max_retries: int = Config.MAX_RETRIES, stops=None,
+                        use_cache: bool = True, priority: int = Priority.BULK, ctx: RequestContext = None,
+                        caller: str = "generate") -> Iterator[str]:
+        """
+        Like generate, but yields the reply piece by piece as Ollama produces it.
+
+        Retries only happen before the first token arrives; once text has been yielded a failure just ends the
+        stream. If no text arrives at all, LLMUnavailableError is raised. Cache hits come back as a single piece,
+        and only complete replies are written to the cache. The scheduler slot is held until the stream ends, is
+        closed, or ctx is cancelled. If the same prompt is already streaming for someone else, the finished reply
+        is yielded as a single piece once it's done.
+        """
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "options": dict(self.options),
+        }
+        if stops is not None:
+            payload['stop'] = stops
+
+        if not use_cache:
+            yield from self._stream_generate(payload, max_retries, priority, ctx, caller=caller)
+            return
+
+        cache_key = make_cache_key(payload)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.inc("llm_cache_hits_total", caller=caller)
+                yield cached
+                return
+
+        leader, future = self.flights.begin(cache_key, rank=priority)
+        if not leader:
+            try:
+                text = self.flights.wait(future, ctx.cancelled if ctx is not None else None)
+            except WaitCancelled:
+                return
+            except (LLMCancelled, StreamIncomplete):
+                if ctx is not None and ctx.is_cancelled:
+                    return
+                # The stream we were waiting on was abandoned by its client or broke off; make our own
+                yield from self._stream_generate(payload, max_retries, priority, ctx, cache_key, caller)
+                return
+            if text:
+                yield text
+            return
+
+        chunks = []
+        stream = self._stream_generate(payload, max_retries, priority, ctx, cache_key, caller)
+        try:
+            while True:
+                try:
+                    token = next(stream)
+                except StopIteration as stop:
+                    complete = stop.value
+                    break
+                chunks.append(token)
+                yield token
+        except GeneratorExit:
+            stream.close()
+            self.flights.finish(cache_key, future, error=LLMCancelled())
+            raise
+        except BaseException as e:
+            self.flights.finish(cache_key, future, error=e)
+            raise
+        # Only a reply Ollama finished is handed to the callers waiting on it; otherwise they make their own call
+        if complete:
+            self.flights.finish(cache_key, future, result="".join(chunks))
+        elif ctx is not None and ctx.is_cancelled:
+            self.flights.finish(cache_key, future, error=LLMCancelled())
+        else:
+            error = StreamIncomplete(f"Stream broke off after {len(chunks)} pieces")
+            self.flights.finish(cache_key, future, error=error)
+
+    def _stream_generate(self, payload: Dict[str, Any], max_retries: int, priority: int,
+                         ctx: Optional[RequestContext], cache_key: str = None, caller: str = "generate"
+                         ) -> Generator[str, None, bool]:
+        """Yields the reply's pieces; returns True only if Ollama finished it (not cancelled or broken off)."""
+        policy = self.retry["generate"]
+        with CallMetrics(caller, "generate", ctx) as call:
+            for attempt in policy.attempts(max_retries):
+                call.attempts = attempt + 1
+                chunks = []
+                try:
+                    with self.scheduler.slot(priority, ctx), self.pool.lease() as backend, \
+                            backend.session.post(backend.generate_url, json=dict(payload, model=backend.model),
+                                                 timeout=Config.TIMEOUT, stream=True) as response:
+                        response.raise_for_status()
+                        for line in response.iter_lines():
+                            if ctx is not None and ctx.is_cancelled:
+                                return False
+                            if not line:
+                                continue
+                            chunk = json.loads(line)
+                            token = chunk.get('response', '')
+                            if token:
+                                chunks.append(token)
+                                yield token
+                            if chunk.get('done'):
+                                call.body = chunk
+                                break
+                        else:
+                            raise requests.exceptions.ChunkedEncodingError("stream ended before the reply was done")
+                    policy.succeeded()
+                    text = "".join(chunks)
+                    if cache_key is not None and self.cache is not None and text.strip():
+                        self.cache.put(cache_key, text)
+                    return True
+                except LLMCancelled:
+                    return False
+                except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+                    if chunks:
+                        logger.error(f"Stream broke off after {len(chunks)} pieces: {e}")
+                        return False
+                    policy.failed(attempt, e, max_retries)
+        return False
+
+    def chat(self, messages: List[Dict[str, str]], max_retries: int = Config.MAX_RETRIES, stops=None,
+             ctx: RequestContext = None, chat_id: str = None, caller: str = "chat") -> Tuple[str, Dict[str, int]]:
+        """
+        Sends a message list to Ollama's /api/chat. Because earlier turns are sent unchanged, Ollama can reuse
+        its cached prefix instead of re-evaluating the whole conversation every turn. Turns of the same chat_id
+        go to the same backend while it's healthy, since that's where the cached prefix lives.
+
+        Returns:
+            tuple: (reply text, {"prompt_eval_count": ..., "eval_count": ...}).
+        Raises:
+            LLMUnavailableError: Ollama kept failing.
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": False,
+            "options": dict(self.options),
+        }
+        if stops is not None:
+            payload['stop'] = stops
+
+        policy = self.retry["chat"]
+        with CallMetrics(caller, "chat", ctx) as call:
+            for attempt in policy.attempts(max_retries):
+                call.attempts = attempt + 1
+                try:
+                    with self.scheduler.slot(Priority.INTERACTIVE, ctx), self.pool.lease(chat_id) as backend:
+                        response = backend.session.post(
+                            backend.chat_url,
+                            json=dict(payload, model=backend.model),
+                            timeout=Config.TIMEOUT
+                        )
+                        response.raise_for_status()
+                    body = call.body = response.json()
+                    policy.succeeded()
+                    return body.get('message', {}).get('content', ''), self._token_counts(body)
+                except LLMCancelled:
+                    return "", {}
+                except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+                    policy.failed(attempt, e, max_retries)
+        return "", {}
+
+    def chat_stream(self, messages: List[Dict[str, str]], max_retries: int = Config.MAX_RETRIES, stops=None,
+                    stats: Dict[str, int] = None, ctx: RequestContext = None, chat_id: str = None,
+                    caller: str = "chat") -> Iterator[str]:
+        """
+        Streaming version of chat. Token counts from the final chunk are written into `stats` if it is given.
+        Raises LLMUnavailableError if Ollama fails before any of the reply arrives.
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            "options": dict(self.options),
+        }
+        if stops is not None:
+            payload['stop'] = stops
+
+        policy = self.retry["chat"]
+        with CallMetrics(caller, "chat", ctx) as call:
+            for attempt in policy.attempts(max_retries):
+                call.attempts = attempt + 1
+                got_tokens = False
+                try:
+                    with self.scheduler.slot(Priority.INTERACTIVE, ctx), self.pool.lease(chat_id) as backend, \
+                            backend.session.post(backend.chat_url, json=dict(payload, model=backend.model),
+                                                 timeout=Config.TIMEOUT, stream=True) as response:
+                        response.raise_for_status()
+                        for line in response.iter_lines():
+                            if ctx is not None and ctx.is_cancelled:
+                                return
+                            if not line:
+                                continue
+                            chunk = json.loads(line)
+                            token = chunk.get('message', {}).get('content', '')
+                            if token:
+                                got_tokens = True
+                                yield token
+                            if chunk.get('done'):
+                                call.body = chunk
+                                if stats is not None:
+                                    stats.update(self._token_counts(chunk))
+                                break
+                    policy.succeeded()
+                    return
+                except LLMCancelled:
+                    return
+                except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+                    if got_tokens:
+                        logger.error(f"Chat stream broke off: {e}")
+                        return
+                    policy.failed(attempt, e, max_retries)
+
+    @staticmethod
+    def _token_counts(body: Dict[str, Any]) -> Dict[str, int]:
+        return {
+            "prompt_eval_count": body.get("prompt_eval_count", 0),
+            "eval_count": body.get("eval_count", 0),
+        }
+
+    @staticmethod
+    def _estimate_tokens(messages: List[Dict[str, str]]) -> int:
+        # Rough but safe: ~4 characters per token for English text
+        return sum(len(m.get("content", "")) for m in messages) // 4
+
+    def _fit_history(self, state: Dict[str, Any]):
+        """
+        Keeps a chat under its token budget. Once the last turn used more than CHAT_HISTORY_BUDGET of num_ctx,
+        everything but the system prompt and the last CHAT_KEEP_TURNS exchanges is folded into a running summary.
+        The system prompt (and with it, Ollama's cached prefix) is left untouched.
+        """
+        messages = state["messages"]
+        budget = int(self.options.get("num_ctx", 2048) * Config.CHAT_HISTORY_BUDGET)
+        used = max(state.get("context_tokens", 0), self._estimate_tokens(messages))
+        keep = 2 * Config.CHAT_KEEP_TURNS
+        # messages[0] is the system prompt, messages[1] may be an earlier summary
+        first = 2 if len(messages) > 1 and messages[1].get("summary") else 1
+        if used <= budget or len(messages) - first <= keep:
+            return
+
+        old_turns = messages[first:len(messages) - keep]
+        transcript = "\n\n".join(f"{m['role'].title()}: {m['content']}" for m in old_turns)
+        prompt = f"""Summarize this conversation between a researcher and an AI assistant in a short paragraph.
+Keep every fact, decision and open question the assistant will need to continue the conversation.
+
+{f"Summary of the conversation before this: {state['history_summary']}" if state.get("history_summary") else ""}
+
+{transcript}
+
+Summary:"""
+        state["history_summary"] = self.generate(prompt, use_cache=False, priority=Priority.INTERACTIVE,
+                                                 caller="compact_chat_history").strip()
+        summary_message = {
+            "role": "system",
+            "content": f"Summary of the earlier conversation: {state['history_summary']}",
+            "summary": True
+        }
+        state["messages"] = [messages[0], summary_message] + messages[len(messages) - keep:]
+        state["context_tokens"] = self._estimate_tokens(state["messages"])
+        logger.info(f"Chat {state['chat_id']}: folded {len(old_turns)} messages into a summary "
+                    f"({used} tokens > budget of {budget})")
+
+    @staticmethod
+    def _outgoing(messages: List[Dict[str, str]], notes: str = '', context: str = '') -> List[Dict[str, str]]:
+        # Our own bookkeeping keys don't go to Ollama, and notes are sent just before the newest question so
+        # they never change the (cached) prefix of the conversation
+        outgoing = [{"role": m["role"], "content": m["content"]} for m in messages]
+        if context:
+            outgoing[-1]["content"] = f"Relevant passages:\n\n{context}\n\nQuestion: {outgoing[-1]['content']}"
+        if notes:
+            outgoing.insert(len(outgoing) - 1, {"role": "system", "content": f"Notes to self: {notes}"})
+        return outgoing
+
+    def _start_search_chat_turn(self, query: str, chat_id: str = None) -> Tuple[str, List[Dict[str, str]], List[str]]:
+        if not chat_id or chat_id not in self.chat_state:
+            chat_id = self._new_chat_id()
             self.chat_state[chat_id] = {
                 "chat_id": chat_id,
                 "original_query": query,
                 "summary": "",
-                "full_context": "",
+                "messages": [{
+                    "role": "system",
+                    "content": "You are an academic research assistant AI that helps researchers compose search"
+                               " queries to find all of the most important related work in their field. The"
+                               " researcher will give you an initial query, and you should ask questions to get a"
+                               " better sense for the research questions and keywords to find the best related works."
+                               "\n\n"
+                               "After each researcher query, first decide if you have enough information to search."
+                               " If you are ready, provide a detailed summary of the ideas,"
+                               " which will be sent to an LLM to rephrase into search queries. "
+                               "Put ONLY the summary in [brackets], do not include dialogue or chit chat inside"
+                               " [brackets]. If you don't have enough information, ask one question at a time to the"
+                               " researcher to help get a better idea of what to search for."
+                }],
+                "context_tokens": 0,
                 "ready_to_search": False,
                 "most_recent_response": ""
             }
-            prompt = f"You are an academic research assistant AI that helps researchers compose search queries" \
-                     f" to find all of the most important related work in their field. The researcher will" \
-                     f" give you an initial query, and you should ask questions to get a better sense for the" \
-                     f" research questions and keywords to find the best related works." \
-                     f"\n\n" \
-                     f"After each researcher query, first decide if you have enough information to search." \
-                     f" If you are ready, provide a detailed summary of the ideas," \
-                     f" which will be sent to an LLM to rephrase into search queries. " \
-                     f"Put ONLY the summary in [brackets], do not include dialogue or chit chat inside [brackets]." \
-                     f" If you don't have enough information, ask one question at a time to the researcher to help " \
-                     f"get a better idea of what to search for." \
-                     f"\n\n" \
-                     f"Researcher: {query}\n\nAI Assistant: "
-        else:
-            prompt = f"{self.chat_state[chat_id]['full_context']}\n\nResearcher: {query}\n\nAI Assistant: "
+        state = self.chat_state[chat_id]
+        self._fit_history(state)
+        state["messages"].append({"role": "user", "content": query})
+        stops = ['Researcher:', '\nResearcher:', 'Researcher: ',
+                 '\nResearcher: ', '\nAI Assistant:', '\nAI Assistant: ']
+        return chat_id, self._outgoing(state["messages"]), stops
 
-        response = self.generate(prompt, stops=['Researcher:', '\nResearcher:', 'Researcher: ',
-                                                '\nResearcher: ', '\nAI Assistant:', '\nAI Assistant: '])
-        response = re.sub(r'\n', '<br />', response)
-        full_context = f"{prompt}{response}"
-        self.chat_state[chat_id]["full_context"] = full_context
+    def _finish_search_chat_turn(self, chat_id: str, response: str, stats: Dict[str, int]):
+        state = self.chat_state[chat_id]
+        state["messages"].append({"role": "assistant", "content": response})
+        state["context_tokens"] = stats.get("prompt_eval_count", 0) + stats.get("eval_count", 0)
         response = re.sub(r'\[brackets]|\[]', '', response)  # Remove [brackets] or []
         response = re.sub(r'\n', '<br />', response)
         summary = extract_bracket_content(response)
         # Can't believe I have to guard against this...
         if summary and len(summary[0]) > 0:
-            self.chat_state[chat_id]["ready_to_search"] = True
-            self.chat_state[chat_id]["summary"] = summary
-        self.chat_state[chat_id]["most_recent_response"] = response
-        return self.chat_state
-
-    def chat_about_research(self, query: str, chat_id: str = None) -> Dict[str, Any]:
-        if self.searched_already:
-            if not chat_id:
-                chat_id = str(time.time())
-            if self.chat_state[chat_id]["started_chat"]:
-                scratch_pad = ''
-                if self.chat_state[chat_id]["summary"]:
-                    scratch_pad = f"Notes to self: {self.chat_state[chat_id]['summary']}\n\n"
-                prompt = f"{self.chat_state[chat_id]['full_context']}\n\nResearcher: {query}" \
-                         f"\n\n{scratch_pad}Expert Assistant: "
-            else:
-                paper_text = self.chat_state[chat_id]["paper_text"]
-                prompt = f"You are an expert helping a researcher to read a paper." \
-                         f" The researcher is interested in preparing for a project" \
-                         f" about \"{self.original_search_query}\"." \
-                         f"\nYou will help them work through ideas for this," \
-                         f" bolstered by the recent paper you just read:\n{paper_text}\n\n" \
-                         f"If you want to do any reasoning or make notes that don't go to the researcher," \
-                         f" put such notes in <<double angle brackets>>. The researcher WILL NOT see text in" \
-                         f" <angle brackets>.\nFinally, keep it concise and informative." \
-                         f"\nResearcher: {query}\n\nExpert Assistant: "
-                self.chat_state[chat_id]["full_context"] = prompt
-                self.chat_state[chat_id]["most_recent_response"] = ""
-                self.chat_state[chat_id]["summary"] = ""
-                self.chat_state[chat_id]["ready_to_search"] = False
-                self.chat_state[chat_id]["started_chat"] = True
-
-            response = self.generate(prompt, stops=['Researcher:', '\nResearcher:', 'Researcher: ',
-                                                    '\nResearcher: ', '\nExpert Assistant:', '\nExpert Assistant: '])
-            scratch_pad = extract_bracket_content(response, angle=True)
-            response = re.sub(r'\n', '<br />', response)
-            if scratch_pad:
-                self.chat_state[chat_id]["summary"] += f"{scratch_pad}\n"
-                response = re.sub(r'<<.*?>>', '', response)  # Remove scratch pad for the response
-            self.chat_state[chat_id]["full_context"] += f"\n\nResearcher: {query}\n\nExpert Assistant: {response}"
-            self.chat_state[chat_id]["most_recent_response"] = response
+            state["ready_to_search"] = True
+            state["summary"] = summary
+        state["most_recent_response"] = response
+        self.chat_state.put(chat_id, state)
+
+    def _abandon_turn(self, chat_id: str):
+        # The model never answered: drop the unanswered question so the history still alternates
+        state = self.chat_state.get(chat_id)
+        if state is not None and state["messages"] and state["messages"][-1]["role"] == "user":
+            state["messages"].pop()
+            self.chat_state.put(chat_id, state)
+
+    def chat_to_search(self, query: str, chat_id: str = None, ctx: RequestContext = None) -> Dict[str, Any]:
+        chat_id, messages, stops = self._start_search_chat_turn(query, chat_id)
+        try:
+            response, stats = self.chat(messages, stops=stops, ctx=ctx, chat_id=chat_id, caller="chat_to_search")
+        except LLMUnavailableError:
+            self._abandon_turn(chat_id)
+            raise
+        self._finish_search_chat_turn(chat_id, response, stats)
+        return self.chat_state[chat_id]
+
+    def embed(self, texts: List[str], batch_size: int = 64, priority: int = Priority.INTERACTIVE,
+              ctx: RequestContext = None, caller: str = "embed") -> Optional[np.ndarray]:
+        """
+        Embeds texts with Ollama's embedding endpoint (Config.OLLAMA_EMBED_MODEL).
+
+        Returns:
+            np.ndarray: float32 matrix of unit-length rows, one per text, or None if embeddings are turned off or
+            the endpoint failed (callers fall back to lexical matching).
+        """
+        if not Config.OLLAMA_EMBED_MODEL or not texts:
+            return None
+        rows = []
+        # Embeddings have a cheap fallback, so they get one attempt each; the breaker stops us from waiting on
+        # an embedding endpoint that is down
+        policy = self.retry["embed"]
+        try:
+            for i in range(0, len(texts), batch_size):
+                with CallMetrics(caller, "embed", ctx) as call:
+                    for attempt in policy.attempts(1):
+                        call.attempts = attempt + 1
+                        try:
+                            with self.scheduler.slot(priority, ctx), self.pool.lease() as backend:
+                                response = backend.session.post(
+                                    backend.embed_url,
+                                    json={"model": Config.OLLAMA_EMBED_MODEL, "input": texts[i:i + batch_size]},
+                                    timeout=Config.TIMEOUT
+                                )
+                                response.raise_for_status()
+                            call.body = response.json()
+                            rows.extend(call.body.get("embeddings", []))
+                            policy.succeeded()
+                        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+                            policy.failed(attempt, e, 1)
+        except LLMCancelled:
+            return None
+        except LLMUnavailableError as e:
+            logger.warning(f"Embedding request failed, falling back to keyword matching: {e}")
+            return None
+        if len(rows) != len(texts):
+            return None
+        matrix = np.asarray(rows, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def add_paper(self, title: str, text: str, chat_id: str = None, session_id: str = None) -> str:
+        """
+        Indexes a paper's text for retrieval and attaches it to a paper chat, creating a new chat unless chat_id
+        already refers to one. Returns the chat id.
+        """
+        index = PaperIndex(title, text, Config.RETRIEVAL_CHUNK_WORDS, Config.RETRIEVAL_CHUNK_OVERLAP,
+                           lambda texts: self.embed(texts, caller="index_paper"))
+        state = self.chat_state.get(chat_id)
+        if state is not None and "papers" in state:
+            state["papers"].append(index)
+            self.chat_state.put(chat_id, state)
+            return chat_id
+        chat_id = self._new_chat_id()
+        self.chat_state[chat_id] = {
+            "chat_id": chat_id,
+            "project_query": self.session_state(session_id)["original_search_query"],
+            "papers": [index],
+            "messages": [],
+            "most_recent_response": "The paper's content has been loaded into the chat context.",
+            "started_chat": False
+        }
+        return chat_id
+
+    @staticmethod
+    def _research_system_prompt(titles: List[str], project_query: str) -> Dict[str, str]:
+        paper_list = "\n".join(f"- {title}" for title in titles)
+        return {
+            "role": "system",
+            "content": f"You are an expert helping a researcher to read papers."
+                       f" The researcher is interested in preparing for a project"
+                       f" about \"{project_query}\"."
+                       f"\nYou will help them work through ideas for this,"
+                       f" bolstered by the recent papers you just read:\n{paper_list}\n\n"
+                       f"With each question you will be given the most relevant passages from these papers."
+                       f"\n\n"
+                       f"If you want to do any reasoning or make notes that don't go to the researcher,"
+                       f" put such notes in <<double angle brackets>>. The researcher WILL NOT see text in"
+                       f" <angle brackets>.\nFinally, keep it concise and informative.",
+            "titles": titles
+        }
+
+    def _start_research_chat_turn(self, query: str, chat_id: str) -> Tuple[str, List[Dict[str, str]], List[str]]:
+        state = self.chat_state[chat_id]
+        titles = [paper.title for paper in state["papers"]]
+        if not state["started_chat"]:
+            state["messages"] = [self._research_system_prompt(titles, state["project_query"])]
+            state["context_tokens"] = 0
+            state["most_recent_response"] = ""
+            state["summary"] = ""
+            state["ready_to_search"] = False
+            state["started_chat"] = True
+        elif state["messages"][0].get("titles") != titles:
+            # Another paper was added to this chat
+            state["messages"][0] = self._research_system_prompt(titles, state["project_query"])
+        self._fit_history(state)
+        state["messages"].append({"role": "user", "content": query})
 
-            return self.chat_state
+        # Only the best passages go to the model, so the prompt stays the same size however long the papers are.
+        # They are attached to the newest question only and are not kept in the history.
+        question_embedding = None
+        if any(paper.embeddings is not None for paper in state["papers"]):
+            embedded = self.embed([query], caller="retrieve_passages")
+            question_embedding = embedded[0] if embedded is not None else None
+        passages = retrieve(state["papers"], query, Config.RETRIEVAL_TOP_K, question_embedding)
+        context = "\n\n".join(f"[{title}]\n{chunk}" for title, chunk in passages)
+
+        stops = ['Researcher:', '\nResearcher:', 'Researcher: ',
+                 '\nResearcher: ', '\nExpert Assistant:', '\nExpert Assistant: ']
+        return chat_id, self._outgoing(state["messages"], state["summary"], context), stops
+
+    def _finish_research_chat_turn(self, chat_id: str, response: str, stats: Dict[str, int]):
+        state = self.chat_state[chat_id]
+        scratch_pad = extract_bracket_content(response, angle=True)
+        if scratch_pad:
+            state["summary"] += f"{scratch_pad}\n"
+            response = re.sub(r'<<.*?>>', '', response)  # Remove scratch pad for the response
+        state["messages"].append({"role": "assistant", "content": response})
+        state["context_tokens"] = stats.get("prompt_eval_count", 0) + stats.get("eval_count", 0)
+        state["most_recent_response"] = re.sub(r'\n', '<br />', response)
+        self.chat_state.put(chat_id, state)
+
+    def _is_paper_chat(self, chat_id: str = None, session_id: str = None) -> bool:
+        if not self.session_state(session_id)["searched_already"]:
+            return False
+        state = self.chat_state.get(chat_id)
+        return state is not None and "papers" in state
+
+    def chat_about_research(self, query: str, chat_id: str = None, session_id: str = None) -> Dict[str, Any]:
+        ctx = RequestContext(session_id)
+        if self._is_paper_chat(chat_id, session_id):
+            chat_id, messages, stops = self._start_research_chat_turn(query, chat_id)
+            try:
+                response, stats = self.chat(messages, stops=stops, ctx=ctx, chat_id=chat_id,
+                                            caller="chat_about_research")
+            except LLMUnavailableError:
+                self._abandon_turn(chat_id)
+                raise
+            self._finish_research_chat_turn(chat_id, response, stats)
+            return self.chat_state[chat_id]
         else:
-            return self.chat_to_search(query, chat_id)
+            return self.chat_to_search(query, chat_id, ctx)
+
+    def chat_about_research_stream(self, query: str, chat_id: str = None, session_id: str = None,
+                                   ctx: RequestContext = None) -> Iterator[Tuple[str, Any]]:
+        """
+        Streaming version of chat_about_research.
+
+        Yields ("token", text) for each piece of the reply the researcher should see (scratch pad notes in
+        <<double angle brackets>> are held back as they stream), then ("done", chat_state[chat_id]) once the
+        turn has been recorded. Cancelling ctx (the client went away) drops the call if it is still waiting for
+        a slot, or ends the stream.
+        """
+        ctx = ctx or RequestContext(session_id)
+        paper_chat = self._is_paper_chat(chat_id, session_id)
+        if paper_chat:
+            chat_id, messages, stops = self._start_research_chat_turn(query, chat_id)
+            scratch_pad = ScratchPadFilter()
+        else:
+            chat_id, messages, stops = self._start_search_chat_turn(query, chat_id)
+            scratch_pad = None
+
+        chunks = []
+        stats = {}
+        recorded = False
+        try:
+            for token in self.chat_stream(messages, stops=stops, stats=stats, ctx=ctx, chat_id=chat_id,
+                                          caller="chat_about_research" if paper_chat else "chat_to_search"):
+                chunks.append(token)
+                visible = scratch_pad.feed(token) if scratch_pad else token
+                if visible:
+                    yield "token", visible
+            if ctx.is_cancelled:
+                return
+            if scratch_pad:
+                visible = scratch_pad.flush()
+                if visible:
+                    yield "token", visible
+
+            response = "".join(chunks)
+            if paper_chat:
+                self._finish_research_chat_turn(chat_id, response, stats)
+            else:
+                self._finish_search_chat_turn(chat_id, response, stats)
+            recorded = True
+        finally:
+            # The LLM failed, or the client went away (ctx cancelled, or this generator closed): the reply was
+            # never recorded, so drop the question too
+            if not recorded:
+                self._abandon_turn(chat_id)
+        yield "done", self.chat_state[chat_id]
 
-    def rephrase_query(self, query: str) -> list:
-        self.original_search_query = query
+    def rephrase_query(self, query: str, session_id: str = None, ctx: RequestContext = None) -> list:
+        state = self.session_state(session_id)
+        state["original_search_query"] = query
+        self.sessions.put(session_id or "", state)
         prompt = f"""Task: Rephrase the following query to optimize it for academic paper search.
 Guidelines:
 - Add relevant academic keywords and phrases
@@ -195,11 +883,13 @@ Your query is:
 Query: "{query}"
 
 Reasoning:"""
-        response = self.generate(prompt).strip()
+        response = self.generate(prompt, priority=Priority.INTERACTIVE, ctx=ctx or RequestContext(session_id),
+                                 caller="rephrase_query").strip()
 
         return extract_bracket_content(response)
 
-    def rate_paper_relevance(self, query: str, paper: Dict[str, Any]) -> float:
+    @staticmethod
+    def _paper_text(paper: Dict[str, Any]) -> str:
         abstract = paper.get('abstract', '')
         if abstract is None or len(abstract) < 1:
             # If we don't have an abstract, get a TLDR
@@ -207,8 +897,26 @@ Reasoning:"""
             if tldr:
                 tldr = tldr.get("text")
                 abstract = tldr
+        return abstract or ''
+
+    @staticmethod
+    def _parse_score(value: Any) -> Optional[float]:
+        try:
+            score = float(value)
+        except (TypeError, ValueError):
+            return None
+        if not math.isfinite(score):
+            return None
+        return min(max(score, 0.0), 100.0)
+
+    def rate_paper_relevance(self, query: str, paper: Dict[str, Any], ctx: RequestContext = None
+                             ) -> Optional[float]:
+        """
+        Scores one paper against the query. Returns None (and logs it) if the model's reply is not a number.
+        """
+        abstract = self._paper_text(paper)
         # If we still don't have anything, give up.
-        if abstract is None or len(abstract) < 1:
+        if not abstract:
             return 0.0
         prompt = f"""Rate the relevance of this paper to the query on a scale of 0-100:
 
@@ -224,14 +932,87 @@ Consider:
 
 Return only the numerical score (0-100):"""
 
+        response = self.generate(prompt, priority=Priority.RELEVANCE, ctx=ctx, caller="rate_paper_relevance").strip()
+        score = self._parse_score(response)
+        if score is None:
+            logger.warning(f"Could not parse relevance score for paper {paper.get('paperId')}: {response[:50]!r}")
+        return score
+
+    def rate_papers_relevance(self, query: str, papers: List[Dict[str, Any]], ctx: RequestContext = None
+                              ) -> Dict[str, Optional[float]]:
+        """
+        Scores several papers against the query with a single JSON-mode generate call.
+
+        Papers are listed under short keys ([1], [2], ...) to keep the prompt small, and the model is asked for a
+        JSON object mapping those keys to scores. Any paper missing from (or unparseable in) the reply is re-scored
+        on its own with rate_paper_relevance.
+
+        Args:
+            query (str): The original search query.
+            papers (list): Semantic Scholar paper records.
+            ctx (RequestContext): Session and cancellation for the scheduler.
+        Returns:
+            dict: paperId -> score in [0, 100], or None if the paper could not be scored at all.
+        """
+        scores = {}
+        keyed = {}
+        for paper in papers:
+            if not self._paper_text(paper):
+                scores[paper.get('paperId')] = 0.0
+            else:
+                keyed[str(len(keyed) + 1)] = paper
+        if not keyed:
+            return scores
+        if len(keyed) == 1:
+            paper = next(iter(keyed.values()))
+            scores[paper.get('paperId')] = self.rate_paper_relevance(query, paper, ctx)
+            return scores
+
+        papers_text = "\n\n".join([
+            f"[{key}] Title: {paper.get('title', 'N/A')}\nAbstract: {self._paper_text(paper)}"
+            for key, paper in keyed.items()
+        ])
+        prompt = f"""Rate the relevance of each paper to the query on a scale of 0-100.
+
+Query: {query}
+
+Papers:
+
+{papers_text}
+
+Consider:
+- Direct relevance to query topic
+- Methodology alignment
+- Potential usefulness
+- Research focus match
+
+Return only a JSON object mapping each paper number to its numerical score (0-100), for example {{"1": 85, "2": 10}}:"""
+
+        response = self.generate(prompt, fmt="json", priority=Priority.RELEVANCE, ctx=ctx,
+                                 caller="rate_papers_relevance").strip()
         try:
-            response = self.generate(prompt).strip()
-            return float(response)
-        except:
-            return 0.0
+            parsed = json.loads(response)
+        except json.JSONDecodeError:
+            parsed = {}
+        if not isinstance(parsed, dict):
+            parsed = {}
 
-    def summarize_paper(self, original_query, paper: Dict[str, Any]) -> str:
-        prompt = f"""Summarize the following academic paper in 3-4 informative sentences, 
+        missing = []
+        for key, paper in keyed.items():
+            score = self._parse_score(parsed.get(key, parsed.get(f"[{key}]")))
+            if score is None:
+                missing.append(paper)
+            else:
+                scores[paper.get('paperId')] = score
+        if missing:
+            logger.info(f"Batch relevance reply was missing {len(missing)}/{len(keyed)} papers, scoring them one by one")
+        for paper in missing:
+            scores[paper.get('paperId')] = self.rate_paper_relevance(query, paper, ctx)
+        return scores
+
+    @staticmethod
+    def _summary_prompt(original_query, paper: Dict[str, Any]) -> str:
+        return f"""Summarize the following academic paper in 3-4 informative sentences, 
         focusing on how it relates to the original query:
 
 Original query: {original_query}
@@ -247,13 +1028,73 @@ Focus on:
 Remember to avoid extraneous language or colloquial commentary, only return the paper summary.
 
 Summary:"""
-        paper_summary = self.generate(prompt).strip()
+
+    def summarize_paper(self, original_query, paper: Dict[str, Any], ctx: RequestContext = None) -> str:
+        paper_summary = self.generate(self._summary_prompt(original_query, paper), ctx=ctx,
+                                      caller="summarize_paper").strip()
         return paper_summary
 
-    def generate_timeline(self, papers: List[Dict[str, Any]], with_citations: bool = True) -> str:
-        if not papers:
-            return "No papers available to generate timeline."
+    def summarize_paper_stream(self, original_query, paper: Dict[str, Any], ctx: RequestContext = None
+                               ) -> Iterator[str]:
+        return self.generate_stream(self._summary_prompt(original_query, paper), ctx=ctx, caller="summarize_paper")
+
+    @staticmethod
+    def _general_summary_prompt(paper: Dict[str, Any]) -> str:
+        return f"""Summarize the following academic paper in 3-4 informative sentences:
 
+Title: {paper.get('title', 'N/A')}
+Authors: {', '.join(author.get('name', '') for author in paper.get('authors', []))}
+Abstract: {paper.get('abstract', 'N/A')}
+
+Focus on:
+- Main research contribution
+- Key findings or methodology
+- Practical implications
+
+Remember to avoid extraneous language or colloquial commentary, only return the paper summary.
+
+Summary:"""
+
+    def summarize_paper_general(self, paper: Dict[str, Any], ctx: RequestContext = None,
+                                priority: int = Priority.BACKGROUND) -> str:
+        """
+        A summary that doesn't depend on the query, so it's stored and reused by every later search. Written by
+        the summary worker in the background, or by a search (at its own priority) that reaches the paper first.
+        """
+        return self.generate(self._general_summary_prompt(paper), priority=priority, ctx=ctx,
+                             caller="summarize_paper_general").strip()
+
+    def summarize_paper_general_stream(self, paper: Dict[str, Any], ctx: RequestContext = None,
+                                       priority: int = Priority.BACKGROUND) -> Iterator[str]:
+        return self.generate_stream(self._general_summary_prompt(paper), priority=priority, ctx=ctx,
+                                    caller="summarize_paper_general")
+
+    @staticmethod
+    def _relate_summary_prompt(original_query, paper: Dict[str, Any], summary: str) -> str:
+        return f"""Here is the summary of an academic paper. In one sentence, say how the paper relates to the \
+original query.
+
+Original query: {original_query}
+Title: {paper.get('title', 'N/A')}
+Summary: {summary}
+
+Remember to avoid extraneous language or colloquial commentary, only return the one sentence.
+
+Sentence:"""
+
+    def relate_summary(self, original_query, paper: Dict[str, Any], summary: str, ctx: RequestContext = None) -> str:
+        """The query-specific step for a paper that already has a general summary."""
+        return self.generate(self._relate_summary_prompt(original_query, paper, summary), ctx=ctx,
+                             caller="relate_summary").strip()
+
+    def relate_summary_stream(self, original_query, paper: Dict[str, Any], summary: str,
+                              ctx: RequestContext = None) -> Iterator[str]:
+        return self.generate_stream(self._relate_summary_prompt(original_query, paper, summary), ctx=ctx,
+                                    caller="relate_summary")
+
+    @staticmethod
+    def _timeline_prompt(papers: List[Dict[str, Any]], with_citations: bool = True
+                         ) -> Tuple[str, List[Dict[str, Any]], Dict[str, str]]:
         # Sort papers by date
         sorted_papers = sorted(
             [p for p in papers if p.get('publication_date')],
@@ -264,7 +1105,6 @@ Summary:"""
         if with_citations:
             for i, paper in enumerate(sorted_papers, 1):
                 citations[paper['paper_id']] = f"[{i}]"
-                paper['citation_number'] = i
 
         papers_text = "\n".join([
             f"- {paper.get('publication_date', 'N/A')}: {paper.get('title', 'N/A')} "
@@ -286,8 +1126,99 @@ Guidelines:
 - Format for display in HTML
 
 Timeline:"""
-        timeline = self.generate(prompt,
-                                 stops=["References:", "\nReferences:", "Bibliography:", "\nBibliography:"]).strip()
+        return prompt, sorted_papers, citations
+
+    @staticmethod
+    def _merge_timelines_prompt(partials: List[str]) -> str:
+        parts_text = "\n\n".join(f"Part {i}:\n{partial}" for i, partial in enumerate(partials, 1))
+        return f"""Merge these partial research timelines into one timeline. Each part covers different papers, oldest \
+first. Do not add new papers, use ONLY what is below:
+
+{parts_text}
+
+Guidelines:
+- Keep every citation number in square brackets exactly as written
+- Combine entries about the same idea, keeping all of their citations
+- Focus on evolution of ideas and methodologies
+- Highlight key breakthroughs and innovations
+- Use bullet points with years
+- Do not include a list of references, I will add that
+- Keep it concise but informative
+- Format for display in HTML
+
+Timeline:"""
+
+    def _final_timeline_prompt(self, papers: List[Dict[str, Any]], with_citations: bool = True,
+                               ctx: RequestContext = None) -> Tuple[str, List[Dict[str, Any]], Dict[str, str]]:
+        """
+        The prompt that produces the timeline. Small paper sets get a single prompt with every summary. Past
+        REPORT_GROUP_SIZE papers that would overflow num_ctx (or just take very long), so the papers are split
+        by year, partial timelines are generated in parallel, and the returned prompt merges them. Cancelling ctx
+        drops the partial calls that haven't started yet.
+        """
+        prompt, sorted_papers, citations = self._timeline_prompt(papers, with_citations)
+        if not 0 < Config.REPORT_GROUP_SIZE < len(sorted_papers):
+            return prompt, sorted_papers, citations
+        groups = group_by_year(sorted_papers, Config.REPORT_GROUP_SIZE)
+        partials = self._generate_partials(groups, self._timeline_prompt, citations, with_citations, TIMELINE_STOPS,
+                                           "generate_timeline", ctx)
+        prompt = self._reduce_partials(partials, self._merge_timelines_prompt, TIMELINE_STOPS, "generate_timeline",
+                                       ctx)
+        return prompt, sorted_papers, citations
+
+    def _generate_partials(self, groups: List[List[Dict[str, Any]]], build_prompt, citations: Dict[str, str],
+                           with_citations: bool, stops: List[str] = None, caller: str = "generate",
+                           ctx: RequestContext = None) -> List[str]:
+        """
+        Map step: one report per group, generated in parallel. Each group's prompt numbers its papers from [1],
+        so it doesn't change when papers are added elsewhere and repeat runs come from the LLM cache. Citations
+        in the results are renumbered to match the full report.
+        """
+        def run(index: int) -> str:
+            prompt, group_papers, local = build_prompt(groups[index], with_citations)
+            text = self.generate(prompt, stops=stops, priority=Priority.REPORT, ctx=ctx,
+                                 caller=f"{caller}_partial").strip()
+            if not with_citations:
+                return text
+            numbering = {int(local[p['paper_id']][1:-1]): int(citations[p['paper_id']][1:-1]) for p in group_papers}
+            return remap_citations(text, numbering)
+
+        partials = {}
+        for index, text, error in bounded_map_unordered(run, range(len(groups)), Config.LLM_WORKERS):
+            if error is not None:
+                raise error
+            partials[index] = text
+        logger.info(f"Generated {len(groups)} partial reports")
+        return [partials[i] for i in range(len(groups)) if partials[i]]
+
+    def _reduce_partials(self, partials: List[str], build_prompt, stops: List[str] = None,
+                         caller: str = "generate", ctx: RequestContext = None) -> str:
+        """
+        Reduce step: merges REPORT_REDUCE_FANIN partial reports at a time (in parallel) until one prompt can
+        take the rest, and returns that final prompt for the caller to generate or stream.
+        """
+        fan_in = max(2, Config.REPORT_REDUCE_FANIN)
+        while len(partials) > fan_in and not (ctx is not None and ctx.is_cancelled):
+            chunks = [partials[i:i + fan_in] for i in range(0, len(partials), fan_in)]
+            merged = {}
+            for index, text, error in bounded_map_unordered(
+                    lambda i: self.generate(build_prompt(chunks[i]), stops=stops, priority=Priority.REPORT, ctx=ctx,
+                                            caller=f"{caller}_merge").strip(),
+                    range(len(chunks)), Config.LLM_WORKERS):
+                if error is not None:
+                    raise error
+                merged[index] = text
+            partials = [merged[i] for i in range(len(chunks)) if merged[i]]
+        return build_prompt(partials)
+
+    def generate_timeline(self, papers: List[Dict[str, Any]], with_citations: bool = True,
+                          ctx: RequestContext = None) -> str:
+        if not papers:
+            return "No papers available to generate timeline."
+
+        prompt, sorted_papers, citations = self._final_timeline_prompt(papers, with_citations, ctx)
+        timeline = self.generate(prompt, stops=TIMELINE_STOPS, priority=Priority.REPORT, ctx=ctx,
+                                 caller="generate_timeline").strip()
         if with_citations:
             # Add bibliography
             bibliography = add_citations(sorted_papers=sorted_papers, citations=citations, ref_text=timeline)
@@ -295,9 +1226,30 @@ Timeline:"""
 
         return timeline
 
-    def generate_future_work(self, papers: List[Dict[str, Any]], with_citations: bool = True, cutoff: int = 10) -> str:
+    def generate_timeline_stream(self, papers: List[Dict[str, Any]], with_citations: bool = True,
+                                 ctx: RequestContext = None) -> Iterator[Tuple[str, str]]:
+        """
+        Streaming version of generate_timeline: yields ("token", text) pieces, then ("done", timeline) with the
+        finished timeline and its bibliography. For large paper sets only the final merge is streamed.
+        """
         if not papers:
-            return "No papers available to generate future work ideas."
+            yield "done", "No papers available to generate timeline."
+            return
+
+        prompt, sorted_papers, citations = self._final_timeline_prompt(papers, with_citations, ctx)
+        chunks = []
+        for token in self.generate_stream(prompt, stops=TIMELINE_STOPS, priority=Priority.REPORT, ctx=ctx,
+                                          caller="generate_timeline"):
+            chunks.append(token)
+            yield "token", token
+        timeline = "".join(chunks).strip()
+        if with_citations:
+            timeline += add_citations(sorted_papers=sorted_papers, citations=citations, ref_text=timeline)
+        yield "done", timeline
+
+    @staticmethod
+    def _future_work_prompt(papers: List[Dict[str, Any]], with_citations: bool = True, cutoff: int = 10
+                            ) -> Tuple[str, List[Dict[str, Any]], Dict[str, str]]:
         papers = sorted(
             papers,
             key=lambda p_id: p_id.get('relevance', 0),
@@ -327,11 +1279,37 @@ Guidelines:
 - Format for display in HTML
 
 Future work ideas:"""
+        return prompt, papers, citations
+
+    def generate_future_work(self, papers: List[Dict[str, Any]], with_citations: bool = True, cutoff: int = 10,
+                             ctx: RequestContext = None) -> str:
+        if not papers:
+            return "No papers available to generate future work ideas."
 
-        future_work = self.generate(prompt).strip()
+        prompt, papers, citations = self._future_work_prompt(papers, with_citations, cutoff)
+        future_work = self.generate(prompt, priority=Priority.REPORT, ctx=ctx, caller="generate_future_work").strip()
 
         if with_citations:
             bibliography = add_citations(sorted_papers=papers, citations=citations, ref_text=future_work)
             future_work += bibliography
 
         return future_work
+
+    def generate_future_work_stream(self, papers: List[Dict[str, Any]], with_citations: bool = True,
+                                    cutoff: int = 10, ctx: RequestContext = None) -> Iterator[Tuple[str, str]]:
+        """
+        Streaming version of generate_future_work: yields ("token", text) pieces, then ("done", future_work).
+        """
+        if not papers:
+            yield "done", "No papers available to generate future work ideas."
+            return
+
+        prompt, papers, citations = self._future_work_prompt(papers, with_citations, cutoff)
+        chunks = []
+        for token in self.generate_stream(prompt, priority=Priority.REPORT, ctx=ctx, caller="generate_future_work"):
+            chunks.append(token)
+            yield "token", token
+        future_work = "".join(chunks).strip()
+        if with_citations:
+            future_work += add_citations(sorted_papers=papers, citations=citations, ref_text=future_work)
+        yield "done", future_work
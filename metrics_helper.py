@@ -0,0 +1,177 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Histogram buckets (seconds) wide enough for a 10ms cache lookup and a 5 minute generation
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms in the Prometheus text format, without the client library.
+
+    Metrics are declared once (counter() / histogram()) and then updated with labels, e.g.
+    metrics.inc("llm_requests_total", caller="summarize_paper", outcome="ok"). Collectors registered with
+    add_collector() are called at render time for values that live elsewhere (queue depths, backend health).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}          # name -> (kind, help, buckets)
+        self.counters = {}      # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> [bucket counts..., sum, count]
+        self.collectors = []
+
+    def counter(self, name: str, help_text: str):
+        self.meta[name] = ("counter", help_text, None)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.meta[name] = ("histogram", help_text, tuple(sorted(buckets)))
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, str, Dict[str, Any], float]]]):
+        """collector() returns (name, kind, help, labels, value) samples, kind being "gauge" or "counter"."""
+        self.collectors.append(collector)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self.meta[name][2]
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            state = self.histograms.get(key)
+            if state is None:
+                state = self.histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(state) for key, state in self.histograms.items()}
+        for name, (kind, help_text, buckets) in sorted(self.meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                continue
+            for (metric, labels), state in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(buckets, state):
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {state[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {state[-2]:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+
+        described = set()
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {kind}")
+                labels = tuple(sorted((k, str(v)) for k, v in labels.items()))
+                lines.append(f"{name}{_format_labels(labels)} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """
+    Timings for one request, sent back as a {"type": "trace"} event when the client asks for it: how long each
+    stage took (stages overlap, so both busy time and first start/last end are kept) and what the LLM did.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.llm = {}
+
+    def add_stage(self, stage: str, started: float, ended: float):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "first_start": None, "last_end": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += ended - started
+            start_offset = started - self.started
+            if entry["first_start"] is None or start_offset < entry["first_start"]:
+                entry["first_start"] = start_offset
+            entry["last_end"] = max(entry["last_end"], ended - self.started)
+
+    def add_llm_call(self, caller: str, seconds: float, prompt_tokens: int, completion_tokens: int, outcome: str):
+        with self.lock:
+            entry = self.llm.setdefault(caller, {"calls": 0, "seconds": 0.0, "prompt_tokens": 0,
+                                                 "completion_tokens": 0, "failed": 0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            if outcome != "ok":
+                entry["failed"] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        def rounded(entry: Dict[str, Any]) -> Dict[str, Any]:
+            return {k: round(v, 3) if isinstance(v, float) else v for k, v in entry.items()}
+
+        with self.lock:
+            return {
+                "elapsed": round(time.perf_counter() - self.started, 3),
+                "stages": {stage: rounded(entry) for stage, entry in self.stages.items()},
+                "llm": {caller: rounded(entry) for caller, entry in self.llm.items()},
+            }
+
+
+@contextmanager
+def timed(stage: str, trace: Optional[Trace] = None) -> Iterator[None]:
+    """Times a block as one occurrence of a search stage, for /metrics and (if given) the request's trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        metrics.observe("search_stage_seconds", ended - started, stage=stage)
+        if trace is not None:
+            trace.add_stage(stage, started, ended)
+
+
+metrics = MetricsRegistry()
+metrics.counter("llm_requests_total", "Ollama calls by caller, endpoint and outcome (ok, error, cancelled).")
+metrics.counter("llm_retries_total", "Extra attempts made by Ollama calls.")
+metrics.counter("llm_cache_hits_total", "LLM calls answered from the cache.")
+metrics.counter("llm_prompt_tokens_total", "Prompt tokens evaluated by Ollama (prompt_eval_count).")
+metrics.counter("llm_completion_tokens_total", "Tokens generated by Ollama (eval_count).")
+metrics.counter("llm_prompt_eval_seconds_total", "Time Ollama spent evaluating prompts (prompt_eval_duration).")
+metrics.counter("llm_eval_seconds_total", "Time Ollama spent generating tokens (eval_duration).")
+metrics.histogram("llm_request_seconds", "Wall time of Ollama calls, including queueing and retries.")
+metrics.histogram("llm_queue_seconds", "Time LLM calls waited for a scheduler slot, by priority class.")
+metrics.counter("semantic_scholar_requests_total", "Semantic Scholar HTTP attempts by endpoint and status.")
+metrics.histogram("semantic_scholar_request_seconds", "Duration of Semantic Scholar HTTP attempts.")
+metrics.histogram("semantic_scholar_rate_limit_wait_seconds", "Time spent waiting for the Semantic Scholar "
+                                                              "rate limiter.")
+metrics.histogram("search_stage_seconds", "Time spent in each stream_search stage (one sample per occurrence).")
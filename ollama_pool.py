@@ -0,0 +1,201 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional, Iterator, Dict, Any
+
+import requests
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Backend:
+    """
+    One Ollama server: its endpoints, the model name it serves, and how many calls it takes at once.
+    """
+
+    def __init__(self, base_url: str, model: str, max_concurrent: int, generate_url: str = None,
+                 chat_url: str = None, embed_url: str = None):
+        base_url = base_url.rstrip("/")
+        self.base_url = base_url
+        self.name = base_url
+        self.model = model
+        self.max_concurrent = max(1, max_concurrent)
+        self.generate_url = generate_url or f"{base_url}/api/generate"
+        self.chat_url = chat_url or f"{base_url}/api/chat"
+        self.embed_url = embed_url or f"{base_url}/api/embed"
+        self.health_url = f"{base_url}/api/tags"
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        self.session = self._new_session()
+
+    def _new_session(self) -> requests.Session:
+        # One pooled connection per concurrent call, so busy backends don't open and drop extra connections
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_concurrent)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def reset(self):
+        self.session = self._new_session()
+
+
+def parse_backends(spec: str, default_model: str, default_concurrency: int) -> List[Backend]:
+    """
+    Parses Config.OLLAMA_BACKENDS: comma-separated "url|model|max_concurrent" entries, where model and
+    max_concurrent are optional, e.g. "http://gpu1:11434|llama3.2|4, http://cpu1:11434||2". All entries must end
+    up with the same model (BackendPool checks).
+    """
+    backends = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        parts = [part.strip() for part in entry.split("|")]
+        model = parts[1] if len(parts) > 1 and parts[1] else default_model
+        concurrency = int(parts[2]) if len(parts) > 2 and parts[2] else default_concurrency
+        backends.append(Backend(parts[0], model, concurrency))
+    return backends
+
+
+class BackendPool:
+    """
+    Routes Ollama calls across several backends.
+
+    Each call goes to the healthy backend with the fewest outstanding requests that still has room. A backend
+    that fails `eject_after` times in a row is taken out of rotation until a health probe (GET /api/tags every
+    `probe_interval` seconds) finds it answering again. If every backend is down we still try the least loaded
+    one rather than failing outright.
+
+    Every backend must serve the same model: replies are cached and coalesced by prompt and model, so a pool
+    that mixed models would hand out one model's answer for another's.
+
+    Calls may pass an affinity key (a chat id): as long as its backend is healthy and not full, the chat stays
+    there, so Ollama can keep reusing that chat's cached prompt.
+
+    Args:
+        backends (list): Backend objects.
+        probe_interval (float): Seconds between health probes (0 turns probing off).
+        eject_after (int): Consecutive failures before a backend is taken out of rotation.
+        max_affinity (int): Affinity keys remembered (least recently used are forgotten first).
+    """
+
+    def __init__(self, backends: List[Backend], probe_interval: float = 10.0, eject_after: int = 3,
+                 max_affinity: int = 10000):
+        if not backends:
+            raise ValueError("BackendPool needs at least one backend")
+        models = sorted({backend.model for backend in backends})
+        if len(models) > 1:
+            raise ValueError(f"Every Ollama backend must serve the same model, got {', '.join(models)}")
+        self.backends = backends
+        self.eject_after = max(1, eject_after)
+        self.max_affinity = max_affinity
+        self.affinity = OrderedDict()
+        self.cond = threading.Condition()
+        self.probe_interval = probe_interval
+        if probe_interval > 0 and len(backends) > 1:
+            threading.Thread(target=self._probe_loop, daemon=True).start()
+
+    @property
+    def capacity(self) -> int:
+        return sum(backend.max_concurrent for backend in self.backends)
+
+    @property
+    def model(self) -> str:
+        return self.backends[0].model
+
+    def reset(self):
+        with self.cond:
+            self.affinity.clear()
+            for backend in self.backends:
+                backend.reset()
+
+    def _pick(self, affinity: Optional[str]) -> Optional[Backend]:
+        # Called with the lock held
+        free = [b for b in self.backends if b.outstanding < b.max_concurrent]
+        if not free:
+            return None
+        candidates = [b for b in free if b.healthy]
+        if not candidates:
+            if any(b.healthy for b in self.backends):
+                # A healthy backend is merely busy: wait for it rather than using a broken one
+                return None
+            candidates = free
+        if affinity is not None:
+            preferred = self.affinity.get(affinity)
+            for backend in candidates:
+                if backend.name == preferred:
+                    return backend
+        return min(candidates, key=lambda b: b.outstanding / b.max_concurrent)
+
+    @contextmanager
+    def lease(self, affinity: str = None) -> Iterator[Backend]:
+        """
+        Picks a backend for one call (waiting if every usable backend is full) and records the outcome:
+        a requests error counts as a failure, anything else as a success.
+        """
+        with self.cond:
+            backend = self._pick(affinity)
+            while backend is None:
+                self.cond.wait(timeout=1.0)
+                backend = self._pick(affinity)
+            backend.outstanding += 1
+            if affinity is not None:
+                self.affinity[affinity] = backend.name
+                self.affinity.move_to_end(affinity)
+                while len(self.affinity) > self.max_affinity:
+                    self.affinity.popitem(last=False)
+        try:
+            yield backend
+        except requests.exceptions.RequestException:
+            self._record(backend, ok=False)
+            raise
+        else:
+            self._record(backend, ok=True)
+        finally:
+            with self.cond:
+                backend.outstanding -= 1
+                self.cond.notify_all()
+
+    def _record(self, backend: Backend, ok: bool):
+        with self.cond:
+            if ok:
+                backend.failures = 0
+                if not backend.healthy:
+                    logger.info(f"Ollama backend {backend.name} is answering again")
+                backend.healthy = True
+                return
+            backend.failures += 1
+            if backend.healthy and backend.failures >= self.eject_after and len(self.backends) > 1:
+                backend.healthy = False
+                logger.warning(f"Ollama backend {backend.name} failed {backend.failures} times in a row, "
+                               f"taking it out of rotation")
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            for backend in self.backends:
+                try:
+                    backend.session.get(backend.health_url, timeout=5).raise_for_status()
+                    ok = True
+                except requests.exceptions.RequestException:
+                    ok = False
+                with self.cond:
+                    if ok and not backend.healthy:
+                        logger.info(f"Ollama backend {backend.name} passed its health check, back in rotation")
+                        backend.failures = 0
+                        backend.healthy = True
+                        self.cond.notify_all()
+                    elif not ok and backend.healthy:
+                        logger.warning(f"Ollama backend {backend.name} failed its health check, "
+                                       f"taking it out of rotation")
+                        backend.healthy = False
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self.cond:
+            return [{"backend": b.name, "model": b.model, "healthy": b.healthy, "outstanding": b.outstanding,
+                     "max_concurrent": b.max_concurrent} for b in self.backends]
@@ -0,0 +1,377 @@
+import json
+import logging
+import numpy as np
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_search_key(query: str, year_start: Optional[int] = None) -> str:
+    """
+    Canonical form of a search so trivially different spellings share one cache entry
+    (case, surrounding/duplicated whitespace).
+    """
+    query = re.sub(r"\s+", " ", query or "").strip().lower()
+    return f"{query}|{year_start or ''}"
+
+
+# Words too common to require in a local match
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "to", "with", "by", "from", "at", "as", "via", "using", "based",
+    "into", "its", "is", "are", "be", "this", "that", "these", "their", "how", "what", "which", "towards", "near",
+}
+
+
+def fts_query(query: str) -> str:
+    """
+    Turns a (possibly boolean, e.g. rephrased) search query into an FTS5 MATCH expression. Every key term must
+    appear, so "graph neural networks for drug discovery" only matches papers about all of it, and the query's
+    own AND / OR / parentheses are kept, so "[A AND (B OR C D)]" matches A with B, or A with both C and D. Terms
+    are quoted so punctuation in the query can't break the syntax, and NOT drops what it negates. bm25 does the
+    ranking.
+    """
+    tokens = []
+    words = re.findall(r"\w+|[()]", (query or "").lower())
+    i = 0
+    while i < len(words):
+        token = words[i]
+        i += 1
+        if token == "not":
+            # Skip the negated term or group rather than requiring it
+            depth = 0
+            while i < len(words):
+                depth += {"(": 1, ")": -1}.get(words[i], 0)
+                i += 1
+                if depth <= 0:
+                    break
+        elif token in ("and", "or"):
+            tokens.append(token.upper())
+        elif token in ("(", ")"):
+            tokens.append(token)
+        elif token not in STOPWORDS:
+            tokens.append(f'"{token}"')
+    if tokens.count("(") != tokens.count(")"):
+        tokens = [token for token in tokens if token not in ("(", ")")]
+    # Drop what removing stopwords (or a sloppy query) left dangling: operators with no term on one side, and
+    # empty parentheses
+    operators = ("AND", "OR")
+    changed = True
+    while changed:
+        changed = False
+        for i, token in enumerate(tokens):
+            before = tokens[i - 1] if i > 0 else None
+            after = tokens[i + 1] if i + 1 < len(tokens) else None
+            dangling = token in operators and (before in (None, "(") + operators or after in (None, ")") + operators)
+            if dangling or (token == "(" and after == ")"):
+                del tokens[i:i + (2 if token == "(" else 1)]
+                changed = True
+                break
+    return " ".join(tokens)
+
+
+def paper_year(paper: Dict[str, Any]) -> Optional[int]:
+    year = paper.get("year")
+    if not year and paper.get("publicationDate"):
+        year = str(paper["publicationDate"])[:4]
+    try:
+        return int(year) if year else None
+    except ValueError:
+        return None
+
+
+class PaperStore:
+    """
+    Persistent store for Semantic Scholar results.
+
+    Paper records are kept once per paperId, and cached searches only hold the ordered list of paperIds they
+    returned, so overlapping refined queries don't duplicate records. Searches expire after ttl seconds and at
+    most max_searches are kept (oldest dropped first). Backed by SQLite, so several worker processes can share it.
+
+    Embeddings and query-independent summaries (see summary_worker) are kept per paperId and model, and the
+    citation edges fetched for graph expansion (see citation_graph) per paperId and direction.
+
+    Every paper ever stored is also a local corpus: search_local() runs a full-text (FTS5) search over titles,
+    abstracts and TLDRs, with year and citation count kept in indexed columns for filtering.
+    """
+
+    def __init__(self, path: str, ttl: int, max_searches: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_searches = max_searches
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS papers ("
+            " paper_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS searches ("
+            " key TEXT PRIMARY KEY, paper_ids TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " paper_id TEXT NOT NULL, model TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (paper_id, model))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " paper_id TEXT NOT NULL, model TEXT NOT NULL, summary TEXT NOT NULL, created REAL NOT NULL,"
+            " PRIMARY KEY (paper_id, model))"
+        )
+        # The citation graph: one row per "citing cites cited" edge, and which papers' edges we've fetched
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS citations ("
+            " citing TEXT NOT NULL, cited TEXT NOT NULL, PRIMARY KEY (citing, cited))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS citations_cited ON citations (cited)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS neighbor_fetches ("
+            " paper_id TEXT NOT NULL, direction TEXT NOT NULL, fetched REAL NOT NULL,"
+            " PRIMARY KEY (paper_id, direction))"
+        )
+        self.fts = self._create_corpus_index()
+        self._conn.commit()
+
+    def _create_corpus_index(self) -> bool:
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(papers)")}
+        if "year" not in columns:
+            self._conn.execute("ALTER TABLE papers ADD COLUMN year INTEGER")
+        if "citation_count" not in columns:
+            self._conn.execute("ALTER TABLE papers ADD COLUMN citation_count INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS papers_year_citations ON papers (year, citation_count)")
+        existed = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'papers_fts'").fetchone()
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(title, abstract, tldr, "
+                "tokenize = 'porter unicode61')"
+            )
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite has no FTS5, the local paper corpus is disabled: {e}")
+            return False
+        if not existed:
+            # Papers stored before the corpus existed
+            papers = [json.loads(data) for (data,) in self._conn.execute("SELECT data FROM papers")]
+            self._conn.executemany(
+                "UPDATE papers SET year = ?, citation_count = ? WHERE paper_id = ?",
+                [(paper_year(p), p.get("citationCount"), p["paperId"]) for p in papers]
+            )
+            self._index(papers)
+            if papers:
+                logger.info(f"Indexed {len(papers)} stored papers for local search")
+        return True
+
+    def _index(self, papers: List[Dict[str, Any]]):
+        # Called with the lock held (or from __init__); the FTS row shares the papers row's rowid
+        rows = []
+        for paper in papers:
+            row = self._conn.execute("SELECT rowid FROM papers WHERE paper_id = ?", (paper["paperId"],)).fetchone()
+            if row is None:
+                continue
+            tldr = (paper.get("tldr") or {}).get("text") or ""
+            abstract = paper.get("abstract") or paper.get("pdfExcerpt") or ""
+            rows.append((row[0], paper.get("title") or "", abstract, tldr))
+        self._conn.executemany("DELETE FROM papers_fts WHERE rowid = ?", [(row[0],) for row in rows])
+        self._conn.executemany("INSERT INTO papers_fts (rowid, title, abstract, tldr) VALUES (?, ?, ?, ?)", rows)
+
+    def get_search(self, query: str, year_start: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        key = normalize_search_key(query, year_start)
+        with self._lock:
+            row = self._conn.execute("SELECT paper_ids, created FROM searches WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM searches WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        paper_ids = json.loads(row[0])
+        papers = self.get_papers(paper_ids)
+        if len(papers) != len(paper_ids):
+            # A referenced record went missing; treat the whole entry as a miss
+            return None
+        return [papers[paper_id] for paper_id in paper_ids]
+
+    def put_search(self, query: str, year_start: Optional[int], papers: List[Dict[str, Any]]):
+        key = normalize_search_key(query, year_start)
+        paper_ids = [p.get("paperId") for p in papers if p.get("paperId")]
+        self.put_papers(papers)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches (key, paper_ids, created) VALUES (?, ?, ?)",
+                (key, json.dumps(paper_ids), time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM searches WHERE key NOT IN (SELECT key FROM searches ORDER BY created DESC LIMIT ?)",
+                (self.max_searches,)
+            )
+            self._conn.commit()
+
+    def get_papers(self, paper_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        paper_ids = list(paper_ids)
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(paper_ids), 500):
+                chunk = paper_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT paper_id, data FROM papers WHERE paper_id IN ({placeholders})", chunk
+                )
+                for paper_id, data in rows:
+                    found[paper_id] = json.loads(data)
+        return found
+
+    def put_papers(self, papers: Iterable[Dict[str, Any]]):
+        now = time.time()
+        papers = [p for p in papers if p.get("paperId")]
+        rows = [(p["paperId"], json.dumps(p), now, paper_year(p), p.get("citationCount")) for p in papers]
+        if not rows:
+            return
+        with self._lock:
+            # An upsert keeps each paper's rowid, which its full-text row is keyed on
+            self._conn.executemany(
+                "INSERT INTO papers (paper_id, data, updated, year, citation_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (paper_id) DO UPDATE SET data = excluded.data, updated = excluded.updated, "
+                "year = excluded.year, citation_count = excluded.citation_count", rows
+            )
+            if self.fts:
+                self._index(papers)
+            self._conn.commit()
+
+    def search_local(self, query: str, year_start: Optional[int] = None, limit: int = 20,
+                     min_citations: int = 0) -> List[Dict[str, Any]]:
+        """
+        Full-text search over every stored paper (title weighted highest, then abstract, then TLDR), best match
+        first and more-cited papers first among equals.
+        """
+        match = fts_query(query)
+        if not self.fts or not match:
+            return []
+        sql = ("SELECT p.data FROM papers_fts JOIN papers p ON p.rowid = papers_fts.rowid "
+               "WHERE papers_fts MATCH ?")
+        params = [match]
+        if year_start:
+            sql += " AND p.year >= ?"
+            params.append(year_start)
+        if min_citations:
+            sql += " AND p.citation_count >= ?"
+            params.append(min_citations)
+        sql += " ORDER BY bm25(papers_fts, 10.0, 4.0, 2.0), p.citation_count DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            try:
+                rows = self._conn.execute(sql, params).fetchall()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Local search for {query!r} failed: {e}")
+                return []
+        return [json.loads(data) for (data,) in rows]
+
+    def add_pdf_text(self, paper_id: str, text: str, excerpt_chars: int = 2000):
+        """
+        Makes a paper we've read the PDF of findable by its text, if Semantic Scholar had no abstract for it.
+        """
+        paper = self.get_papers([paper_id]).get(paper_id)
+        if paper is None or paper.get("abstract") or paper.get("pdfExcerpt"):
+            return
+        paper["pdfExcerpt"] = re.sub(r"\s+", " ", text).strip()[:excerpt_chars]
+        self.put_papers([paper])
+
+    def get_embeddings(self, paper_ids: Iterable[str], model: str) -> Dict[str, np.ndarray]:
+        paper_ids = list(paper_ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(paper_ids), 500):
+                chunk = paper_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT paper_id, vector FROM embeddings WHERE model = ? AND paper_id IN ({placeholders})",
+                    [model] + chunk
+                )
+                for paper_id, vector in rows:
+                    found[paper_id] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_embeddings(self, vectors: Dict[str, np.ndarray], model: str):
+        rows = [(paper_id, model, np.asarray(v, dtype=np.float32).tobytes()) for paper_id, v in vectors.items()]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (paper_id, model, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def get_summaries(self, paper_ids: Iterable[str], model: str) -> Dict[str, str]:
+        paper_ids = list(paper_ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(paper_ids), 500):
+                chunk = paper_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT paper_id, summary FROM summaries WHERE model = ? AND paper_id IN ({placeholders})",
+                    [model] + chunk
+                )
+                found.update(rows)
+        return found
+
+    def put_summaries(self, summaries: Dict[str, str], model: str):
+        now = time.time()
+        rows = [(paper_id, model, summary, now) for paper_id, summary in summaries.items() if summary]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO summaries (paper_id, model, summary, created) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def get_neighbors(self, paper_ids: Iterable[str], direction: str) -> Dict[str, List[str]]:
+        """
+        Stored references (direction "references") or citations ("citations") of each paper whose edges were
+        fetched within ttl seconds. Papers missing from the result need fetching; an empty list is a real answer.
+        """
+        paper_ids = list(paper_ids)
+        found = {}
+        column, other = ("citing", "cited") if direction == "references" else ("cited", "citing")
+        with self._lock:
+            for i in range(0, len(paper_ids), 500):
+                chunk = paper_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT paper_id FROM neighbor_fetches WHERE direction = ? AND fetched > ? "
+                    f"AND paper_id IN ({placeholders})", [direction, time.time() - self.ttl] + chunk
+                )
+                fresh = [paper_id for (paper_id,) in rows]
+                for paper_id in fresh:
+                    found[paper_id] = []
+                if not fresh:
+                    continue
+                placeholders = ",".join("?" * len(fresh))
+                rows = self._conn.execute(
+                    f"SELECT {column}, {other} FROM citations WHERE {column} IN ({placeholders})", fresh
+                )
+                for paper_id, neighbor in rows:
+                    found[paper_id].append(neighbor)
+        return found
+
+    def put_neighbors(self, paper_id: str, direction: str, neighbors: List[str]):
+        if direction == "references":
+            edges = [(paper_id, neighbor) for neighbor in neighbors]
+        else:
+            edges = [(neighbor, paper_id) for neighbor in neighbors]
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO citations (citing, cited) VALUES (?, ?)", edges)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO neighbor_fetches (paper_id, direction, fetched) VALUES (?, ?, ?)",
+                (paper_id, direction, time.time())
+            )
+            self._conn.commit()
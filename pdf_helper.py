@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import requests
+from PyPDF2 import PdfReader
+
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PDFIngestError(Exception):
+    """Raised when a PDF can't be downloaded or read; the message is safe to show to the user."""
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: forking a multi-threaded Flask process can deadlock the children
+            _pool = ProcessPoolExecutor(max_workers=Config.PDF_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _extract_pages(job: Tuple[str, int, int]) -> List[str]:
+    # Runs in a worker process, so it opens its own reader
+    path, start, stop = job
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def download_pdf(url: str, dest: str, max_bytes: int, timeout: int) -> str:
+    """
+    Streams a PDF to dest in chunks, never holding more than one chunk in memory.
+
+    Args:
+        url (str): Where to download from.
+        dest (str): File to write to.
+        max_bytes (int): Abort once the download gets bigger than this.
+        timeout (int): Seconds allowed for the whole download (and for each network read).
+    Returns:
+        str: sha256 of the downloaded bytes.
+    """
+    deadline = time.monotonic() + timeout
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise PDFIngestError("Failed to download PDF")
+            declared = response.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise PDFIngestError(f"PDF is larger than {max_bytes // (1024 * 1024)}MB")
+            with open(dest, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise PDFIngestError(f"PDF is larger than {max_bytes // (1024 * 1024)}MB")
+                    if time.monotonic() > deadline:
+                        raise PDFIngestError("Timed out downloading PDF")
+                    digest.update(chunk)
+                    f.write(chunk)
+    except requests.exceptions.RequestException as e:
+        raise PDFIngestError(f"Failed to download PDF: {e}")
+    return digest.hexdigest()
+
+
+def extract_text(path: str) -> str:
+    """
+    Extracts the text of every page. Large documents are split into page ranges parsed in a process pool,
+    so a long survey doesn't hold the GIL (or a Flask worker) for its whole parse.
+    """
+    try:
+        num_pages = len(PdfReader(path).pages)
+    except Exception as e:
+        raise PDFIngestError(f"Could not read PDF: {e}")
+    step = max(1, Config.PDF_PAGES_PER_TASK)
+    jobs = [(path, start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+    if len(jobs) <= 1 or Config.PDF_WORKERS <= 1:
+        pages = [text for job in jobs for text in _extract_pages(job)]
+    else:
+        pages = [text for chunk in _get_pool().map(_extract_pages, jobs) for text in chunk]
+    return "".join(pages)
+
+
+class PDFIngestor:
+    """
+    Downloads and extracts PDFs, caching the text by content hash (and the URL -> hash mapping) in SQLite,
+    so the same paper is never downloaded or parsed twice.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS pdf_texts (sha TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS pdf_urls (url TEXT PRIMARY KEY, sha TEXT NOT NULL)")
+        self._conn.commit()
+
+    def _cached_text(self, url: str = None, sha: str = None) -> Optional[str]:
+        with self._lock:
+            if url is not None:
+                row = self._conn.execute(
+                    "SELECT t.text FROM pdf_urls u JOIN pdf_texts t ON u.sha = t.sha WHERE u.url = ?", (url,)
+                ).fetchone()
+            else:
+                row = self._conn.execute("SELECT text FROM pdf_texts WHERE sha = ?", (sha,)).fetchone()
+        return row[0] if row else None
+
+    def _remember(self, url: str, sha: str, text: Optional[str] = None):
+        with self._lock:
+            if text is not None:
+                self._conn.execute("INSERT OR REPLACE INTO pdf_texts (sha, text) VALUES (?, ?)", (sha, text))
+            self._conn.execute("INSERT OR REPLACE INTO pdf_urls (url, sha) VALUES (?, ?)", (url, sha))
+            self._conn.commit()
+
+    def ingest(self, url: str) -> str:
+        text = self._cached_text(url=url)
+        if text is not None:
+            return text
+
+        # Every request gets its own temp file, so concurrent users never overwrite each other's download
+        fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        try:
+            sha = download_pdf(url, pdf_path, Config.PDF_MAX_BYTES, Config.PDF_TIMEOUT)
+            text = self._cached_text(sha=sha)
+            if text is not None:
+                # Same file, different URL
+                self._remember(url, sha)
+                return text
+            text = extract_text(pdf_path)
+        finally:
+            os.remove(pdf_path)
+
+        if text.strip():
+            self._remember(url, sha, text)
+        return text
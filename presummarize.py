@@ -0,0 +1,63 @@
+"""
+Warms the summary store for a topic, e.g. overnight, so later searches about it show summaries straight away.
+
+Usage:
+    python presummarize.py "graph neural networks" "protein structure prediction" --pages 5 --year-filter 2018-
+    python presummarize.py --drain
+
+Each topic is searched the way the app searches (the local corpus first, then Semantic Scholar), every paper
+found that needs an LLM summary is queued, and the queue (Config.SUMMARY_QUEUE_PATH) is worked through until
+it's empty. --drain only works through what is already queued, e.g. papers from searches whose tab was closed.
+The queue is shared with a running app, so both can work on it at once.
+"""
+import argparse
+import logging
+
+from config import Config
+from local_llm_helper import LocalLLM
+from resilience_helper import SearchUnavailableError
+from search_pipeline import tldr_text
+from semantic_scholar_helper import SemanticScholarAPI
+from summary_worker import PRIORITY_WARM, SummaryJobs, SummaryWorker
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write query-independent paper summaries ahead of time.")
+    parser.add_argument("topics", nargs="*", help="search queries whose papers should be summarized")
+    parser.add_argument("--pages", type=int, default=Config.MAX_PAGES, help="Semantic Scholar result pages per topic")
+    parser.add_argument("--year-filter", default=Config.DEFAULT_YEAR_FILTER, help='e.g. "2018-"')
+    parser.add_argument("--workers", type=int, default=Config.LLM_WORKERS, help="summaries written at once")
+    parser.add_argument("--drain", action="store_true", help="only work through papers that are already queued")
+    args = parser.parse_args()
+    if not args.topics and not args.drain:
+        parser.error("give at least one topic, or --drain")
+
+    Config.MAX_PAGES = args.pages
+    semantic_scholar = SemanticScholarAPI(Config.SEMANTIC_API_KEY)
+    llm = LocalLLM(Config.OLLAMA_API_URL, Config.OLLAMA_MODEL)
+    worker = SummaryWorker(llm, semantic_scholar.store,
+                           SummaryJobs(Config.SUMMARY_QUEUE_PATH, Config.SUMMARY_MAX_ATTEMPTS), args.workers)
+
+    for topic in [] if args.drain else args.topics:
+        found, queued = 0, 0
+        try:
+            for _, papers in semantic_scholar.iter_search([topic], args.year_filter):
+                found += len(papers)
+                # Papers with a TLDR are already summarized, and there's nothing to summarize without an abstract
+                queued += worker.enqueue([p["paperId"] for p in papers
+                                          if p.get("paperId") and p.get("abstract") and not tldr_text(p)],
+                                         PRIORITY_WARM)
+        except SearchUnavailableError as e:
+            logger.error(f"Searching for {topic!r} failed: {e}")
+        logger.info(f"{topic!r}: {found} papers found, {queued} newly queued")
+
+    logger.info(f"Queue before: {worker.jobs.counts(worker.model)}")
+    worker.drain()
+    logger.info(f"Queue after: {worker.jobs.counts(worker.model)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+from llm_scheduler import Priority, RequestContext
+from local_llm_helper import LocalLLM
+from paper_store import PaperStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingRanker:
+    """
+    Cheap first-stage ranking: cosine similarity between the query and each paper's title + abstract/TLDR.
+
+    Paper embeddings are cached in the paper store by paperId (and embedding model), so papers that show up
+    in several searches are only embedded once.
+    """
+
+    def __init__(self, llm: LocalLLM, store: PaperStore):
+        self.llm = llm
+        self.store = store
+
+    @staticmethod
+    def _paper_text(paper: Dict[str, Any]) -> str:
+        return f"{paper.get('title') or ''}\n{LocalLLM._paper_text(paper)}"
+
+    def scores(self, query: str, papers: List[Dict[str, Any]], ctx: RequestContext = None
+               ) -> Optional[Dict[str, float]]:
+        """
+        Returns:
+            dict: paperId -> cosine similarity with the query, or None if embeddings aren't available.
+        """
+        if not Config.OLLAMA_EMBED_MODEL or not papers:
+            return None
+        ids = [p.get("paperId") for p in papers]
+        vectors = self.store.get_embeddings(ids, Config.OLLAMA_EMBED_MODEL)
+
+        missing = [p for p in papers if p.get("paperId") not in vectors]
+        # The query goes in the same batch as any papers we haven't embedded before
+        embedded = self.llm.embed([query] + [self._paper_text(p) for p in missing], priority=Priority.RELEVANCE,
+                                  ctx=ctx, caller="rank_papers")
+        if embedded is None:
+            return None
+        fresh = {p.get("paperId"): embedded[i + 1] for i, p in enumerate(missing)}
+        self.store.put_embeddings(fresh, Config.OLLAMA_EMBED_MODEL)
+        vectors.update(fresh)
+
+        matrix = np.stack([vectors[paper_id] for paper_id in ids]).astype(np.float32, copy=False)
+        similarities = matrix @ embedded[0]
+        return dict(zip(ids, similarities.tolist()))
@@ -0,0 +1,174 @@
+import json
+import time
+import random
+import logging
+import threading
+from typing import Iterator, Optional, Type
+
+import requests
+
+from rate_limiter import parse_retry_after
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DependencyUnavailableError(Exception):
+    """A service we depend on failed (or its circuit is open), as opposed to giving an empty answer."""
+
+
+class LLMUnavailableError(DependencyUnavailableError):
+    """Ollama could not produce a reply."""
+
+
+class SearchUnavailableError(DependencyUnavailableError):
+    """Semantic Scholar could not be reached."""
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Capped exponential backoff with full jitter: uniform in [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def status_code(error: Exception) -> Optional[int]:
+    response = getattr(error, "response", None)
+    return response.status_code if response is not None else None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """The server's Retry-After (seconds) for a failed request, if it sent one."""
+    response = getattr(error, "response", None)
+    if response is None or "Retry-After" not in response.headers:
+        return None
+    return parse_retry_after(response.headers.get("Retry-After"))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Connection problems, timeouts, garbled bodies, 408, 429 and 5xx are worth retrying; other 4xx are not."""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          requests.exceptions.ChunkedEncodingError, json.JSONDecodeError)):
+        return True
+    code = status_code(error)
+    return code is None or code in (408, 429) or code >= 500
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an endpoint is down.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls are refused for `reset_timeout`
+    seconds. Then one trial call is let through (half-open): success closes the circuit, failure re-opens it.
+
+    Args:
+        name (str): Endpoint name, for logs.
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_timeout (float): Seconds to stay open before a trial call.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            # A trial that never reported back (e.g. it was cancelled) doesn't block the circuit forever
+            if self.trial_started is not None and now - self.trial_started < self.reset_timeout:
+                return False
+            self.trial_started = now
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info(f"{self.name} is answering again, closing its circuit")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_started is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.warning(f"{self.name} failed {self.failures} times in a row, failing fast for "
+                               f"{self.reset_timeout:.0f}s")
+                self.opened_at = time.monotonic()
+            self.trial_started = None
+
+
+class RetryPolicy:
+    """
+    Retries calls to one endpoint with capped, jittered exponential backoff behind a circuit breaker.
+
+    Use it around a request loop:
+
+        for attempt in policy.attempts():
+            try:
+                ...
+                policy.succeeded()
+                return result
+            except requests.exceptions.RequestException as e:
+                policy.failed(attempt, e)
+
+    failed() sleeps before the next attempt (honouring Retry-After), and raises `error_cls` once the error isn't
+    worth retrying or the attempts are used up. attempts() raises `error_cls` straight away while the circuit
+    is open. A 429 never counts against the circuit: the server is up, just busy.
+
+    Args:
+        breaker (CircuitBreaker): The endpoint's breaker.
+        error_cls (type): DependencyUnavailableError subclass to raise.
+        max_retries (int): Attempts per call.
+        base_delay (float): Backoff before the second attempt (seconds), doubling each time.
+        max_delay (float): Backoff cap (seconds).
+    """
+
+    def __init__(self, breaker: CircuitBreaker, error_cls: Type[DependencyUnavailableError], max_retries: int,
+                 base_delay: float, max_delay: float):
+        self.breaker = breaker
+        self.error_cls = error_cls
+        self.max_retries = max(1, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def attempts(self, max_retries: int = None) -> Iterator[int]:
+        for attempt in range(max_retries or self.max_retries):
+            if not self.breaker.allow():
+                raise self.error_cls(f"{self.breaker.name} is unavailable (circuit open)")
+            yield attempt
+
+    def succeeded(self):
+        self.breaker.record_success()
+
+    def failed(self, attempt: int, error: Exception, max_retries: int = None, wait: bool = True):
+        max_retries = max_retries or self.max_retries
+        retryable = is_retryable(error)
+        if retryable and status_code(error) != 429:
+            self.breaker.record_failure()
+        else:
+            # The endpoint answered, it's just busy or didn't like the request
+            self.breaker.record_success()
+        if not retryable or attempt >= max_retries - 1:
+            raise self.error_cls(f"{self.breaker.name} failed after {attempt + 1} attempt(s): {error}") from error
+        delay = retry_after(error)
+        if delay is None:
+            delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        logger.warning(f"{self.breaker.name} attempt {attempt + 1}/{max_retries} failed ({error}), "
+                       f"retrying in {delay:.1f}s")
+        if wait:
+            time.sleep(delay)
@@ -0,0 +1,98 @@
+import math
+import re
+from collections import Counter
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def chunk_text(text: str, words_per_chunk: int, overlap: int) -> List[str]:
+    """
+    Splits text into overlapping windows of roughly words_per_chunk words.
+
+    Args:
+        text (str): Full text, e.g. an extracted PDF.
+        words_per_chunk (int): Target chunk size in words.
+        overlap (int): Words shared between neighbouring chunks, so sentences on a boundary aren't lost.
+    Returns:
+        list: The chunks, in document order.
+    """
+    words = text.split()
+    step = max(1, words_per_chunk - overlap)
+    return [" ".join(words[i:i + words_per_chunk]) for i in range(0, max(1, len(words) - overlap), step)]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of chunks."""
+
+    def __init__(self, chunks: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(chunk)) for chunk in chunks]
+        self.lengths = np.array([sum(c.values()) for c in self.term_counts], dtype=np.float32)
+        self.avg_length = float(self.lengths.mean()) if len(chunks) else 0.0
+        doc_freq = Counter(term for counts in self.term_counts for term in counts)
+        n = len(chunks)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.term_counts), dtype=np.float32)
+        if not self.avg_length:
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / self.avg_length)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            tf = np.array([counts.get(term, 0) for counts in self.term_counts], dtype=np.float32)
+            scores += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+class PaperIndex:
+    """
+    Searchable chunks of one paper: a BM25 index, plus (optionally) a float32 matrix of unit-length chunk
+    embeddings for semantic matching.
+    """
+
+    def __init__(self, title: str, text: str, words_per_chunk: int, overlap: int,
+                 embed: Optional[Callable[[List[str]], Optional[np.ndarray]]] = None):
+        self.title = title
+        self.chunks = chunk_text(text, words_per_chunk, overlap)
+        self.bm25 = BM25Index(self.chunks)
+        self.embeddings = embed(self.chunks) if embed is not None else None
+        # Approximate memory use (text, term counts, embeddings), used for session memory budgets
+        self.nbytes = 3 * sum(len(chunk) for chunk in self.chunks) + \
+            (self.embeddings.nbytes if self.embeddings is not None else 0)
+
+    def scores(self, question: str, question_embedding: Optional[np.ndarray] = None) -> np.ndarray:
+        lexical = self.bm25.scores(question)
+        if lexical.max() > 0:
+            lexical = lexical / lexical.max()
+        if question_embedding is None or self.embeddings is None:
+            return lexical
+        semantic = np.clip(self.embeddings @ question_embedding, 0.0, 1.0)
+        return 0.5 * lexical + 0.5 * semantic
+
+
+def retrieve(indexes: List[PaperIndex], question: str, top_k: int,
+             question_embedding: Optional[np.ndarray] = None) -> List[Tuple[str, str]]:
+    """
+    Picks the top_k chunks for a question across every loaded paper.
+
+    Returns:
+        list: (paper title, chunk) pairs, best first.
+    """
+    candidates = []
+    for index in indexes:
+        scores = index.scores(question, question_embedding)
+        for i in np.argsort(-scores)[:top_k]:
+            candidates.append((float(scores[i]), index.title, index.chunks[i]))
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    return [(title, chunk) for _, title, chunk in candidates[:top_k]]
@@ -0,0 +1,481 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import sqlite3
+import threading
+from queue import Queue, Empty, Full
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from citation_graph import CitationGraph
+from config import Config
+from llm_scheduler import Priority, RequestContext
+from local_llm_helper import LocalLLM
+from metrics_helper import Trace, timed
+from paper_store import paper_year
+from ranking_helper import EmbeddingRanker
+from resilience_helper import SearchUnavailableError
+from semantic_scholar_helper import SemanticScholarAPI
+from summary_worker import SummaryWorker
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def paper_card(p: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields the frontend needs to draw a paper card, from a Semantic Scholar record."""
+    open_pdf = p.get("openAccessPdf", None)
+    open_pdf_url = ''
+    if open_pdf is not None:
+        open_pdf_url = open_pdf.get('url')
+    return {
+        "title": p.get("title", "Untitled"),
+        "url": p.get("url"),
+        "publication_date": p.get("publicationDate"),
+        "citation_count": p.get("citationCount", 0),
+        "authors": [a.get("name", "") for a in p.get("authors", [])],
+        "pdf_url": open_pdf_url,
+        "paper_id": p.get("paperId"),
+        "abstract": p.get("abstract", "")
+    }
+
+
+def tldr_text(paper: Dict[str, Any]) -> Optional[str]:
+    tldr = paper.get("tldr") or {}
+    return tldr.get("text") or None
+
+
+class SearchPipeline:
+    """
+    Streams a search as overlapping stages: search -> dedupe -> relevance scoring -> summarization.
+
+    The search stage runs on its own thread and hands each page on as soon as it arrives. A fixed set of LLM
+    workers (Config.LLM_WORKERS) then pull from two priority queues: relevance scoring first (highest embedding
+    similarity first), and summaries whenever there's nothing to score (highest relevance known so far first,
+    re-prioritised as scores come in). Once the search results are scored, one worker expands the results along
+    the citation graph (if one is given), and the best connected new papers go through the same stages as
+    another `papers` batch. Everything flows back to the request through a bounded event queue, so
+    the stream still carries the same refined_query / papers / relevance / summary events as before, just
+    sooner. If Semantic Scholar can't be reached an {"type": "error"} event says so; if the LLM is down, papers
+    fall back to their embedding score and "No summary available.".
+
+    Args:
+        llm (LocalLLM): Scores and summarizes papers.
+        semantic_scholar (SemanticScholarAPI): Runs the searches.
+        ranker (EmbeddingRanker): Cheap first-pass similarity, used to pick what the LLM scores.
+        query (str): The user's original query.
+        refined_queries (list): Rephrased queries to search for.
+        year_filter (str): Year filter such as "2020-".
+        stream_tokens (bool): Also emit summary_token events while summaries are written.
+        status (callable): status(message, stage=..., done=..., total=...) progress callback.
+        session_id (str): The browser tab this search is for, so the LLM scheduler can share Ollama fairly.
+        trace (Trace): Collects this search's stage and LLM timings, if the client asked for a trace.
+        summaries (SummaryWorker): Serves and stores query-independent summaries, and takes the papers left over.
+        graph (CitationGraph): Once the search results are scored, adds the papers most linked to the best ones.
+    """
+
+    def __init__(self, llm: LocalLLM, semantic_scholar: SemanticScholarAPI, ranker: EmbeddingRanker, query: str,
+                 refined_queries: List[str], year_filter: Optional[str], stream_tokens: bool = False,
+                 status: Callable[..., None] = None, session_id: str = "", trace: Optional[Trace] = None,
+                 summaries: Optional[SummaryWorker] = None, graph: Optional[CitationGraph] = None):
+        self.llm = llm
+        self.semantic_scholar = semantic_scholar
+        self.ranker = ranker
+        self.query = query
+        self.refined_queries = refined_queries
+        self.year_filter = year_filter
+        self.stream_tokens = stream_tokens
+        self.status = status or (lambda message, **progress: None)
+        self.summaries = summaries
+        self.graph = graph
+
+        self.events = Queue(maxsize=Config.PIPELINE_QUEUE_SIZE)
+        self.cancelled = threading.Event()
+        # LLM calls still waiting for the scheduler are dropped as soon as the client goes away
+        self.trace = trace
+        self.ctx = RequestContext(session_id, self.cancelled, trace)
+        self.cond = threading.Condition()
+        self.seq = itertools.count()
+        self.loop = None               # Set by arun(): events are also announced to this event loop
+        self.wakeup = None
+
+        self.papers = {}               # paperId -> record
+        self.similarity = {}           # paperId -> embedding similarity
+        self.relevance = {}            # paperId -> best known relevance score
+        self.score_heap = []           # (-similarity, seq, paperId)
+        self.unscored = []             # paperIds the LLM gave no score, scored like leftovers
+        self.summary_heap = []         # (-priority, seq, paperId), stale entries skipped on pop
+        self.summary_priority = {}     # paperId -> current priority, only for papers still waiting
+        self.stored_summaries = {}     # paperId -> query-independent summary still to be related to the query
+        self.unsummarized = set()      # paperIds still without a stored summary, handed to the worker at the end
+        self.llm_budget = None         # remaining papers the LLM may score; None = unlimited
+        self.scoring_in_flight = 0
+        self.search_done = False
+        self.expanded = graph is None  # True once the citation graph stage is over (or if there isn't one)
+        self.expanding = False
+        self.leftovers_scored = False
+        self.scored = 0
+        self.summarized = 0
+
+    def run(self) -> Iterator[Dict[str, Any]]:
+        running = self._start()
+        try:
+            while running:
+                event = self.events.get()
+                if event is _DONE:
+                    running -= 1
+                else:
+                    yield event
+        finally:
+            # Also reached when the client disconnects and the response generator is closed
+            self._stop()
+
+    async def arun(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        run() for the asyncio server: the stages still run on threads, but waiting for their next event doesn't
+        hold one. Cancelling the task that iterates this cancels the search, like closing run() does.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        running = self._start()
+        try:
+            while running:
+                try:
+                    event = self.events.get_nowait()
+                except Empty:
+                    # Cleared before re-checking, and _emit sets it after every put, so no wakeup is lost
+                    self.wakeup.clear()
+                    if self.events.empty():
+                        await self.wakeup.wait()
+                    continue
+                if event is _DONE:
+                    running -= 1
+                else:
+                    yield event
+        finally:
+            self._stop()
+
+    def _start(self) -> int:
+        threads = [threading.Thread(target=self._guard, args=(self._search,), daemon=True)]
+        threads += [threading.Thread(target=self._guard, args=(self._work,), daemon=True)
+                    for _ in range(max(1, min(Config.LLM_WORKERS, Config.LLM_MAX_IN_FLIGHT)))]
+        for thread in threads:
+            thread.start()
+        return len(threads)
+
+    def _stop(self):
+        self.cancelled.set()
+        with self.cond:
+            self.cond.notify_all()
+            unsummarized = list(self.unsummarized)
+        if unsummarized:
+            # The summary worker writes the ones this search didn't get to, even if the tab was closed
+            try:
+                self.summaries.enqueue(unsummarized)
+            except sqlite3.Error as e:
+                logger.error(f"Could not queue {len(unsummarized)} papers for background summaries: {e}")
+
+    def _guard(self, stage: Callable[[], None]):
+        try:
+            stage()
+        except Exception as e:
+            logger.exception(f"Search pipeline stage failed: {e}")
+        finally:
+            if stage == self._search:
+                with self.cond:
+                    self.search_done = True
+                    self.cond.notify_all()
+            self._emit(_DONE)
+
+    def _emit(self, event: Any):
+        # Bounded queue: if the client stops reading, don't block forever
+        while not self.cancelled.is_set():
+            try:
+                self.events.put(event, timeout=0.5)
+                if self.loop is not None:
+                    self.loop.call_soon_threadsafe(self.wakeup.set)
+                return
+            except Full:
+                continue
+            except RuntimeError:
+                # The event loop reading arun() has shut down
+                self.cancelled.set()
+
+    # Stage 1 + 2: search and dedupe
+    def _search(self):
+        self.status("Searching for relevant papers...", stage="search")
+        try:
+            with timed("search", self.trace):
+                self._search_pages()
+        except SearchUnavailableError as e:
+            logger.error(f"Search failed: {e}")
+            self.status("Semantic Scholar is unavailable, please try again shortly.", stage="error")
+            self._emit({"type": "error", "data": {"stage": "search", "message": "Semantic Scholar is unavailable, "
+                                                                                "please try again shortly."}})
+
+    def _search_pages(self):
+        for _, batch in self.semantic_scholar.iter_search(self.refined_queries, self.year_filter):
+            if self.cancelled.is_set():
+                return
+            self._add_papers(batch)
+
+    def _add_papers(self, batch: List[Dict[str, Any]]):
+        # New papers from a search page or the citation graph: send their cards, then queue them for scoring
+        with self.cond:
+            fresh = [p for p in batch if p.get("paperId") and p.get("paperId") not in self.papers]
+            for paper in fresh:
+                self.papers[paper["paperId"]] = paper
+        if not fresh:
+            return
+        self._emit({"type": "papers", "data": [paper_card(p) for p in fresh]})
+
+        # Summaries that need no LLM go out immediately
+        needs_summary = []
+        for paper in fresh:
+            tldr = tldr_text(paper)
+            if tldr:
+                self._emit({"type": "summary", "data": {"paper_id": paper["paperId"], "summary": tldr}})
+            elif paper.get("abstract"):
+                needs_summary.append(paper)
+            else:
+                self._emit({"type": "summary",
+                            "data": {"paper_id": paper["paperId"], "summary": 'No summary available.'}})
+        if needs_summary and self.summaries is not None:
+            needs_summary = self._use_stored_summaries(needs_summary)
+
+        similarities = None
+        if Config.PRERANK_TOP_K > 0:
+            with timed("prerank", self.trace):
+                similarities = self.ranker.scores(self.query, fresh, self.ctx)
+        with self.cond:
+            if similarities is not None:
+                self.similarity.update(similarities)
+                if self.llm_budget is None:
+                    self.llm_budget = Config.PRERANK_TOP_K
+            for paper in fresh:
+                paper_id = paper["paperId"]
+                similarity = self.similarity.get(paper_id, 0.0)
+                heapq.heappush(self.score_heap, (-similarity, next(self.seq), paper_id))
+            for paper in needs_summary:
+                # Until it has a relevance score, a paper's summary priority is its similarity
+                self._set_summary_priority(paper["paperId"], max(self.similarity.get(paper["paperId"], 0.0), 0) * 100)
+            self.cond.notify_all()
+
+    def _use_stored_summaries(self, papers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Papers with a pre-made summary are served from it; the rest get one written (and stored) here, and
+        # whichever of them this search doesn't reach are queued for the summary worker when it ends. Returns the
+        # papers that still need an LLM call here.
+        stored = self.summaries.get([p["paperId"] for p in papers])
+        with self.cond:
+            self.unsummarized.update(p["paperId"] for p in papers if p["paperId"] not in stored)
+            if Config.SUMMARY_QUERY_NOTE:
+                self.stored_summaries.update(stored)
+        if Config.SUMMARY_QUERY_NOTE:
+            return papers
+        for paper_id, summary in stored.items():
+            self._emit({"type": "summary", "data": {"paper_id": paper_id, "summary": summary}})
+        return [p for p in papers if p["paperId"] not in stored]
+
+    def _set_summary_priority(self, paper_id: str, priority: float):
+        self.summary_priority[paper_id] = priority
+        heapq.heappush(self.summary_heap, (-priority, next(self.seq), paper_id))
+
+    # Stage 3 + 4: LLM workers, scoring first and summaries when there's nothing to score
+    def _next_task(self):
+        with self.cond:
+            while not self.cancelled.is_set():
+                can_score = self.score_heap and (self.llm_budget is None or self.llm_budget > 0)
+                if can_score:
+                    batch = []
+                    while self.score_heap and len(batch) < max(1, Config.RELEVANCE_BATCH_SIZE) and \
+                            (self.llm_budget is None or self.llm_budget > 0):
+                        batch.append(self.papers[heapq.heappop(self.score_heap)[2]])
+                        if self.llm_budget is not None:
+                            self.llm_budget -= 1
+                    self.scoring_in_flight += 1
+                    return "score", batch
+
+                scoring_over = self.search_done and self.scoring_in_flight == 0
+                if scoring_over and not self.expanded and not self.expanding:
+                    self.expanding = True
+                    return "expand", None
+                if scoring_over and self.expanded and not self.leftovers_scored:
+                    self.leftovers_scored = True
+                    return "leftovers", None
+
+                while self.summary_heap:
+                    priority, _, paper_id = heapq.heappop(self.summary_heap)
+                    if self.summary_priority.get(paper_id) == -priority:
+                        del self.summary_priority[paper_id]
+                        return "summary", self.papers[paper_id]
+
+                if scoring_over and self.expanded and self.leftovers_scored:
+                    return None, None
+                self.cond.wait()
+        return None, None
+
+    def _work(self):
+        while True:
+            kind, task = self._next_task()
+            if kind is None:
+                return
+            if kind == "score":
+                try:
+                    self._score(task)
+                finally:
+                    with self.cond:
+                        self.scoring_in_flight -= 1
+                        self.cond.notify_all()
+            elif kind == "expand":
+                try:
+                    self._expand()
+                except Exception as e:
+                    logger.exception(f"Citation graph expansion failed: {e}")
+                finally:
+                    with self.cond:
+                        self.expanded = True
+                        self.cond.notify_all()
+            elif kind == "leftovers":
+                self._score_leftovers()
+            else:
+                self._summarize(task)
+
+    def _record_relevance(self, paper_id: str, relevance: float):
+        with self.cond:
+            self.relevance[paper_id] = relevance
+            if paper_id in self.summary_priority:
+                self._set_summary_priority(paper_id, relevance)
+            self.cond.notify_all()
+        self._emit({"type": "relevance", "data": {"paper_id": paper_id, "relevance": relevance}})
+
+    def _score(self, batch: List[Dict[str, Any]]):
+        try:
+            with timed("relevance", self.trace):
+                scores = self.llm.rate_papers_relevance(self.query, batch, self.ctx)
+        except Exception as e:
+            logger.error(f"Error rating papers {[p.get('paperId') for p in batch]}: {e}")
+            scores = {}
+        # A None (or missing) score means scoring failed outright; rather than pretending the paper is irrelevant,
+        # leave it for the embedding fallback with the leftovers
+        missed = [p.get("paperId") for p in batch if scores.get(p.get("paperId")) is None]
+        with self.cond:
+            self.unscored.extend(missed)
+            self.scored += len(batch)
+            done, total = self.scored, len(self.papers)
+        self.status("Rating paper relevance...", stage="relevance", done=done, total=total)
+        for paper_id, relevance in scores.items():
+            if relevance is not None:
+                self._record_relevance(paper_id, relevance)
+
+    def _expand(self):
+        # Stage 3b: follow references, citations and recommendations out from the best papers so far. The new
+        # papers are ranked by their links first, so only the best connected ones reach the LLM
+        with self.cond:
+            seeds = dict(heapq.nlargest(Config.EXPANSION_SEEDS, self.relevance.items(), key=lambda item: item[1]))
+            known = set(self.papers)
+        if not seeds:
+            return
+        self.status("Following citations from the most relevant papers...", stage="expand")
+        year_start = self.semantic_scholar.parse_year_filter(self.year_filter)
+        papers = []
+        with timed("expand", self.trace):
+            ranked = [paper_id for paper_id, _ in self.graph.frontier(seeds, known)]
+            # Citations reach back past the year filter, so fetch up to two batches' worth to find enough papers
+            chunk = 2 * Config.EXPANSION_MAX_PAPERS
+            for start in range(0, min(len(ranked), 2 * chunk), chunk):
+                picked = ranked[start:start + chunk]
+                try:
+                    found = self.semantic_scholar.hydrate(picked)
+                except SearchUnavailableError as e:
+                    logger.error(f"Could not fetch papers found through citations: {e}")
+                    break
+                papers += [found[paper_id] for paper_id in picked if paper_id in found and
+                           (not year_start or (paper_year(found[paper_id]) or 0) >= year_start)]
+                if len(papers) >= Config.EXPANSION_MAX_PAPERS or self.cancelled.is_set():
+                    break
+        papers = papers[:Config.EXPANSION_MAX_PAPERS]
+        if not papers or self.cancelled.is_set():
+            return
+        with self.cond:
+            if self.llm_budget is not None:
+                self.llm_budget += Config.EXPANSION_LLM_BUDGET
+        self._add_papers(papers)
+
+    def _score_leftovers(self):
+        # Papers the LLM didn't get to keep their embedding score (0-100). If the LLM did find relevant papers, the
+        # scores are scaled to below the least relevant of those, so they never outrank one but keep their order;
+        # papers the LLM rated 0 don't count, and if it rated none (say it's down) the scores are used as they are
+        with self.cond:
+            leftovers = [paper_id for _, _, paper_id in self.score_heap] + self.unscored
+            self.score_heap = []
+            self.unscored = []
+            floor = min((relevance for relevance in self.relevance.values() if relevance > 0), default=None)
+        scale = 1.0 if floor is None else 0.9 * floor / 100
+        for paper_id in leftovers:
+            similarity = min(max(self.similarity.get(paper_id, 0.0), 0.0), 1.0)
+            self._record_relevance(paper_id, round(similarity * 100 * scale, 1))
+        self.status("Summarizing the most relevant papers...", stage="summary")
+
+    def _summarize(self, paper: Dict[str, Any]):
+        paper_id = paper.get("paperId")
+        try:
+            with timed("summary", self.trace):
+                summary = self._write_summary(paper)
+        except Exception as e:
+            logger.error(f"Error summarizing paper {paper_id}: {e}")
+            summary = self.stored_summaries.get(paper_id, "")
+        if summary is None:
+            return
+        self._emit({"type": "summary", "data": {"paper_id": paper_id, "summary": summary or "No summary available."}})
+        with self.cond:
+            self.summarized += 1
+            done, waiting = self.summarized, len(self.summary_priority)
+        self.status("Summarizing the most relevant papers...", stage="summary", done=done, total=done + waiting)
+
+    def _write_summary(self, paper: Dict[str, Any]) -> Optional[str]:
+        # None means the client went away mid-stream
+        paper_id = paper.get("paperId")
+        if self.summaries is None:
+            return self._llm_text(paper_id, lambda: self.llm.summarize_paper(self.query, paper, self.ctx),
+                                  lambda: self.llm.summarize_paper_stream(self.query, paper, self.ctx))
+        stored = self.stored_summaries.get(paper_id)
+        if stored is None:
+            # Write the query-independent summary here, at the search's priority, and keep it so neither the
+            # summary worker nor a later search writes it again
+            stored = self._llm_text(
+                paper_id, lambda: self.llm.summarize_paper_general(paper, self.ctx, Priority.BULK),
+                lambda: self.llm.summarize_paper_general_stream(paper, self.ctx, Priority.BULK))
+            if not stored:
+                return stored
+            self.summaries.put(paper_id, stored)
+            with self.cond:
+                self.unsummarized.discard(paper_id)
+                self.stored_summaries[paper_id] = stored
+            if not Config.SUMMARY_QUERY_NOTE:
+                return stored
+            separator = " "
+        else:
+            separator = stored + " "
+        # Only the query-specific sentence is left to write
+        if self.stream_tokens:
+            self._emit({"type": "summary_token", "data": {"paper_id": paper_id, "token": separator}})
+        note = self._llm_text(paper_id, lambda: self.llm.relate_summary(self.query, paper, stored, self.ctx),
+                              lambda: self.llm.relate_summary_stream(self.query, paper, stored, self.ctx))
+        if note is None:
+            return None
+        return f"{stored} {note}".strip()
+
+    def _llm_text(self, paper_id: str, write: Callable[[], str], stream: Callable[[], Iterator[str]]
+                  ) -> Optional[str]:
+        # write() in one go, or stream() with a summary_token event per piece if the client asked for them
+        if not self.stream_tokens:
+            return write().strip()
+        chunks = []
+        for token in stream():
+            if self.cancelled.is_set():
+                return None
+            chunks.append(token)
+            self._emit({"type": "summary_token", "data": {"paper_id": paper_id, "token": token}})
+        return "".join(chunks).strip()
\ No newline at end of file
@@ -1,91 +1,308 @@
+import time
 import requests
-from functools import lru_cache
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 import logging
-import time
 from config import Config
+from concurrency_helper import MicroBatcher, bounded_map_unordered
+from metrics_helper import metrics
+from paper_store import PaperStore, normalize_search_key
+from rate_limiter import TokenBucket, parse_retry_after
+from resilience_helper import CircuitBreaker, RetryPolicy, SearchUnavailableError, status_code
+from single_flight import SingleFlight
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Searches only ask for enough to dedupe; the full records come from /paper/batch (or the paper store)
+SEARCH_FIELDS = "paperId,title"
+PAPER_FIELDS = "title,url,abstract,publicationTypes,publicationDate,openAccessPdf,citationCount,authors,paperId,tldr"
+SEARCH_KEYS = set(SEARCH_FIELDS.split(","))
+
 
 class SemanticScholarAPI:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.headers = {"x-api-key": api_key} if api_key else {}
-        self.search_url = "http://api.semanticscholar.org/graph/v1/paper/search"
-        self.rec_url = "https://api.semanticscholar.org/recommendations/v1/papers"
+        base_url = Config.SEMANTIC_API_URL.rstrip("/")
+        self.search_url = f"{base_url}/graph/v1/paper/search"
+        self.rec_url = f"{base_url}/recommendations/v1/papers"
+        self.batch_url = f"{base_url}/graph/v1/paper/batch"
+        # Per-paper URLs, filled in with format(paper_id=...); retries and metrics are kept per route
+        self.references_route = f"{base_url}/graph/v1/paper/{{paper_id}}/references"
+        self.citations_route = f"{base_url}/graph/v1/paper/{{paper_id}}/citations"
         self.session = requests.Session()
+        self.store = PaperStore(Config.PAPER_STORE_PATH, Config.SEARCH_CACHE_TTL, Config.CACHE_SIZE)
+        rate = Config.SEMANTIC_RATE_KEYED if api_key else Config.SEMANTIC_RATE_ANON
+        self.limiter = TokenBucket(rate, Config.SEMANTIC_RATE_BURST)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=Config.SEARCH_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.endpoints = {self.search_url: "search", self.rec_url: "recommendations", self.batch_url: "batch",
+                          self.references_route: "references", self.citations_route: "citations"}
+        # One breaker per endpoint: recommendations being down shouldn't stop searches
+        self.retry = {
+            url: RetryPolicy(CircuitBreaker(name, Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RESET_TIMEOUT),
+                             SearchUnavailableError, Config.MAX_RETRIES, Config.RETRY_BASE_DELAY,
+                             Config.RETRY_MAX_DELAY)
+            for url, name in ((self.search_url, "Semantic Scholar search"),
+                              (self.rec_url, "Semantic Scholar recommendations"),
+                              (self.batch_url, "Semantic Scholar paper batch"),
+                              (self.references_route, "Semantic Scholar references"),
+                              (self.citations_route, "Semantic Scholar citations"))
+        }
+        # Tabs searching for the same thing at the same time share requests (and rate limit tokens)
+        self.flights = SingleFlight("semantic_scholar")
+        # Paper ids from pages that arrive while a /paper/batch call is running go together in the next one
+        self.hydrator = MicroBatcher(self._fetch_batch, Config.SEMANTIC_BATCH_SIZE)
 
-    @lru_cache(maxsize=Config.CACHE_SIZE)
-    def search_papers(self, query: str, year_filter: Optional[str] = None) -> List[Dict[str, Any]]:
-        url = self.search_url
-        all_papers = []
-
-        # Parse year filter
+    @staticmethod
+    def parse_year_filter(year_filter: Optional[str]) -> Optional[int]:
         year_start = None
         if year_filter and year_filter.endswith('-'):
             try:
                 year_start = int(year_filter[:-1])
             except ValueError:
                 logger.warning(f"Invalid year filter: {year_filter}")
+        return year_start
 
-        for page in range(Config.MAX_PAGES):
-            time.sleep(1)  # Rate limiting
-
-            params = {
-                "query": query,
-                "fields": "title,url,abstract,publicationTypes,publicationDate,"
-                          "openAccessPdf,citationCount,authors,paperId,tldr",
-                "limit": Config.PAPERS_PER_PAGE,
-                "offset": page * Config.PAPERS_PER_PAGE,
-                **({"year": f"{year_start}-"} if year_start else {})
-            }
+    def _request(self, method: str, url: str, route: Optional[str] = None, **kwargs) -> requests.Response:
+        """
+        Sends one request through the shared rate limiter, retrying failures with jittered exponential backoff.
+        On a 429 the whole limiter is paused for the server's Retry-After instead, so every worker backs off.
+        `route` is the URL template a per-paper url was made from, if any.
 
+        Raises:
+            SearchUnavailableError: Retries ran out, the error wasn't worth retrying, or the endpoint's circuit
+            is open.
+        """
+        policy = self.retry[route or url]
+        endpoint = self.endpoints[route or url]
+        for attempt in policy.attempts():
+            waiting = time.perf_counter()
+            self.limiter.acquire()
+            started = time.perf_counter()
+            metrics.observe("semantic_scholar_rate_limit_wait_seconds", started - waiting, endpoint=endpoint)
             try:
-                response = self.session.get(
-                    url,
-                    params=params,
-                    headers=self.headers,
-                    timeout=Config.TIMEOUT
-                )
+                try:
+                    response = self.session.request(method, url, headers=self.headers, timeout=Config.TIMEOUT,
+                                                    **kwargs)
+                finally:
+                    metrics.observe("semantic_scholar_request_seconds", time.perf_counter() - started,
+                                    endpoint=endpoint)
+                metrics.inc("semantic_scholar_requests_total", endpoint=endpoint, status=response.status_code)
                 response.raise_for_status()
-                papers = response.json().get("data", [])
+                policy.succeeded()
+                return response
+            except requests.exceptions.RequestException as e:
+                if e.response is None:
+                    metrics.inc("semantic_scholar_requests_total", endpoint=endpoint, status="error")
+                rate_limited = status_code(e) == 429
+                if rate_limited:
+                    delay = parse_retry_after(e.response.headers.get("Retry-After"))
+                    logger.warning(f"Rate limited by Semantic Scholar, pausing {delay:.1f}s "
+                                   f"(attempt {attempt + 1}/{Config.MAX_RETRIES})")
+                    self.limiter.pause(delay)
+                policy.failed(attempt, e, wait=not rate_limited)
+
+    def _fetch_page(self, query: str, year_start: Optional[int], page: int) -> Dict[str, Any]:
+        key = ("search", normalize_search_key(query, year_start), page)
+        return self.flights.do(key, lambda: self._request_page(query, year_start, page))
+
+    def _request_page(self, query: str, year_start: Optional[int], page: int) -> Dict[str, Any]:
+        params = {
+            "query": query,
+            "fields": SEARCH_FIELDS,
+            "limit": Config.PAPERS_PER_PAGE,
+            "offset": page * Config.PAPERS_PER_PAGE,
+            **({"year": f"{year_start}-"} if year_start else {})
+        }
+        body = self._request("GET", self.search_url, params=params).json()
+        light = body.get("data", [])
+        try:
+            full = self.hydrate([p.get("paperId") for p in light])
+            body["hydrated"] = True
+            # Ids /paper/batch returned null for keep their search record for display, but are never stored
+            body["unhydrated"] = [p.get("paperId") for p in light if p.get("paperId") not in full]
+        except SearchUnavailableError as e:
+            # Still show the titles, but don't cache a search made of partial records
+            logger.error(f"Could not fetch paper details for {query!r} page {page}: {e}")
+            full = {}
+            body["hydrated"] = False
+        body["data"] = [full.get(p.get("paperId")) or p for p in light]
+        return body
 
-                # If we got fewer papers than requested, we've reached the end
-                if len(papers) < Config.PAPERS_PER_PAGE:
-                    all_papers.extend(papers)
-                    break
+    def hydrate(self, paper_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Full records (PAPER_FIELDS) for paper_ids. Papers already in the paper store are never fetched again;
+        the rest are requested with POST /paper/batch, batched together with other searches' lookups.
 
-                all_papers.extend(papers)
+        Returns:
+            dict: paperId -> record, for every id Semantic Scholar knows.
+        Raises:
+            SearchUnavailableError: The batch endpoint failed.
+        """
+        paper_ids = [paper_id for paper_id in dict.fromkeys(paper_ids) if paper_id]
+        # Bare search records ({paperId, title}) stored by older versions don't count as fetched
+        found = {paper_id: paper for paper_id, paper in self.store.get_papers(paper_ids).items()
+                 if not set(paper) <= SEARCH_KEYS}
+        missing = [paper_id for paper_id in paper_ids if paper_id not in found]
+        if missing:
+            fetched = self.hydrator.get(missing)
+            found.update({paper_id: paper for paper_id, paper in fetched.items() if paper})
+        return found
 
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error fetching papers on page {page}: {e}")
-                break  # Stop pagination on error
+    def _fetch_batch(self, paper_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        response = self._request("POST", self.batch_url, params={"fields": PAPER_FIELDS}, json={"ids": paper_ids})
+        # Unknown ids come back as null, in the same position
+        papers = [paper for paper in response.json() if paper]
+        self.store.put_papers(papers)
+        logger.info(f"Fetched details for {len(papers)}/{len(paper_ids)} papers in one batch")
+        return {paper.get("paperId"): paper for paper in papers}
+
+    def iter_search(self, queries: List[str], year_filter: Optional[str] = None
+                    ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Runs every (query, page) request concurrently under the shared rate limiter.
 
+        Before going to the API, each query is run against the local corpus (every paper we've stored), and any
+        matches are yielded straight away. Queries with at least LOCAL_CORPUS_ENOUGH local matches skip the API
+        altogether (0 = always ask the API too); otherwise the API fills in, and only papers we don't have yet
+        are fetched in full.
+
+        Args:
+            queries (list): Search queries.
+            year_filter (str): Year filter such as "2020-".
+        Returns:
+            iterator: (query, papers) pairs, one per page, as soon as each page arrives. Cached searches come
+            back first, as a single batch, then local corpus matches.
+        Raises:
+            SearchUnavailableError: Every request failed and nothing was found locally, so "no papers" would not
+            be a real answer.
+        """
+        year_start = self.parse_year_filter(year_filter)
+        pages = {}
+        answered = False
+        last_error = None
+        for query in dict.fromkeys(queries):
+            cached = self.store.get_search(query, year_start)
+            if cached is not None:
+                answered = True
+                yield query, cached
+            else:
+                pages[query] = {}
+        if Config.LOCAL_CORPUS_ENABLED:
+            for query in list(pages):
+                local = self.store.search_local(query, year_start, Config.LOCAL_CORPUS_LIMIT)
+                if local:
+                    answered = True
+                    yield query, local
+                if Config.LOCAL_CORPUS_ENOUGH and len(local) >= Config.LOCAL_CORPUS_ENOUGH:
+                    del pages[query]
+
+        jobs = [(query, page) for query in pages for page in range(Config.MAX_PAGES)]
+        results = bounded_map_unordered(
+            lambda job: self._fetch_page(job[0], year_start, job[1]),
+            jobs,
+            max_workers=Config.SEARCH_WORKERS
+        )
+        for (query, page), body, error in results:
+            if error is not None:
+                logger.error(f"Error fetching papers for {query!r} on page {page}: {error}")
+                last_error = error
+                body = None
+            else:
+                answered = True
+            pages[query][page] = body
+            if body:
+                papers = body.get("data", [])
+                if papers:
+                    yield query, papers
+            if len(pages[query]) == Config.MAX_PAGES:
+                self._store_if_complete(query, year_start, pages.pop(query))
+        if not answered and last_error is not None:
+            raise SearchUnavailableError(f"Semantic Scholar search failed: {last_error}") from last_error
+
+    def _store_if_complete(self, query: str, year_start: Optional[int], pages: Dict[int, Optional[Dict[str, Any]]]):
+        # Only complete result sets get cached: no failed pages, and either every page was full or we reached the
+        # reported total (a short page that isn't the end of the results is a partial response)
+        all_papers = []
+        for page in range(Config.MAX_PAGES):
+            body = pages.get(page)
+            if body is None or not body.get("hydrated", True):
+                return
+            papers = body.get("data", [])
+            unhydrated = set(body.get("unhydrated", []))
+            all_papers.extend(p for p in papers if p.get("paperId") not in unhydrated)
+            if len(papers) < Config.PAPERS_PER_PAGE:
+                if page * Config.PAPERS_PER_PAGE + len(papers) < body.get("total", 0):
+                    return
+                break
+        self.store.put_search(query, year_start, all_papers)
+
+    def search_papers(self, query: str, year_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        all_papers = []
+        seen = set()
+        for _, papers in self.iter_search([query], year_filter):
+            for paper in papers:
+                if paper.get("paperId") not in seen:
+                    seen.add(paper.get("paperId"))
+                    all_papers.append(paper)
         return all_papers
 
     def get_recommended_papers(self, paper_ids: List[str], limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Raises:
+            SearchUnavailableError: The recommendations endpoint failed.
+        """
         if not paper_ids:
             return []
 
         url = self.rec_url
         params = {
-            "fields": "title,url,abstract,citationCount,authors,publicationDate,openAccessPdf,paperId,tldr",
+            "fields": SEARCH_FIELDS,
             "limit": limit
         }
 
-        try:
-            response = self.session.post(
-                url,
-                json={"positivePaperIds": paper_ids},
-                params=params,
-                headers=self.headers,
-                timeout=Config.TIMEOUT
-            )
-            response.raise_for_status()
-            return response.json().get('recommendedPapers', [])
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching recommendations: {e}")
-            return []
+        # Kept like a search, so asking again for the same papers' recommendations costs no request
+        key = f"recommendations:{','.join(sorted(paper_ids))}:{limit}"
+        cached = self.store.get_search(key)
+        if cached is not None:
+            return cached
+
+        def fetch():
+            response = self._request("POST", url, json={"positivePaperIds": paper_ids}, params=params)
+            light = response.json().get('recommendedPapers', [])
+            full = self.hydrate([p.get("paperId") for p in light])
+            papers = [full.get(p.get("paperId")) or p for p in light]
+            if len(full) == len(light):
+                self.store.put_search(key, None, papers)
+            return papers
+
+        return self.flights.do(("recommendations", tuple(sorted(paper_ids)), limit), fetch)
+
+    def get_neighbors(self, paper_id: str, direction: str, limit: int = 100) -> List[str]:
+        """
+        Ids of the papers paper_id cites (direction "references") or that cite it ("citations"). Each paper's
+        edges are kept in the paper store's citation graph, so they're only fetched once per SEARCH_CACHE_TTL.
+
+        Raises:
+            SearchUnavailableError: The endpoint failed.
+        """
+        cached = self.store.get_neighbors([paper_id], direction)
+        if paper_id in cached:
+            return cached[paper_id]
+        route = self.references_route if direction == "references" else self.citations_route
+        other = "citedPaper" if direction == "references" else "citingPaper"
+
+        def fetch():
+            params = {"fields": "paperId", "limit": limit}
+            body = self._request("GET", route.format(paper_id=paper_id), route=route, params=params).json()
+            # "data" is null when the publisher doesn't allow the list to be shown, and unresolved entries
+            # have no paperId
+            neighbors = [(item.get(other) or {}).get("paperId") for item in body.get("data") or []]
+            neighbors = [neighbor for neighbor in dict.fromkeys(neighbors) if neighbor]
+            self.store.put_neighbors(paper_id, direction, neighbors)
+            return neighbors
+
+        return self.flights.do((direction, paper_id, limit), fetch)
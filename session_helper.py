@@ -0,0 +1,160 @@
+import logging
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Rough memory footprint of session state, dominated by text (papers, chat history) and arrays.
+    Objects that know their own size (numpy arrays, indexes) report it through an `nbytes` attribute.
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class SessionStore:
+    """
+    Bounded in-memory store for per-session state (chats, search flags), keyed by an id.
+
+    Entries are evicted least-recently-used first when there are more than max_entries or their combined
+    estimated size passes max_bytes, and any entry untouched for idle_ttl seconds is evicted too. With a
+    spill_path, evicted entries are pickled to SQLite and transparently restored on the next get(), so a chat
+    that was pushed out of memory can be picked up again later (until spill_ttl runs out).
+
+    Values are plain dicts that callers mutate in place; call put() after changing one so its size is
+    re-counted.
+    """
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int, idle_ttl: float,
+                 spill_path: str = "", spill_ttl: float = 0):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.spill_ttl = spill_ttl
+        self._entries = OrderedDict()  # key -> (value, size, last_used)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._conn = None
+        if spill_path:
+            directory = os.path.dirname(spill_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(spill_path, check_same_thread=False, timeout=30)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS spilled ("
+                " store TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, spilled REAL NOT NULL,"
+                " PRIMARY KEY (store, key))"
+            )
+            self._conn.commit()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Dict[str, Any]):
+        self.put(key, value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if key is None:
+            return None
+        with self._lock:
+            self._expire_idle()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], entry[1], time.monotonic())
+                self._entries.move_to_end(key)
+                return entry[0]
+            value = self._restore(key)
+            if value is not None:
+                self.put(key, value)
+            return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        size = estimate_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, time.monotonic())
+            self._bytes += size
+            # Never evict the entry we're putting, even if it alone is over budget
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._evict(next(iter(self._entries)))
+
+    def pop(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM spilled WHERE store = ? AND key = ?", (self.name, key))
+                self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _expire_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._entries:
+            key, (_, _, last_used) = next(iter(self._entries.items()))
+            if last_used > cutoff:
+                break
+            self._evict(key)
+
+    def _evict(self, key: str):
+        value, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        if self._conn is None:
+            return
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning(f"Could not spill {self.name} entry {key} to disk: {e}")
+            return
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO spilled (store, key, value, spilled) VALUES (?, ?, ?, ?)",
+            (self.name, key, blob, now)
+        )
+        if self.spill_ttl:
+            self._conn.execute("DELETE FROM spilled WHERE spilled < ?", (now - self.spill_ttl,))
+        self._conn.commit()
+
+    def _restore(self, key: str) -> Optional[Dict[str, Any]]:
+        if self._conn is None:
+            return None
+        row = self._conn.execute(
+            "SELECT value FROM spilled WHERE store = ? AND key = ?", (self.name, key)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("DELETE FROM spilled WHERE store = ? AND key = ?", (self.name, key))
+        self._conn.commit()
+        return pickle.loads(row[0])
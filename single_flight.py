@@ -0,0 +1,96 @@
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class WaitCancelled(Exception):
+    """Raised in a follower whose own cancel event was set while it waited for the leader."""
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is in flight, other callers with the same key
+    wait for its result instead of making their own. Results are not kept once the call finishes (that's what
+    the caches are for), and an exception is raised in every waiting caller.
+
+    Either wrap the call with do(key, fn), or, when the leader needs to do more than return a value (e.g.
+    stream it), use begin(key) and then finish(key, future, result=... or error=...).
+
+    Calls can have a rank (lower is more urgent, like LLM priorities): a caller never joins a flight of lower
+    urgency than its own, since it would inherit that flight's place in the queue. It starts its own flight
+    instead, which later callers of the same key then join.
+
+    Args:
+        name (str): Used in logs and stats.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def begin(self, key: Hashable, rank: int = 0) -> Tuple[bool, Future]:
+        """
+        Returns (True, future) if the caller is the leader and must call finish(), or (False, future) for a
+        follower, who waits with wait(future).
+        """
+        with self.lock:
+            self.calls += 1
+            flight = self.in_flight.get(key)
+            if flight is not None and flight[1] <= rank:
+                self.coalesced += 1
+                return False, flight[0]
+            future = Future()
+            self.in_flight[key] = (future, rank)
+            return True, future
+
+    def finish(self, key: Hashable, future: Future, result: Any = None, error: BaseException = None):
+        with self.lock:
+            flight = self.in_flight.get(key)
+            if flight is not None and flight[0] is future:
+                del self.in_flight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    @staticmethod
+    def wait(future: Future, cancelled: Optional[threading.Event] = None) -> Any:
+        """The leader's result; raises WaitCancelled if `cancelled` is set first."""
+        if cancelled is None:
+            return future.result()
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except TimeoutError:
+                if cancelled.is_set():
+                    raise WaitCancelled()
+
+    def do(self, key: Hashable, fn: Callable[[], Any], rank: int = 0,
+           cancelled: Optional[threading.Event] = None) -> Any:
+        leader, future = self.begin(key, rank)
+        if not leader:
+            return self.wait(future, cancelled)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result=result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "name": self.name,
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self.in_flight),
+                "coalesced_ratio": self.coalesced / self.calls if self.calls else 0.0,
+            }
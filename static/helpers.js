@@ -3,6 +3,8 @@ let sortAscending = false;
 let paperData = new Map();
 let chatHistory = [];
 let activeChatId = null;
+// Identifies this tab, so status updates (and server-side state) aren't shared with other tabs
+const sessionId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
 
 async function exportToPDF() {
     try {
@@ -95,12 +97,40 @@ function formatDate(dateString) {
         return dateString;
     }
 }
+// Reads an NDJSON response body, calling onEvent for every complete line.
+// Lines can be split across network chunks, so partial lines are buffered until their newline arrives.
+async function readNdjson(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const {value, done} = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, {stream: true});
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+            if (line) onEvent(JSON.parse(line));
+        }
+    }
+    if (buffer) onEvent(JSON.parse(buffer));
+}
+
 function initializeStatusUpdates() {
-    const evtSource = new EventSource("/status");
+    const evtSource = new EventSource(`/status?session_id=${encodeURIComponent(sessionId)}`);
     evtSource.onmessage = function(event) {
         const data = JSON.parse(event.data);
         if (data.status) {
-            updateLoadingStatus(data.status);
+            let message = data.status;
+            if (data.total) {
+                message += ` (${data.done}/${data.total})`;
+            }
+            if (data.elapsed !== undefined) {
+                message += ` ${Math.round(data.elapsed)}s`;
+            }
+            updateLoadingStatus(message);
         }
     };
     return evtSource;
@@ -116,26 +146,48 @@ async function handleChat() {
     loading.classList.remove('hidden');
 
     try {
-        const response = await fetch('/chat', {
+        const response = await fetch('/chat_stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 message: query,
-                chat_id: activeChatId
+                chat_id: activeChatId,
+                session_id: sessionId
             })
         });
 
-        const data = await response.json();
-
-        if (data.error) {
-            showError(data.error);
+        if (!response.ok) {
+            const error = await response.json();
+            showError(error.error || 'Chat request failed');
             return;
         }
 
+        // Show the reply as it is written, then swap in the final cleaned-up response
+        let streamedText = '';
+        let streamingMessage = null;
+        let data = null;
+        await readNdjson(response, (event) => {
+            if (event.type === 'token') {
+                streamedText += event.data;
+                if (!streamingMessage) {
+                    streamingMessage = addChatMessage(streamedText, false);
+                    loading.classList.add('hidden');
+                } else {
+                    setChatMessageText(streamingMessage, streamedText);
+                }
+            } else if (event.type === 'done') {
+                data = event.data;
+            } else if (event.type === 'error') {
+                showError(event.data);
+            }
+        });
+        if (!data) return;
+
         if (data.chat_id) {
             activeChatId = data.chat_id;
         }
         if (data.ready_to_search) {
+            if (streamingMessage) streamingMessage.remove();
             addChatMessage("Got it! I am putting a search query into the box below, and will begin looking now.")
             const query = document.getElementById('query');
             query.value = data.summary;
@@ -145,7 +197,11 @@ async function handleChat() {
             query.value = ''
             addChatMessage(`Searched for: "${data.summary}"`, false)
         } else if (data.most_recent_response) {
-            addChatMessage(data.most_recent_response, false); // Add AI message
+            if (streamingMessage) {
+                streamingMessage.innerHTML = data.most_recent_response;
+            } else {
+                addChatMessage(data.most_recent_response, false); // Add AI message
+            }
             loading.classList.add('hidden');
         }
 
@@ -180,6 +236,13 @@ function addChatMessage(text, isUser) {
     adjustChatHeight();
     // Auto-scroll to the bottom
     chatContainer.scrollTop = chatContainer.scrollHeight;
+    return messageDiv;
+}
+
+function setChatMessageText(messageDiv, text) {
+    messageDiv.innerHTML = text.replace(/\n/g, '<br />');
+    const chatContainer = document.getElementById('chatContainer');
+    chatContainer.scrollTop = chatContainer.scrollHeight;
 }
 
 function toggleSection(section) {
@@ -198,28 +261,42 @@ async function generateTimeline() {
         return;
     }
 
+    const loading = document.getElementById('loading');
     try {
         // Show loading state
-        const loading = document.getElementById('loading');
         const loadingStatus = document.getElementById('loadingStatus');
         loading.classList.remove('hidden');
         loadingStatus.textContent = 'Generating research timeline...';
 
-        const response = await fetch('/generate_timeline', {
+        const response = await fetch('/generate_timeline_stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ papers })
         });
 
-        const data = await response.json();
-        if (data.timeline) {
-            const timelineSection = document.getElementById('timelineSection');
-            const timelineOutput = document.getElementById('timelineOutput');
+        if (!response.ok) {
+            const error = await response.json();
+            showError(error.error || 'Error generating timeline');
+            return;
+        }
+
+        const timelineSection = document.getElementById('timelineSection');
+        const timelineOutput = document.getElementById('timelineOutput');
+        let streamedText = '';
+        await readNdjson(response, (event) => {
+            if (event.type === 'token') {
+                streamedText += event.data;
+            } else if (event.type === 'done') {
+                streamedText = event.data.timeline;
+            } else {
+                if (event.type === 'error') showError(event.data);
+                return;
+            }
             timelineSection.classList.remove('hidden');
-            timelineOutput.innerHTML = marked.parse(data.timeline);
+            timelineOutput.innerHTML = marked.parse(streamedText);
             timelineOutput.classList.remove('hidden');
             document.getElementById('timelineIcon').style.transform = 'rotate(180deg)';
-        }
+        });
     } catch (error) {
         showError('Error generating timeline: ' + error.message);
     } finally {
@@ -234,28 +311,42 @@ async function generateFutureWork() {
         return;
     }
 
+    const loading = document.getElementById('loading');
     try {
         // Show loading state
-        const loading = document.getElementById('loading');
         const loadingStatus = document.getElementById('loadingStatus');
         loading.classList.remove('hidden');
         loadingStatus.textContent = 'Generating future work ideas...';
 
-        const response = await fetch('/generate_future_work', {
+        const response = await fetch('/generate_future_work_stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ papers })
         });
 
-        const data = await response.json();
-        if (data.future_work) {
-            const futureWorkSection = document.getElementById('futureWorkSection');
-            const futureWorkOutput = document.getElementById('futureWorkOutput');
+        if (!response.ok) {
+            const error = await response.json();
+            showError(error.error || 'Error generating future work ideas');
+            return;
+        }
+
+        const futureWorkSection = document.getElementById('futureWorkSection');
+        const futureWorkOutput = document.getElementById('futureWorkOutput');
+        let streamedText = '';
+        await readNdjson(response, (event) => {
+            if (event.type === 'token') {
+                streamedText += event.data;
+            } else if (event.type === 'done') {
+                streamedText = event.data.future_work;
+            } else {
+                if (event.type === 'error') showError(event.data);
+                return;
+            }
             futureWorkSection.classList.remove('hidden');
-            futureWorkOutput.innerHTML = marked.parse(data.future_work);
+            futureWorkOutput.innerHTML = marked.parse(streamedText);
             futureWorkOutput.classList.remove('hidden');
             document.getElementById('futureWorkIcon').style.transform = 'rotate(180deg)';
-          }
+        });
     } catch (error) {
         showError('Error generating future work ideas: ' + error.message);
     } finally {
@@ -332,7 +423,11 @@ function createPaperCard(paper) {
         `;
         chatButton.onclick = async () => {
             try {
-                const response = await fetch(`/process-pdf?url=${encodeURIComponent(paper.pdf_url)}`);
+                const params = new URLSearchParams({ url: paper.pdf_url, title: paper.title || 'Untitled' });
+                params.set('session_id', sessionId);
+                if (paper.paper_id) params.set('paper_id', paper.paper_id);
+                if (activeChatId) params.set('chat_id', activeChatId);
+                const response = await fetch(`/process-pdf?${params}`);
                 if (!response.ok) {
                     throw new Error('Failed to process PDF.');
                 }
@@ -342,10 +437,15 @@ function createPaperCard(paper) {
                     alert(`Error processing PDF: ${result.error}`);
                 } else {
                     if (result.chat_id) {
+                        const addedToChat = result.chat_id === activeChatId;
                         activeChatId = result.chat_id;
                         const paperTitle = paper.title || 'The paper'; // Ensure fallback if title is missing
 
-                        addChatMessage(`"${paperTitle}" has been successfully loaded. You can now ask questions about its content.`, false);
+                        if (addedToChat) {
+                            addChatMessage(`"${paperTitle}" has been added to this chat. You can now ask questions across all of the loaded papers.`, false);
+                        } else {
+                            addChatMessage(`"${paperTitle}" has been successfully loaded. You can now ask questions about its content.`, false);
+                        }
                         // Scroll back to the top of the page
                         window.scrollTo({
                             top: 0,
@@ -408,11 +508,12 @@ function sortResults() {
         if (paper && paper.paper_id) {
             const card = createPaperCard(paper);
 
-            // If we already have a summary, update it immediately
-            if (paper.summary) {
+            // If we already have a summary (or part of one), update it immediately
+            const summaryText = paper.summary || paper.partial_summary;
+            if (summaryText) {
                 const summaryElement = card.querySelector('.summary-placeholder');
                 if (summaryElement) {
-                    summaryElement.textContent = paper.summary;
+                    summaryElement.textContent = summaryText;
                     summaryElement.classList.remove('animate-pulse', 'bg-gray-100');
                 }
             }
@@ -468,61 +569,68 @@ document.getElementById('searchButton').addEventListener('click', async () => {
     futureWorkSection.classList.add('hidden');
 
 
+    // Open the page with ?trace=1 to get a timing breakdown of each search in the browser console
+    const trace = new URLSearchParams(window.location.search).has('trace');
+
     try {
         const response = await fetch('/stream_search', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ query, year_filter: yearFilter })
+            body: JSON.stringify({ query, year_filter: yearFilter, stream_tokens: true, session_id: sessionId, trace })
         });
 
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-
-        while (true) {
-            const {value, done} = await reader.read();
-            if (done) break;
-
-            const lines = decoder.decode(value).split('\n');
-            for (const line of lines) {
-                if (!line) continue;
-                const data = JSON.parse(line);
-
-                switch (data.type) {
-                    case 'refined_query':
-                        document.getElementById('refinedQuery').textContent = data.data.join(', ');
-                        results.classList.remove('hidden');
-                        break;
-                    case 'papers':
-                        // Add new papers to paperData
-                        data.data.forEach(paper => {
-                            updatePaperData(paper);
-                            // Only append to DOM if the card doesn't exist
-                            if (!document.querySelector(`[data-paper-id="${paper.paper_id}"]`)) {
-                                papersContainer.appendChild(createPaperCard(paper));
-                            }
-                        });
-                        // Update total results count
-                        document.getElementById('totalResults').textContent = paperData.size;
-                        break;
-                    case 'relevance':
-                        const paper = paperData.get(data.data.paper_id);
-                        if (paper) {
-                            paper.relevance = data.data.relevance;
-                            updatePaperData(paper);
+        await readNdjson(response, (data) => {
+            switch (data.type) {
+                case 'refined_query':
+                    document.getElementById('refinedQuery').textContent = data.data.join(', ');
+                    results.classList.remove('hidden');
+                    break;
+                case 'papers':
+                    // Add new papers to paperData
+                    data.data.forEach(paper => {
+                        updatePaperData(paper);
+                        // Only append to DOM if the card doesn't exist
+                        if (!document.querySelector(`[data-paper-id="${paper.paper_id}"]`)) {
+                            papersContainer.appendChild(createPaperCard(paper));
                         }
-                        sortResults();
-                        break;
-                    case 'summary':
-                        updatePaperCard(data.data.paper_id, data.data.summary);
-                        const existingPaper = paperData.get(data.data.paper_id);
-                        if (existingPaper) {
-                            existingPaper.summary = data.data.summary;
-                            updatePaperData(existingPaper);
-                        }
-                        break;
-                }
+                    });
+                    // Update total results count
+                    document.getElementById('totalResults').textContent = paperData.size;
+                    break;
+                case 'relevance':
+                    const paper = paperData.get(data.data.paper_id);
+                    if (paper) {
+                        paper.relevance = data.data.relevance;
+                        updatePaperData(paper);
+                    }
+                    sortResults();
+                    break;
+                case 'summary_token':
+                    const streamingPaper = paperData.get(data.data.paper_id);
+                    if (streamingPaper) {
+                        streamingPaper.partial_summary = (streamingPaper.partial_summary || '') + data.data.token;
+                        updatePaperCard(data.data.paper_id, streamingPaper.partial_summary);
+                    }
+                    break;
+                case 'error':
+                    showError(data.data.message);
+                    break;
+                case 'summary':
+                    updatePaperCard(data.data.paper_id, data.data.summary);
+                    const existingPaper = paperData.get(data.data.paper_id);
+                    if (existingPaper) {
+                        existingPaper.summary = data.data.summary;
+                        delete existingPaper.partial_summary;
+                        updatePaperData(existingPaper);
+                    }
+                    break;
+                case 'trace':
+                    console.info(`Search took ${data.data.elapsed}s`);
+                    console.table(data.data.stages);
+                    console.table(data.data.llm);
+                    break;
             }
-        }
+        });
     } catch (error) {
         showError(error.message || 'An error occurred while searching');
     } finally {
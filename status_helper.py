@@ -0,0 +1,141 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Iterator, Optional
+
+
+class _Channel:
+    def __init__(self, buffer_size: int):
+        self.messages = deque(maxlen=buffer_size)
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.subscribers = 0
+        self.waiters = set()    # (event loop, asyncio.Event) of async subscribers
+        self.last_active = time.monotonic()
+
+
+class StatusBus:
+    """
+    Per-session pub/sub for status updates sent to the browser over server-sent events.
+
+    Each session has a bounded ring buffer of recent messages. Subscribers block on a condition variable (or
+    await an asyncio.Event, under the ASGI server) until something is published or a slow heartbeat is due,
+    instead of polling, and sessions with no subscribers are dropped once they've been idle for idle_ttl seconds.
+    """
+
+    def __init__(self, buffer_size: int, heartbeat_interval: float, idle_ttl: float):
+        self.buffer_size = buffer_size
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_ttl = idle_ttl
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, session_id: str) -> _Channel:
+        with self._lock:
+            channel = self._channels.get(session_id)
+            if channel is None:
+                channel = self._channels[session_id] = _Channel(self.buffer_size)
+            channel.last_active = time.monotonic()
+            return channel
+
+    def _sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            for session_id in [s for s, c in self._channels.items()
+                               if c.subscribers == 0 and now - c.last_active > self.idle_ttl]:
+                del self._channels[session_id]
+
+    def publish(self, session_id: str, message: str, stage: Optional[str] = None, done: Optional[int] = None,
+                total: Optional[int] = None, started: Optional[float] = None):
+        """
+        Args:
+            session_id (str): Browser session to notify.
+            message (str): Human readable status.
+            stage (str): Machine readable stage name, e.g. "relevance".
+            done (int): Items finished so far in this stage.
+            total (int): Items in this stage.
+            started (float): time.time() when the operation began, used to report elapsed seconds.
+        """
+        update = {"status": message}
+        if stage is not None:
+            update["stage"] = stage
+        if done is not None:
+            update["done"] = done
+        if total is not None:
+            update["total"] = total
+        if started is not None:
+            update["elapsed"] = round(time.time() - started, 1)
+        channel = self._channel(session_id)
+        with channel.condition:
+            channel.seq += 1
+            channel.messages.append((channel.seq, update))
+            channel.condition.notify_all()
+            for loop, wakeup in channel.waiters:
+                try:
+                    loop.call_soon_threadsafe(wakeup.set)
+                except RuntimeError:
+                    # That subscriber's event loop has already shut down
+                    pass
+        self._sweep()
+
+    def subscribe(self, session_id: str) -> Iterator[str]:
+        """
+        Yields server-sent event lines for one session until the client disconnects.
+        Only messages published after subscribing are sent.
+        """
+        channel = self._channel(session_id)
+        with channel.condition:
+            channel.subscribers += 1
+            cursor = channel.seq
+        try:
+            while True:
+                with channel.condition:
+                    channel.condition.wait_for(lambda: channel.seq > cursor, timeout=self.heartbeat_interval)
+                    updates = [update for seq, update in channel.messages if seq > cursor]
+                    cursor = channel.seq
+                if not updates:
+                    yield f"data: {json.dumps({'heartbeat': True})}\n\n"
+                for update in updates:
+                    yield f"data: {json.dumps(update)}\n\n"
+        finally:
+            # Runs when the WSGI server closes the generator after the client goes away
+            with channel.condition:
+                channel.subscribers -= 1
+            channel.last_active = time.monotonic()
+            self._sweep()
+
+    async def asubscribe(self, session_id: str) -> AsyncIterator[str]:
+        """
+        subscribe() for the asyncio server: waits on an asyncio.Event that publish() sets from whichever thread
+        it runs on, so an idle /status stream costs no thread. Ends when the consuming task is cancelled.
+        """
+        wakeup = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wakeup)
+        channel = self._channel(session_id)
+        with channel.condition:
+            channel.subscribers += 1
+            channel.waiters.add(waiter)
+            cursor = channel.seq
+        try:
+            while True:
+                # Cleared before reading, so a publish() that lands after the read still wakes us
+                wakeup.clear()
+                with channel.condition:
+                    updates = [update for seq, update in channel.messages if seq > cursor]
+                    cursor = channel.seq
+                if not updates:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout=self.heartbeat_interval)
+                    except asyncio.TimeoutError:
+                        yield f"data: {json.dumps({'heartbeat': True})}\n\n"
+                    continue
+                for update in updates:
+                    yield f"data: {json.dumps(update)}\n\n"
+        finally:
+            with channel.condition:
+                channel.subscribers -= 1
+                channel.waiters.discard(waiter)
+            channel.last_active = time.monotonic()
+            self._sweep()
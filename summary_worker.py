@@ -0,0 +1,227 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+from llm_scheduler import RequestContext
+from local_llm_helper import LocalLLM
+from paper_store import PaperStore
+from resilience_helper import LLMUnavailableError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Job priorities: papers a user just searched for go ahead of a bulk warm-up
+PRIORITY_SEARCH = 0
+PRIORITY_WARM = 1
+
+# A job claimed this long ago whose worker never finished it (the process died) is handed out again
+JOB_LEASE = 15 * 60
+
+
+class SummaryJobs:
+    """
+    Durable queue of papers waiting for a query-independent summary, one job per (paperId, model).
+
+    Backed by SQLite, so jobs survive restarts and the queue can be filled by one process (presummarize.py)
+    and worked through by another (the app). Claiming a job is a single write transaction, so several
+    processes can drain the same queue without doing a paper twice. Finished jobs are kept, which makes
+    enqueueing a paper that was already summarized (or given up on) a no-op.
+    """
+
+    def __init__(self, path: str, max_attempts: int):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit, so claim() can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " paper_id TEXT NOT NULL, model TEXT NOT NULL, state TEXT NOT NULL, priority INTEGER NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, enqueued REAL NOT NULL, updated REAL NOT NULL, error TEXT,"
+            " PRIMARY KEY (paper_id, model))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_next ON jobs (model, state, priority, enqueued)")
+
+    def enqueue(self, paper_ids: Iterable[str], model: str, priority: int = PRIORITY_SEARCH) -> int:
+        """Adds jobs for papers that don't have one yet; returns how many were added."""
+        now = time.time()
+        rows = [(paper_id, model, priority, now, now) for paper_id in dict.fromkeys(paper_ids) if paper_id]
+        if not rows:
+            return 0
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (paper_id, model, state, priority, enqueued, updated) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)", rows
+            )
+            return self._conn.total_changes - before
+
+    def claim(self, model: str, limit: int = 1) -> List[str]:
+        """Marks up to `limit` of the most urgent queued (or abandoned) jobs as running and returns their paperIds."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                paper_ids = [row[0] for row in self._conn.execute(
+                    "SELECT paper_id FROM jobs WHERE model = ? AND (state = 'queued' OR "
+                    "(state = 'running' AND updated < ?)) ORDER BY priority, enqueued LIMIT ?",
+                    (model, now - JOB_LEASE, limit)
+                )]
+                self._conn.executemany(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, updated = ? "
+                    "WHERE paper_id = ? AND model = ?", [(now, paper_id, model) for paper_id in paper_ids]
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return paper_ids
+
+    def finish(self, paper_id: str, model: str, state: str = "done", error: Optional[str] = None):
+        """
+        state: "done", or "skipped" for papers there's nothing to summarize from. Also records papers that were
+        never queued (summarized by a search), so enqueueing them later is a no-op.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (paper_id, model, state, priority, enqueued, updated, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (paper_id, model) DO UPDATE SET state = excluded.state, "
+                "updated = excluded.updated, error = excluded.error",
+                (paper_id, model, state, PRIORITY_SEARCH, now, now, error)
+            )
+
+    def fail(self, paper_id: str, model: str, error: str):
+        """Puts the job back in the queue, or marks it failed once it has used up its attempts."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, updated = ?, "
+                "error = ? WHERE paper_id = ? AND model = ?",
+                (self.max_attempts, time.time(), error[:500], paper_id, model)
+            )
+
+    def counts(self, model: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs WHERE model = ? GROUP BY state", (model,))
+            return dict(rows.fetchall())
+
+
+class SummaryWorker:
+    """
+    Writes query-independent summaries ahead of time, so a later search (for any query) can show them at once.
+
+    A search writes the summaries it gets to itself (see SearchPipeline) and queues the papers it didn't reach
+    when it ends, so the work isn't lost if the tab is closed. Worker threads summarize those at the lowest LLM
+    priority, which the scheduler only grants while no search or chat is waiting, and store the results in the
+    paper store by paperId and model.
+
+    Args:
+        llm (LocalLLM): Writes the summaries; its model is part of the key.
+        store (PaperStore): Where the papers are read from and the summaries saved.
+        jobs (SummaryJobs): The durable queue.
+        workers (int): Summaries written at once.
+        poll_interval (float): Seconds between checks for jobs queued by another process.
+    """
+
+    def __init__(self, llm: LocalLLM, store: PaperStore, jobs: SummaryJobs, workers: int = 1,
+                 poll_interval: float = 5.0):
+        self.llm = llm
+        self.model = llm.model
+        self.store = store
+        self.jobs = jobs
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.ctx = RequestContext("summary-worker", self.stopped)
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"summary-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        # Also drops any summary still waiting for an LLM slot; its job is picked up again after JOB_LEASE
+        self.stopped.set()
+        self.wakeup.set()
+
+    def enqueue(self, paper_ids: Iterable[str], priority: int = PRIORITY_SEARCH) -> int:
+        added = self.jobs.enqueue(paper_ids, self.model, priority)
+        if added:
+            self.wakeup.set()
+        return added
+
+    def get(self, paper_ids: Iterable[str]) -> Dict[str, str]:
+        """Stored summaries for this model, by paperId."""
+        return self.store.get_summaries(paper_ids, self.model)
+
+    def put(self, paper_id: str, summary: str):
+        """Stores a summary written elsewhere (by a search) and marks the paper's job done."""
+        self.store.put_summaries({paper_id: summary}, self.model)
+        self.jobs.finish(paper_id, self.model)
+
+    def run_once(self) -> bool:
+        """Summarizes the next queued paper. Returns False if there was nothing to do."""
+        paper_ids = self.jobs.claim(self.model)
+        if not paper_ids:
+            return False
+        paper_id = paper_ids[0]
+        if self.get([paper_id]):
+            # Summarized by a search since it was queued
+            self.jobs.finish(paper_id, self.model)
+            return True
+        paper = self.store.get_papers([paper_id]).get(paper_id)
+        if paper is None or not paper.get("abstract"):
+            self.jobs.finish(paper_id, self.model, "skipped", "no abstract")
+            return True
+        try:
+            summary = self.llm.summarize_paper_general(paper, self.ctx)
+        except LLMUnavailableError as e:
+            self.jobs.fail(paper_id, self.model, str(e))
+            # Ollama is down (the circuit breaker is open); don't spin through the queue meanwhile
+            self.stopped.wait(Config.BREAKER_RESET_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.exception(f"Background summary of {paper_id} failed: {e}")
+            self.jobs.fail(paper_id, self.model, str(e))
+            return True
+        if not summary:
+            # Cancelled by stop(), or an empty reply
+            self.jobs.fail(paper_id, self.model, "no summary")
+            return True
+        self.store.put_summaries({paper_id: summary}, self.model)
+        self.jobs.finish(paper_id, self.model)
+        return True
+
+    def drain(self):
+        """Works through the queue on `workers` threads and returns once it's empty. Used by presummarize.py."""
+        def work():
+            while not self.stopped.is_set() and self.run_once():
+                pass
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            try:
+                busy = self.run_once()
+            except sqlite3.Error as e:
+                logger.error(f"Summary queue unavailable: {e}")
+                busy = False
+            if not busy:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()